@@ -0,0 +1,82 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from api.services.ai_engine import HybridAIEngine
+from api.services.synthetic import sample_records, stored_records
+
+
+def parse_band(value):
+    low, high = (float(v) for v in value.split(':'))
+    if not 0 <= low <= high <= 1: raise ValueError(value)
+    return (low, high)
+
+
+class Command(BaseCommand):
+    help = "Validates LightGBM early-exit bands against the full stack: decision agreement and latency saved."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bands', nargs='+', type=parse_band, default=[(0.1, 0.9), (0.2, 0.8), (0.3, 0.7)],
+                            help="Uncertainty bands as low:high")
+        parser.add_argument('--rows', type=int, default=2000, help="Benchmark rows")
+        parser.add_argument('--source', choices=['auto', 'db', 'synthetic'], default='auto',
+                            help="Past sessions, synthetic forms, or sessions when at least --rows/2 exist")
+        parser.add_argument('--latency-rows', type=int, default=200, help="Rows timed one request at a time")
+
+    def decide(self, engine, X, disease_types):
+        """
+        Calibrated label + confidence per row, exactly as the pipeline decides them (no MRI).
+        """
+        failed = np.zeros(len(X), dtype=bool)
+        probs = engine._ensemble_proba(X, failed, [[d] for d in disease_types])
+        ml = engine.calibrate_prediction(engine._class_column(probs, disease_types), X, disease_types)
+        return engine._label(ml, disease_types)
+
+    def single_row_ms(self, engine, X, disease_types):
+        start = time.perf_counter()
+        for i in range(len(X)):
+            self.decide(engine, X[i:i + 1], disease_types[i:i + 1])
+        return (time.perf_counter() - start) / len(X) * 1000
+
+    def handle(self, *args, **options):
+        engine = HybridAIEngine()
+        engine.ensure_loaded('PV')
+        if 'lgbm' not in engine.models or not engine.models.keys() & {'rf', 'xgb'}:
+            raise CommandError("Early exit needs LightGBM plus at least one other tabular model")
+
+        # 1. Benchmark set: stored sessions, or synthetic forms scored as both AE and PV
+        records = []
+        if options['source'] != 'synthetic':
+            records = stored_records(options['rows'])
+            if options['source'] == 'auto' and len(records) < options['rows'] // 2: records = []
+            if options['source'] == 'db' and not records: raise CommandError("No stored sessions with clinical data")
+        source = 'sessions'
+        if not records:
+            source = 'synthetic'
+            forms = sample_records(engine, (options['rows'] + 1) // 2, np.random.default_rng(42))
+            records = [(form, d) for form in forms for d in ('AE', 'PV')][:options['rows']]
+        disease_types = [d for _, d in records]
+        X = engine.engineer_features([form for form, _ in records])
+        self.stdout.write(f"{len(X)} rows ({source}), models: {', '.join(sorted(engine.models))}")
+
+        # 2. Reference: the full stack for every row
+        engine.early_exit_band = None
+        ref_labels, ref_confs = self.decide(engine, X, disease_types)
+        lat = slice(0, min(options['latency_rows'], len(X)))
+        ref_ms = self.single_row_ms(engine, X[lat], disease_types[lat])
+        self.stdout.write(f"{'full stack':<12} {'':>10} {'':>10} {'':>12} {ref_ms:8.3f} ms/row")
+
+        # 3. Each band
+        lgb_probs = engine._base_proba('lgbm', X)
+        for band in options['bands']:
+            engine.early_exit_band = band
+            exits = engine._early_exits(lgb_probs, [[d] for d in disease_types], band).mean()
+            labels, confs = self.decide(engine, X, disease_types)
+            agreement = np.mean([a == b for a, b in zip(labels, ref_labels)])
+            conf_diff = np.abs(np.array(confs) - np.array(ref_confs)).mean()
+            ms = self.single_row_ms(engine, X[lat], disease_types[lat])
+            self.stdout.write(
+                f"{band[0]:.2f}-{band[1]:.2f}    exit {exits:6.1%}  agree {agreement:6.1%}  "
+                f"|Δconf| {conf_diff:5.2f}  {ms:8.3f} ms/row  saved {1 - ms / ref_ms:6.1%}"
+            )
+        engine.early_exit_band = None
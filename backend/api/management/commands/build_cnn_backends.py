@@ -0,0 +1,112 @@
+import glob
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import torch
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.services import cnn_backends
+from api.services.mri_preprocess import decode, normalize
+from api.services.ai_engine import HybridAIEngine, COMPILED_DIR
+
+
+class Command(BaseCommand):
+    help = "Builds and caches the CPU inference variants of the AE CNN, checks them against fp32 and picks the fastest."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', nargs='+', choices=cnn_backends.BACKENDS, default=list(cnn_backends.BACKENDS))
+        parser.add_argument('--images', default=os.path.join(settings.MEDIA_ROOT, getattr(settings, 'AI_MRI_STORE_DIR', 'mri')),
+                            help="Directory (searched recursively) of sample scans for calibration and the accuracy check")
+        parser.add_argument('--samples', type=int, default=64, help="Sample scans to use")
+        parser.add_argument('--tolerance', type=float, default=0.01, help="Max allowed AE probability difference vs fp32")
+        parser.add_argument('--no-save', action='store_true', help="Verify only, do not write ml_models/compiled/cnn/")
+
+    def sample_scans(self, directory, n):
+        """
+        Preprocessed scans from the directory; synthetic noise images top up a short sample set.
+        """
+        paths = sorted(p for p in glob.glob(os.path.join(directory, '**', '*'), recursive=True)
+                       if p.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')))[:n]
+        scans = []
+        for path in paths:
+            try:
+                scans.append(torch.from_numpy(normalize(decode(path))))
+            except OSError as e:
+                self.stderr.write(f"    skipping {path}: {e}")
+        if len(scans) < n:
+            self.stderr.write(self.style.WARNING(
+                f"Only {len(scans)} scans in {directory}; padding with {n - len(scans)} synthetic images "
+                "(int8_static calibration is only as good as its sample set)"
+            ))
+            rng = np.random.default_rng(42)
+            noise = rng.integers(0, 256, (n - len(scans), 224, 224, 3), dtype=np.uint8)
+            scans.extend(torch.from_numpy(normalize(img)) for img in noise)
+        return torch.stack(scans)
+
+    def handle(self, *args, **options):
+        engine = HybridAIEngine()
+        engine._ensure('cnn')
+        if engine.cnn_model is None:
+            raise CommandError("No CNN checkpoint in ml_models (ae_cnn_model.pth)")
+        model = engine.cnn_model.cpu()
+        cache_dir = os.path.join(COMPILED_DIR, 'cnn')
+
+        scans = self.sample_scans(options['images'], options['samples'])
+        # Calibrate int8_static on the first half, check every backend on all of them
+        calibration = scans[:max(1, len(scans) // 2)]
+        reference = cnn_backends.build(model, 'eager')(scans)
+
+        results = {}
+        for backend in options['backends']:
+            # 1. Build
+            start = time.perf_counter()
+            try:
+                variant = cnn_backends.build(model, backend, calibration=calibration)
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"{backend}: build failed ({e})"))
+                continue
+            build_s = time.perf_counter() - start
+
+            # 2. Accuracy against fp32 eager
+            diff = float((variant(scans) - reference).abs().max())
+
+            # 3. Latency: single scan and a batch of 8
+            single, batch = scans[:1], scans[:8]
+            variant(single)
+            start = time.perf_counter()
+            for _ in range(5): variant(single)
+            single_ms = (time.perf_counter() - start) / 5 * 1000
+            start = time.perf_counter()
+            for _ in range(3): variant(batch)
+            batch_ms = (time.perf_counter() - start) / 3 / len(batch) * 1000
+
+            ok = diff <= options['tolerance']
+            results[backend] = {'max_abs_diff': diff, 'ms_single': round(single_ms, 2),
+                                'ms_per_scan': round(batch_ms, 2), 'ok': ok}
+            line = (f"{backend:<14} built in {build_s:5.1f} s   max |diff| {diff:.2e}   "
+                    f"1 scan: {single_ms:7.1f} ms   batched: {batch_ms:7.1f} ms/scan")
+            self.stdout.write(line if ok else self.style.WARNING(line + "   (over tolerance)"))
+
+            if not options['no_save']:
+                cnn_backends.save(variant, cache_dir)
+
+        if not results:
+            raise CommandError("No backend could be built")
+        recommended = cnn_backends.recommend(results, options['tolerance'])
+        self.stdout.write(self.style.SUCCESS(f"Fastest within {options['tolerance']}: {recommended}"))
+
+        if not options['no_save']:
+            cnn_backends.write_report(cache_dir, {
+                'source': engine._source_stamp(engine.cnn_path),
+                'built_at': datetime.now().isoformat(timespec='seconds'),
+                'torch': torch.__version__,
+                'quantized_engine': torch.backends.quantized.engine,
+                'samples': len(scans),
+                'tolerance': options['tolerance'],
+                'backends': results,
+                'recommended': recommended,
+            })
+            self.stdout.write(self.style.SUCCESS(f"    saved to {cache_dir} (AI_CNN_BACKEND = 'auto' picks {recommended})"))
@@ -0,0 +1,80 @@
+import os
+import time
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from api.services.ai_engine import HybridAIEngine, COMPILED_DIR
+from api.services.tree_compiler import native_predict_proba
+
+
+def sample_rows(forest, n, rng):
+    """
+    Synthetic rows that exercise every split: values spread around each feature's
+    thresholds, some landing exactly on a threshold, some missing.
+    """
+    n_nodes = len(forest.feature)
+    internal = forest.children[:, 0] != np.arange(n_nodes)
+    width = max(len(forest.feature_names), int(forest.feature[internal].max()) + 1)
+
+    X = np.zeros((n, width))
+    for f in range(width):
+        thr = np.asarray(forest.threshold[internal & (forest.feature == f)], dtype=np.float64)
+        if not len(thr): continue
+        X[:, f] = rng.uniform(thr.min() - 1, thr.max() + 1, n)
+        on_split = rng.random(n) < 0.1
+        X[on_split, f] = rng.choice(thr, on_split.sum())
+
+    X[rng.random(X.shape) < 0.05] = np.nan
+    return X
+
+
+class Command(BaseCommand):
+    help = "Compiles the XGBoost/LightGBM artifacts into array-backed forests and checks them against the boosters."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help="Synthetic rows for the booster comparison")
+        parser.add_argument('--atol', type=float, default=1e-5, help="Max allowed probability difference")
+        parser.add_argument('--no-save', action='store_true', help="Verify only, do not write ml_models/compiled/")
+
+    def handle(self, *args, **options):
+        engine = HybridAIEngine()
+        engine.ensure_loaded('PV')
+        rng = np.random.default_rng(42)
+
+        for key in ('xgb', 'lgbm'):
+            if key not in engine.models: continue
+            booster = engine.models[key]
+
+            start = time.perf_counter()
+            forest = engine.compile_forest(key)
+            compile_ms = (time.perf_counter() - start) * 1000
+
+            # 1. Accuracy against the original booster
+            X = sample_rows(forest, options['rows'], rng)
+            try:
+                diff = forest.verify(booster, X, atol=options['atol'])
+            except AssertionError as e:
+                raise CommandError(str(e))
+
+            # 2. Latency: single row and full batch
+            row = X[:1]
+            timings = {}
+            for name, fn in (('compiled', forest.predict_proba), ('native', lambda A: native_predict_proba(booster, A))):
+                fn(row)
+                start = time.perf_counter()
+                for _ in range(200): fn(row)
+                single_us = (time.perf_counter() - start) / 200 * 1e6
+                start = time.perf_counter()
+                fn(X)
+                timings[name] = (single_us, (time.perf_counter() - start) * 1000)
+
+            self.stdout.write(
+                f"{key}: {forest.meta['n_trees']} trees, {forest.meta['n_nodes']} nodes, depth {forest.max_depth}, "
+                f"compiled in {compile_ms:.0f} ms, max |diff| {diff:.2e} over {len(X)} rows"
+            )
+            for name, (single_us, batch_ms) in timings.items():
+                self.stdout.write(f"    {name:<8} 1 row: {single_us:8.1f} us   {len(X)} rows: {batch_ms:8.1f} ms")
+
+            if not options['no_save']:
+                forest.save(os.path.join(COMPILED_DIR, key))
+                self.stdout.write(self.style.SUCCESS(f"    saved to {os.path.join(COMPILED_DIR, key)}"))
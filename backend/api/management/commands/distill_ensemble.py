@@ -0,0 +1,112 @@
+import time
+from datetime import datetime
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from api.services import distillation
+from api.services.ai_engine import HybridAIEngine, MODEL_DIR
+from api.services.synthetic import sample_records, stored_records
+from api.services.tree_compiler import compile_booster
+
+
+class Command(BaseCommand):
+    help = "Distills the stacked ensemble into one small XGBoost model (the 'fast' tier) and reports its fidelity."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=50000, help="Training + holdout rows")
+        parser.add_argument('--source', choices=['auto', 'db', 'synthetic'], default='auto',
+                            help="Past sessions, synthetic forms, or sessions topped up with synthetic forms")
+        parser.add_argument('--holdout', type=float, default=0.2, help="Share of rows kept back for the fidelity report")
+        parser.add_argument('--trees', type=int, default=200, help="Boosting rounds")
+        parser.add_argument('--depth', type=int, default=4, help="Max tree depth")
+        parser.add_argument('--learning-rate', type=float, default=0.3)
+        parser.add_argument('--min-agreement', type=float, default=0.98,
+                            help="Lowest AE/PV decision agreement with the stack that still gets saved")
+        parser.add_argument('--latency-rows', type=int, default=200, help="Rows timed one request at a time")
+        parser.add_argument('--no-save', action='store_true', help="Report only, do not write ml_models/")
+
+    def records(self, engine, options):
+        """
+        Intake forms to label: stored sessions, synthetic forms over the training ranges, or both.
+        """
+        forms = []
+        if options['source'] != 'synthetic':
+            forms = [form for form, _ in stored_records(options['rows'])]
+            if options['source'] == 'db' and not forms: raise CommandError("No stored sessions with clinical data")
+        sessions = len(forms)
+        if options['source'] != 'db' and len(forms) < options['rows']:
+            forms += sample_records(engine, options['rows'] - len(forms), np.random.default_rng(42))
+        return forms, sessions
+
+    def decisions(self, engine, probs, X):
+        """
+        Calibrated AE and PV labels, exactly as the pipeline decides them (no MRI).
+        """
+        return {
+            d: engine._label(engine.calibrate_prediction(probs[:, engine.class_index[d]], X, d), [d] * len(X))[0]
+            for d in ('AE', 'PV')
+        }
+
+    def ms_per_row(self, predict, X):
+        start = time.perf_counter()
+        for i in range(len(X)):
+            predict(X[i:i + 1])
+        return (time.perf_counter() - start) / len(X) * 1000
+
+    def handle(self, *args, **options):
+        engine = HybridAIEngine()
+        engine._ensure('tabular')
+        engine.early_exit_band = None
+        if not engine.models.keys() & {'rf', 'xgb', 'lgbm'}:
+            raise CommandError("No tabular models in ml_models to distill")
+        if len(engine.class_index) < 3:
+            raise CommandError("Distillation expects the 3-class (AE/PV/Normal) stack")
+
+        # 1. Teacher labels: the stack's soft outputs
+        forms, sessions = self.records(engine, options)
+        X = engine.engineer_features(forms)
+        failed = np.zeros(len(X), dtype=bool)
+        teacher = engine._stack_proba(X, failed)
+        if failed.any(): raise CommandError("The stack failed on the training rows (see the log)")
+        self.stdout.write(f"{len(X)} rows ({sessions} from sessions, {len(X) - sessions} synthetic), "
+                          f"teacher: {', '.join(k for k in ('rf', 'xgb', 'lgbm', 'meta') if k in engine.models)}")
+
+        # 2. Student
+        order = np.random.default_rng(0).permutation(len(X))
+        n_hold = max(1, int(len(X) * options['holdout']))
+        hold, train = order[:n_hold], order[n_hold:]
+        start = time.perf_counter()
+        student = distillation.train_student(X[train], teacher[train], engine.schema.columns, options['trees'],
+                                             options['depth'], options['learning_rate'])
+        self.stdout.write(f"Trained {options['trees']} trees (depth {options['depth']}) in {time.perf_counter() - start:.1f} s")
+
+        # 3. Fidelity on the holdout rows
+        forest = compile_booster(student)
+        student_probs = forest.predict_proba(X[hold]) * distillation.output_scale(student)
+        report = distillation.fidelity(student_probs, teacher[hold])
+        ref, got = self.decisions(engine, teacher[hold], X[hold]), self.decisions(engine, student_probs, X[hold])
+        report['decision_agreement'] = {d: round(float(np.mean(np.array(ref[d]) == np.array(got[d]))), 5) for d in ref}
+
+        lat = X[hold][:options['latency_rows']]
+        report['stack_ms_per_row'] = round(self.ms_per_row(lambda x: engine._stack_proba(x, np.zeros(len(x), dtype=bool)), lat), 4)
+        report['student_ms_per_row'] = round(self.ms_per_row(forest.predict_proba, lat), 4)
+
+        self.stdout.write(f"    |Δp| mean {report['mean_abs_diff']}   max {report['max_abs_diff']}")
+        self.stdout.write(f"    top class agree {report['top_class_agreement']:.2%}   decisions agree "
+                          + "   ".join(f"{d} {a:.2%}" for d, a in report['decision_agreement'].items()))
+        self.stdout.write(f"    latency: stack {report['stack_ms_per_row']:.3f} ms/row   "
+                          f"student {report['student_ms_per_row']:.3f} ms/row")
+
+        if options['no_save']: return
+        worst = min(report['decision_agreement'].values())
+        if worst < options['min_agreement']:
+            raise CommandError(f"Decision agreement {worst:.2%} is below --min-agreement {options['min_agreement']:.2%}; not saved")
+        path = distillation.save(student, {
+            'teacher': {key: engine._source_stamp(p) for key, p in engine.model_paths.items() if key != 'fast'},
+            'trained_at': datetime.now().isoformat(timespec='seconds'),
+            'rows': {'train': len(train), 'holdout': len(hold), 'sessions': sessions},
+            'params': {'trees': options['trees'], 'depth': options['depth'], 'learning_rate': options['learning_rate']},
+            'fidelity': report,
+        }, MODEL_DIR)
+        self.stdout.write(self.style.SUCCESS(f"    saved to {path} (AI_MODEL_TIER = 'fast' or \"tier\": \"fast\" serves it)"))
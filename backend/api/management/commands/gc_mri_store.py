@@ -0,0 +1,78 @@
+import os
+import shutil
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.models import DiagnosticSession
+from api.services import mri_store, uploads
+from api.services.result_cache import file_digest
+
+
+class Command(BaseCommand):
+    help = ("Garbage-collects the content-addressed MRI store: expires stale resumable uploads, recounts references, "
+            "deletes unreferenced scans and their Grad-CAM overlays.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=mri_store.GRACE_SECONDS,
+                            help="Seconds a scan must have been unreferenced before it is deleted")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be deleted, change nothing")
+        parser.add_argument('--adopt-legacy', action='store_true',
+                            help="Move scans uploaded before the store (mri_scans/) into it, merging duplicates")
+        parser.add_argument('--orphans', action='store_true', help="Also delete store files that have no row")
+
+    def adopt_legacy(self, dry_run):
+        """
+        Sessions whose scan predates the store: hash it, point the session at the stored copy, drop the duplicate.
+        """
+        adopted = merged = 0
+        for session in DiagnosticSession.objects.filter(mri_blob__isnull=True).exclude(mri_scan=''):
+            path = session.mri_scan.path
+            if not os.path.exists(path):
+                self.stderr.write(f"    session {session.id}: {session.mri_scan.name} is missing, skipped")
+                continue
+            if dry_run:
+                adopted += 1
+                continue
+            moved = []
+            blob = mri_store.add(file_digest(path), mri_store.extension(path), os.path.getsize(path),
+                                 lambda target: moved.append(shutil.move(path, target)))
+            session.mri_scan, session.mri_blob = blob.file.name, blob
+            session.save(update_fields=['mri_scan', 'mri_blob'])
+            if not moved:
+                os.remove(path) # The store already had this scan
+                merged += 1
+            adopted += 1
+        return adopted, merged
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        # 1. Legacy uploads
+        if options['adopt_legacy']:
+            adopted, merged = self.adopt_legacy(dry_run)
+            self.stdout.write(f"Adopted {adopted} legacy scan(s), {merged} of them duplicates")
+
+        # 2. Resumable uploads past their expiry (their partial files, or their reference on a finalized scan)
+        if not dry_run:
+            expired = uploads.expire()
+            if expired: self.stdout.write(f"Expired {expired} upload(s)")
+
+        # 3. References
+        if not dry_run:
+            drifted = mri_store.recount()
+            if drifted: self.stdout.write(f"♻️ Corrected {drifted} reference count(s)")
+
+        # 4. Unreferenced scans past the grace period
+        scans, freed, overlays = mri_store.collect(options['grace'], dry_run)
+        verb = "Would delete" if dry_run else "Deleted"
+        self.stdout.write(f"{verb} {scans} scan(s) ({freed / 1e6:.1f} MB) and {overlays} Grad-CAM overlay(s)")
+
+        # 5. Files without a row
+        if options['orphans']:
+            found = mri_store.orphans(options['grace'])
+            for path in found:
+                if not dry_run: os.remove(path)
+            self.stdout.write(f"{verb} {len(found)} orphaned file(s) under {os.path.join(settings.MEDIA_ROOT, mri_store.STORE_DIR)}")
+
+        if not dry_run: self.stdout.write(self.style.SUCCESS("MRI store collected"))
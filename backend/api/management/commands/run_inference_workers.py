@@ -0,0 +1,86 @@
+import multiprocessing
+import signal
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api.services import job_queue
+from api.services.ai_engine import get_engine
+
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _worker_main(index, poll_interval):
+    # Forked children inherit the parent's DB sockets; spawned ones need Django set up
+    django.setup()
+    connections.close_all()
+    try:
+        # Warm the models before claiming jobs, so the first job does not pay for lazy loading
+        get_engine().warm_up()
+        job_queue.work(job_queue.worker_name(index), poll_interval)
+    except KeyboardInterrupt:
+        pass
+
+
+class Command(BaseCommand):
+    help = "Runs a local pool of inference worker processes that drain the async diagnosis queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'AI_INFERENCE_WORKERS', 2))
+        parser.add_argument('--poll', type=float, default=0.5, help="Seconds between queue polls when idle")
+        parser.add_argument('--stale-after', type=int, default=600, help="Requeue 'running' jobs older than this (s)")
+        parser.add_argument('--once', action='store_true', help="Drain the queue in this process and exit")
+
+    def handle(self, *args, **options):
+        requeued, failed = job_queue.requeue_stale(options['stale_after'])
+        if requeued or failed:
+            self.stdout.write(f"♻️ Requeued {requeued} stale job(s), failed {failed}")
+
+        if options['once']:
+            worker = job_queue.worker_name()
+            done = 0
+            while True:
+                job = job_queue.claim_next(worker)
+                if job is None: break
+                if job_queue.process(job) is not None: done += 1
+            self.stdout.write(self.style.SUCCESS(f"Processed {done} job(s)"))
+            return
+
+        # 1. Start the pool (fork where available so children share the parent's imports)
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        connections.close_all()
+        signal.signal(signal.SIGTERM, _stop)
+        procs = {}
+
+        def start(index):
+            proc = ctx.Process(target=_worker_main, args=(index, options['poll']), daemon=True)
+            proc.start()
+            procs[index] = proc
+
+        for index in range(options['workers']):
+            start(index)
+        self.stdout.write(self.style.SUCCESS(f"🚀 {options['workers']} inference worker(s) running"))
+
+        # 2. Supervise: restart crashed workers, recover their jobs
+        try:
+            while True:
+                time.sleep(5)
+                for index, proc in list(procs.items()):
+                    if not proc.is_alive():
+                        self.stdout.write(f"⚠️ Worker {index} exited ({proc.exitcode}), restarting")
+                        start(index)
+                job_queue.requeue_stale(options['stale_after'])
+                connections.close_all()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for proc in procs.values():
+                proc.terminate()
+            for proc in procs.values():
+                proc.join(timeout=10)
@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-18 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_inferencejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnosticsession',
+            name='cnn_probability',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='diagnosticsession',
+            name='cnn_status',
+            field=models.CharField(blank=True, choices=[('scored', 'MRI Scored'), ('skipped', 'MRI Skipped (Tabular Decisive)')], max_length=10),
+        ),
+        migrations.AddField(
+            model_name='diagnosticsession',
+            name='tabular_probability',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
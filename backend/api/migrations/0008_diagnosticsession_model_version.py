@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_diagnosticsession_cnn_cascade'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnosticsession',
+            name='model_version',
+            field=models.CharField(blank=True, max_length=12),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_diagnosticsession_model_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnosticsession',
+            name='grad_cam_url',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='diagnosticsession',
+            name='shap_features',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 15:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_diagnosticsession_stream_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='diagnosticsession',
+            name='explanation_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Explanations Pending'), ('ready', 'Explanations Ready'), ('failed', 'Explanations Failed')], max_length=10),
+        ),
+    ]
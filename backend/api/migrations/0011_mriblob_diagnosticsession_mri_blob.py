@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-18 16:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_diagnosticsession_explanation_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MriBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(max_length=255, upload_to='')),
+                ('size', models.BigIntegerField(default=0)),
+                ('refcount', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('cnn_probability', models.FloatField(blank=True, null=True)),
+                ('cnn_version', models.CharField(blank=True, max_length=12)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='diagnosticsession',
+            name='mri_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='sessions', to='api.mriblob'),
+        ),
+    ]
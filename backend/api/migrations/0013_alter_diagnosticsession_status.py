@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_mriupload'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='diagnosticsession',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Analysis Running'), ('completed', 'AI Result Ready'), ('verified', 'Verified'), ('rejected', 'Rejected'), ('failed', 'Analysis Failed')], default='pending', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 17:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_alter_diagnosticsession_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inferencejob',
+            name='available_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_inferencejob_available_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='diagnosticsession',
+            name='cnn_status',
+            field=models.CharField(blank=True, choices=[('scored', 'MRI Scored'), ('skipped', 'MRI Skipped (Tabular Decisive)'), ('unavailable', 'MRI Not Scored (No CNN Model)'), ('failed', 'MRI Scoring Failed')], max_length=12),
+        ),
+    ]
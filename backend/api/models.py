@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.utils.timezone import now
@@ -40,7 +42,7 @@ class DoctorProfile(models.Model):
 # 3. Diagnostic Session
 class DiagnosticSession(models.Model):
     DISEASE_CHOICES = [('AE', 'Autoimmune Encephalitis'), ('PV', 'Pemphigus Vulgaris')]
-    STATUS_CHOICES = [('pending', 'Analysis Running'), ('completed', 'AI Result Ready'), ('verified', 'Verified'), ('rejected', 'Rejected')]
+    STATUS_CHOICES = [('pending', 'Analysis Running'), ('completed', 'AI Result Ready'), ('verified', 'Verified'), ('rejected', 'Rejected'), ('failed', 'Analysis Failed')]
 
     patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='diagnostic_sessions')
     disease_type = models.CharField(max_length=2, choices=DISEASE_CHOICES)
@@ -48,9 +50,26 @@ class DiagnosticSession(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     clinical_data = models.JSONField(default=dict) 
     mri_scan = models.ImageField(upload_to='mri_scans/', null=True, blank=True)
+    # The stored scan mri_scan points into (uploads before the MRI store have none)
+    mri_blob = models.ForeignKey('MriBlob', on_delete=models.PROTECT, null=True, blank=True, related_name='sessions')
     prediction_result = models.CharField(max_length=50, blank=True)
     confidence_score = models.FloatField(null=True, blank=True)
     ai_explanation_text = models.TextField(blank=True)
+
+    # AE + MRI: tabular score, and whether the CNN scored the scan or the cascade skipped it (scored on demand)
+    CNN_STATUS_CHOICES = [('scored', 'MRI Scored'), ('skipped', 'MRI Skipped (Tabular Decisive)'),
+                          ('unavailable', 'MRI Not Scored (No CNN Model)'), ('failed', 'MRI Scoring Failed')]
+    tabular_probability = models.FloatField(null=True, blank=True)
+    cnn_probability = models.FloatField(null=True, blank=True)
+    cnn_status = models.CharField(max_length=12, choices=CNN_STATUS_CHOICES, blank=True)
+    # Content version of the ml_models artifact set that produced the result
+    model_version = models.CharField(max_length=12, blank=True)
+    # Grad-CAM overlay and top SHAP features of the result (filled stage by stage when streamed)
+    grad_cam_url = models.CharField(max_length=255, blank=True)
+    shap_features = models.JSONField(default=list, blank=True)
+    # Whether they are computed yet: blank for results stored with them inline (see AI_EXPLANATIONS)
+    EXPLANATION_STATUS_CHOICES = [('pending', 'Explanations Pending'), ('ready', 'Explanations Ready'), ('failed', 'Explanations Failed')]
+    explanation_status = models.CharField(max_length=10, choices=EXPLANATION_STATUS_CHOICES, blank=True)
     
     # Store Grad-CAM path string if needed, though we generate on fly usually
     # Adding a field to persist it if we want to be safe
@@ -96,4 +115,66 @@ class ContactQuery(models.Model):
     is_resolved = models.BooleanField(default=False)
 
     def __str__(self):
-        return f"Query from {self.first_name} {self.last_name}"
\ No newline at end of file
+        return f"Query from {self.first_name} {self.last_name}"
+
+# 7. Inference Queue (async predictions, drained by `manage.py run_inference_workers`)
+class InferenceJob(models.Model):
+    STATUS_CHOICES = [('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')]
+
+    session = models.OneToOneField(DiagnosticSession, on_delete=models.CASCADE, related_name='job')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', db_index=True)
+    stage = models.CharField(max_length=50, blank=True)
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    # Response extras that are not stored on the session (grad_cam, shap_features)
+    result = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # A job admission control turned away waits in the queue until then
+    available_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+
+    def __str__(self):
+        return f"Job {self.session_id}: {self.status}"
+
+# 8. Content-Addressed MRI Store (one file per distinct scan, shared by every session that uploaded it)
+class MriBlob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(max_length=255)
+    size = models.BigIntegerField(default=0)
+    # Sessions holding the scan; `manage.py gc_mri_store` recounts it and deletes scans left at 0 (-1 while deleting)
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=now, db_index=True)
+    # CNN probability of the scan and the CNN build that produced it (engine.cnn_version)
+    cnn_probability = models.FloatField(null=True, blank=True)
+    cnn_version = models.CharField(max_length=12, blank=True)
+
+    def __str__(self):
+        return f"MRI {self.sha256[:12]} ({self.refcount} refs)"
+
+# 9. Resumable MRI Uploads (tus-style: create, append chunks, finalize into the MRI store, attach to a session)
+class MriUpload(models.Model):
+    STATUS_CHOICES = [('uploading', 'Uploading'), ('complete', 'Complete'), ('attached', 'Attached'), ('failed', 'Failed')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='mri_uploads')
+    filename = models.CharField(max_length=255, blank=True)
+    length = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    # Expected sha256 (hex) of the whole scan, checked on finalize
+    checksum = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='uploading', db_index=True)
+    # Set while a chunk is being written: one writer per upload
+    locked_at = models.DateTimeField(null=True, blank=True)
+    # The stored scan once finalized; the upload holds one reference on it until a session takes it over
+    blob = models.ForeignKey(MriBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='uploads')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Upload {self.id} ({self.offset}/{self.length} bytes, {self.status})"
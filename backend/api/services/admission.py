@@ -0,0 +1,206 @@
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .telemetry import count, observe
+
+# Model families a prediction can hold a slot in, always acquired in this order (no lock-order deadlocks)
+FAMILIES = ('tabular', 'cnn')
+# Requests running at once per family and process; 0 = unlimited
+MAX_CONCURRENCY = getattr(settings, 'AI_MAX_CONCURRENCY', {'tabular': 8, 'cnn': 8})
+# Requests allowed to wait for a slot per family (beyond that: 429), and how long they wait (then: 503)
+QUEUE_SIZE = getattr(settings, 'AI_ADMISSION_QUEUE', 32)
+QUEUE_TIMEOUT = getattr(settings, 'AI_ADMISSION_TIMEOUT', 10)
+# Server processes per host sharing the cores (gunicorn/uvicorn workers)
+SERVER_PROCESSES = getattr(settings, 'AI_SERVER_PROCESSES', 1)
+# Intra-op threads per torch / booster call; 0 = cores / (processes x permitted concurrency)
+TORCH_THREADS = getattr(settings, 'AI_TORCH_THREADS', 0)
+BOOSTER_THREADS = getattr(settings, 'AI_BOOSTER_THREADS', 0)
+
+
+class Overloaded(Exception):
+    """
+    A request was turned away: its family's wait queue was full (429) or it waited too long for a slot (503).
+    """
+    def __init__(self, family, reason, retry_after):
+        self.family = family
+        self.reason = reason
+        self.retry_after = retry_after
+        self.status = 429 if reason == 'queue_full' else 503
+        super().__init__(f"{family} inference is at capacity ({reason.replace('_', ' ')}), retry in {retry_after} s")
+
+
+class Slots:
+    """
+    Counting semaphore with a bounded FIFO wait queue. A released slot goes straight to the oldest waiter,
+    so a burst of new arrivals cannot overtake requests that are already queued.
+    """
+    def __init__(self, family, limit, queue_size, timeout):
+        self.family = family
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.admitted = self.rejected = 0
+        # Moving average of how long a request holds its slot (drives Retry-After)
+        self.hold_seconds = 0.0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        """
+        Seconds until the queue in front of a new request should have drained, 1..60.
+        """
+        if self.limit <= 0: return 1
+        return max(1, min(60, math.ceil(self.hold_seconds * (len(self._waiters) + 1) / self.limit)))
+
+    def acquire(self):
+        """
+        Takes a slot, waiting in line if needed. Returns the seconds spent waiting; raises Overloaded.
+        """
+        with self._lock:
+            if self.limit <= 0 or (self.active < self.limit and not self._waiters):
+                self.active += 1
+                self.admitted += 1
+                count('immunoai_admission_total', family=self.family, outcome='admitted')
+                return 0.0
+            if len(self._waiters) >= self.queue_size:
+                self.rejected += 1
+                count('immunoai_admission_total', family=self.family, outcome='rejected_queue_full')
+                raise Overloaded(self.family, 'queue_full', self.retry_after())
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+
+        started = time.perf_counter()
+        granted = waiter.wait(self.timeout)
+        waited = time.perf_counter() - started
+        with self._lock:
+            # A release may hand the slot over between the timeout and this lock
+            if not granted and not waiter.is_set():
+                self._waiters.remove(waiter)
+                self.rejected += 1
+                count('immunoai_admission_total', family=self.family, outcome='rejected_timeout')
+                raise Overloaded(self.family, 'timeout', self.retry_after())
+            self.admitted += 1
+        count('immunoai_admission_total', family=self.family, outcome='queued')
+        observe('immunoai_admission_wait_seconds', waited, family=self.family)
+        return waited
+
+    def release(self, held_seconds=None):
+        with self._lock:
+            if held_seconds is not None:
+                self.hold_seconds = held_seconds if not self.hold_seconds else 0.8 * self.hold_seconds + 0.2 * held_seconds
+            if self._waiters:
+                self._waiters.popleft().set() # The slot changes hands, active stays the same
+            else:
+                self.active -= 1
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'active': self.active,
+            'waiting': len(self._waiters),
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'hold_ms': round(self.hold_seconds * 1000, 2),
+        }
+
+
+class InferenceGovernor:
+    """
+    Per-process admission control for model inference: each family runs at most MAX_CONCURRENCY requests,
+    QUEUE_SIZE more wait up to QUEUE_TIMEOUT seconds, everything else is rejected at once.
+    """
+    def __init__(self, limits=None, queue_size=QUEUE_SIZE, timeout=QUEUE_TIMEOUT):
+        limits = limits if limits is not None else MAX_CONCURRENCY
+        self.slots = {f: Slots(f, limits.get(f, 0), queue_size, timeout) for f in FAMILIES}
+
+    @contextmanager
+    def admit(self, *families):
+        """
+        Holds one slot in each family for the duration of the block (acquired in FAMILIES order).
+        """
+        held, started = [], None
+        try:
+            for family in FAMILIES:
+                if family in families:
+                    self.slots[family].acquire()
+                    held.append(family)
+            started = time.perf_counter()
+            yield
+        finally:
+            elapsed = time.perf_counter() - started if started is not None else None
+            for family in reversed(held):
+                self.slots[family].release(elapsed)
+
+    def stats(self):
+        return {family: slots.stats() for family, slots in self.slots.items()}
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # A forked worker must not inherit the parent's slot counts or a lock held mid-release
+    global _governor, _governor_lock
+    _governor = None
+    _governor_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_governor():
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                _governor = InferenceGovernor()
+    return _governor
+
+
+def admit(*families):
+    return get_governor().admit(*families)
+
+
+# --- THREAD BUDGET ---
+
+def thread_budget(family, concurrency=None):
+    """
+    Intra-op threads per call for a family: the cores split over every process and every request
+    the governor lets run at once, so a full house never oversubscribes the CPUs.
+    """
+    configured = TORCH_THREADS if family == 'cnn' else BOOSTER_THREADS
+    if configured: return configured
+    if concurrency is None: concurrency = MAX_CONCURRENCY.get(family, 0) or (os.cpu_count() or 1)
+    return max(1, (os.cpu_count() or 1) // (max(1, SERVER_PROCESSES) * max(1, concurrency)))
+
+
+def configure_torch(concurrency=None):
+    """
+    Sets torch's intra-op thread count for this process (torch must already be imported). Returns it.
+    """
+    torch = sys.modules.get('torch')
+    if torch is None: return None
+    threads = thread_budget('cnn', concurrency)
+    if torch.get_num_threads() != threads:
+        torch.set_num_threads(threads)
+    return threads
+
+
+def threads_in_use():
+    """
+    Current intra-op thread settings, for the metrics endpoint.
+    """
+    torch = sys.modules.get('torch')
+    return {
+        'torch': torch.get_num_threads() if torch is not None else None,
+        'booster': thread_budget('tabular'),
+    }
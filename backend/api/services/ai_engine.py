@@ -1,51 +1,122 @@
 import os
-import joblib
-import pandas as pd
-import numpy as np
-import torch
-import torch.nn as nn
-import torchvision.models as models
-import torchvision.transforms as transforms
-import cv2
-import shap
 import json
-import traceback
-import xgboost as xgb
-from PIL import Image
+import logging
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
 from django.conf import settings
-from torch.nn import functional as F
+
+from .feature_schema import FeatureSchema
+from .tree_compiler import CompiledForest, compile_booster, native_predict_proba
+from .contributions import native_contributions, supports_native, top_features
+from .result_cache import ResultCache, file_digest, result_key
+from .telemetry import count, observe, span
+from .stages import submit, submit_to
+from .batching import MicroBatcher
+from .mri_preprocess import MRIPreprocessor
+from . import admission, artifacts, distillation
+
+# Heavy libraries (torch, torchvision, shap, cv2, xgboost, lightgbm, pandas) are imported
+# inside the loaders that need them, so importing this module stays cheap.
+
+logger = logging.getLogger(__name__)
 
 # Configuration
 MODEL_DIR = os.path.join(settings.BASE_DIR, 'ml_models')
+COMPILED_DIR = os.path.join(MODEL_DIR, 'compiled')
 MEDIA_ROOT = settings.MEDIA_ROOT
+# 'compiled' (array-backed forests), 'native' (booster APIs) or 'verify' (both, native wins on mismatch)
+TREE_BACKEND = getattr(settings, 'AI_TREE_BACKEND', 'compiled')
+# Memory-map compiled forests and joblib arrays so every worker process shares one page-cache copy
+MMAP_MODE = 'r' if getattr(settings, 'AI_MMAP_MODELS', True) else None
+# Which model explains each disease type, first loaded one wins
+EXPLAINERS = getattr(settings, 'AI_EXPLAINERS', {'AE': ['lgbm', 'rf'], 'PV': ['xgb', 'lgbm', 'rf']})
+# shap_base_values.json uses the training notebook's model names
+BASE_VALUE_KEYS = {'rf': 'rf', 'xgb': 'xgb', 'lgbm': 'lgb'}
+# Memoized full results (0 disables either bound)
+RESULT_CACHE_SIZE = getattr(settings, 'AI_RESULT_CACHE_SIZE', 1024)
+RESULT_CACHE_TTL = getattr(settings, 'AI_RESULT_CACHE_TTL', 600)
+# Seconds between re-stats of ml_models for changed artifacts
+FINGERPRINT_CHECK_INTERVAL = 5
+# Hot reload: a changed artifact set is loaded and warmed in the background, then swapped in
+MODEL_AUTO_RELOAD = getattr(settings, 'AI_MODEL_AUTO_RELOAD', False)
+# Seconds the artifact set must stay unchanged before a reload loads it (lets multi-file copies finish)
+MODEL_RELOAD_SETTLE = getattr(settings, 'AI_MODEL_RELOAD_SETTLE', 2)
+# Concurrent MRI scans share one CNN forward pass: up to N scans, waiting at most this long for company
+CNN_BATCH_SIZE = getattr(settings, 'AI_CNN_BATCH_SIZE', 8)
+CNN_BATCH_WAIT_MS = getattr(settings, 'AI_CNN_BATCH_WAIT_MS', 5)
+# CNN inference build on CPU (see cnn_backends); 'auto' = fastest one `manage.py build_cnn_backends` accepted
+CNN_BACKEND = getattr(settings, 'AI_CNN_BACKEND', 'eager')
+# Decoded scans (224x224 RGB) kept in memory, keyed by file content (0 disables)
+MRI_CACHE_SIZE = getattr(settings, 'AI_MRI_CACHE_SIZE', 32)
+# CNN probabilities kept in memory per scan content and CNN build (duplicate uploads skip the CNN; 0 disables)
+SCAN_CACHE_SIZE = getattr(settings, 'AI_SCAN_CACHE_SIZE', 4096)
+# AE fusion: final = (1 - CNN_WEIGHT) * ml + CNN_WEIGHT * cnn
+CNN_WEIGHT = 0.3
+# Cascade: skip the CNN (and Grad-CAM) when no CNN output could move the fused AE score across 0.5
+CNN_CASCADE = getattr(settings, 'AI_CNN_CASCADE', False)
+# Early exit: LightGBM runs first; rows whose LightGBM probability falls outside this (low, high) band
+# skip RF, XGBoost and the meta-learner. None runs the full stack for every row.
+EARLY_EXIT_BAND = getattr(settings, 'AI_EARLY_EXIT_BAND', None)
+# Default model tier: 'full' (stacked ensemble) or 'fast' (one booster distilled from it, `manage.py distill_ensemble`)
+MODEL_TIERS = ('full', 'fast')
+MODEL_TIER = getattr(settings, 'AI_MODEL_TIER', 'full')
+# Share of fast-tier rows the full stack re-scores in the background to watch the student's agreement (metrics only)
+FAST_VERIFY_RATE = getattr(settings, 'AI_FAST_VERIFY_RATE', 0.0)
 
-class AE_CNN_Model(nn.Module):
+class HybridAIEngine:
     """
-    Standard ResNet50 Classifier for Autoimmune Encephalitis.
+    Model families load lazily on first use: the tabular stack on the first prediction,
+    each SHAP explainer on the first explanation that needs it, the CNN on the first AE request with an MRI.
     """
-    def __init__(self):
-        super(AE_CNN_Model, self).__init__()
-        try:
-            from torchvision.models import ResNet50_Weights
-            resnet = models.resnet50(weights=ResNet50_Weights.DEFAULT)
-        except:
-            resnet = models.resnet50(weights=None)
-            
-        self.features = nn.Sequential(*list(resnet.children())[:-2]) 
-        self.avgpool = nn.AdaptiveAvgPool2d((1, 1))
-        self.fc = nn.Linear(2048, 2) 
-        
-    def forward(self, x):
-        x = self.features(x)
-        x = self.avgpool(x)
-        x = torch.flatten(x, 1)
-        x = self.fc(x)
-        return x
-
-class HybridAIEngine:
-    def __init__(self):
+    def __init__(self, version=None):
         self.models = {}
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.model_paths = {}
+        self.forests = {}
+        self.explainers = {}
+        self.schema = None
+        self.cnn_model = None
+        self.cnn_path = None
+        self.cnn_fast = None
+        # Checkpoint content + inference build: namespaces the per-scan caches and Grad-CAM files
+        self.cnn_version = None
+        self.device = None
+        self.mri_preprocess = MRIPreprocessor(MRI_CACHE_SIZE)
+        self._loaded = set()
+        self._load_lock = threading.RLock()
+        # Seconds per model family / per model artifact, and artifacts that exist but failed to load
+        self.load_seconds = {}
+        self.model_load_seconds = {}
+        self.load_errors = {}
+        self.warmup = {'state': 'pending', 'seconds': {}, 'errors': {}}
+        self._warmup_pid = None
+        self._warmup_lock = threading.Lock()
+        # Content version of the artifact set this engine serves (see the version property); construction only
+        # stats the files, a reload passes the version it already computed for the new set
+        self.signature = artifacts.stat_signature(MODEL_DIR)
+        self._version = version
+        self._artifacts_checked_at = time.monotonic()
+        self.result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+        # A scan's CNN probability cannot go stale under one cnn_version (part of the key): LRU plus a day's TTL
+        self.scan_scores = ResultCache(SCAN_CACHE_SIZE, ttl=24 * 3600)
+        # sha256 per scan file version (path, size, mtime): one request reads a scan's bytes for it at most once,
+        # and scans from the MRI store arrive with theirs (remember_digest)
+        self.scan_digests = ResultCache(4096, ttl=24 * 3600)
+        self.cnn_batcher = (
+            MicroBatcher(self._cnn_forward_batch, CNN_BATCH_SIZE, CNN_BATCH_WAIT_MS / 1000.0, name='cnn')
+            if CNN_BATCH_SIZE > 1 else None
+        )
+        # Class layout of the 3-class boosters and the screening cut-offs (overridden by model_metadata.json)
+        self.class_index = {'AE': 0, 'PV': 1, 'Normal': 2}
+        self.thresholds = {'high_confidence': 0.7, 'suspected': 0.3}
+        self.early_exit_band = EARLY_EXIT_BAND
+        self.tier = MODEL_TIER
+        self.fast_verify_rate = FAST_VERIFY_RATE
+        self.fast_scale = 1.0
+        self._verify_rng = np.random.default_rng()
+        # OpenMP threads per booster call: the cores shared by every request the governor admits at once
+        self.booster_threads = admission.thread_budget('tabular')
         
         # --- HARDCODED FEATURE SCHEMAS (Based on Error Logs) ---
         # 1. XGBoost explicit features (Includes Skin/Clinical symptoms)
@@ -64,480 +135,1555 @@ class HybridAIEngine:
             'imaging_score', 'age_x_csf'
         ]
 
-        # 3. Load Models
-        self._load_models()
-        self._load_explainers() # Renamed to handle multiple explainers
-        self._load_cnn()
+    # --- LAZY LOADING ---
 
-    def _load_models(self):
+    def _ensure(self, family):
+        """
+        Loads one model family exactly once, even under concurrent first requests.
+        """
+        if family in self._loaded: return
+        with self._load_lock:
+            if family in self._loaded: return
+            if family.startswith('explainer:'): self._ensure('tabular')
+            started = time.perf_counter()
+            with span('load', family=family):
+                if family == 'tabular':
+                    self._load_models()
+                    self._load_metadata()
+                    self._build_schema()
+                    self._compile_forests()
+                    self.version # Hashed with the files it describes, not on a later request
+                elif family == 'cnn':
+                    self._load_cnn()
+                elif family.startswith('explainer:'):
+                    self._load_explainer(family.split(':', 1)[1])
+            self.load_seconds[family] = round(time.perf_counter() - started, 4)
+            self._loaded.add(family)
+
+    @property
+    def version(self):
+        """
+        Short content hash of the artifact set (artifacts.content_version), computed once per engine: the same
+        scheme a reload compares against, so touched or identically re-copied files keep the version.
+        """
+        if self._version is None:
+            with self._load_lock:
+                if self._version is None:
+                    self._version = artifacts.content_version(MODEL_DIR, self.signature)
+        return self._version
+
+    @property
+    def fingerprint(self):
+        return self._fingerprint(self.version)
+
+    @staticmethod
+    def _fingerprint(version):
+        """
+        Result-cache namespace: the model version plus the settings that change results for the same models.
+        An engine never changes its models, so its cache is only invalidated by replacing the engine (a reload).
+        """
+        import hashlib
+
+        return hashlib.sha256(f"{TREE_BACKEND}|{sorted(EXPLAINERS.items())}|{version}".encode()).hexdigest()[:16]
+
+    def _check_artifacts(self):
+        """
+        Re-stats ml_models at most every FINGERPRINT_CHECK_INTERVAL seconds. When the process-wide engine
+        sees a changed set it starts a background reload and keeps serving until the new one is swapped in.
+        """
+        now = time.monotonic()
+        if now - self._artifacts_checked_at < FINGERPRINT_CHECK_INTERVAL: return
+        self._artifacts_checked_at = now
+        if not MODEL_AUTO_RELOAD or _engine is not self: return
         try:
-            # Random Forest
-            if os.path.exists(os.path.join(MODEL_DIR, 'rf_model.pkl')):
-                self.models['rf'] = joblib.load(os.path.join(MODEL_DIR, 'rf_model.pkl'))
-                print("✅ RF Model Loaded")
-
-            # XGBoost
-            if os.path.exists(os.path.join(MODEL_DIR, 'xgb_model.pkl')):
-                self.models['xgb'] = joblib.load(os.path.join(MODEL_DIR, 'xgb_model.pkl'))
-                print("✅ XGBoost Model Loaded")
-            elif os.path.exists(os.path.join(MODEL_DIR, 'xgb_model.json')):
-                self.models['xgb'] = xgb.Booster()
-                self.models['xgb'].load_model(os.path.join(MODEL_DIR, 'xgb_model.json'))
-                print("✅ XGBoost (JSON) Loaded")
-
-            # LightGBM
-            if os.path.exists(os.path.join(MODEL_DIR, 'lgb_model.pkl')):
-                self.models['lgbm'] = joblib.load(os.path.join(MODEL_DIR, 'lgb_model.pkl'))
-                print("✅ LightGBM Model Loaded")
-            elif os.path.exists(os.path.join(MODEL_DIR, 'lgb_model.txt')):
+            signature = artifacts.stat_signature(MODEL_DIR)
+        except OSError:
+            return
+        # A set that already failed to load is not retried until it changes again (or an admin forces it)
+        if signature != self.signature and signature != _reload['failed_signature']:
+            reload_engine()
+
+    def retire(self):
+        """
+        Called once this engine has been swapped out: requests still running on it finish normally.
+        """
+        if self.cnn_batcher is not None: self.cnn_batcher.close()
+
+    def ensure_loaded(self, disease_type=None, with_mri=False):
+        """
+        Loads everything a request for this disease type needs (all families if disease_type is None).
+        """
+        self._ensure('tabular')
+        if disease_type in (None, 'AE') and (with_mri or disease_type is None):
+            self._ensure('cnn')
+        if disease_type is None:
+            for key in dict.fromkeys([*(k for keys in EXPLAINERS.values() for k in keys), 'fast']):
+                if key in self.models: self._ensure(f'explainer:{key}')
+
+    def preload(self):
+        """
+        Loads every model family up front and prepares them for sharing with forked workers
+        (gunicorn --preload / uwsgi master): CNN weights go to shared memory, and the loaded
+        objects are moved out of the garbage collector's reach so it never dirties their pages.
+        """
+        import gc
+
+        self.ensure_loaded()
+        if self.cnn_model is not None and self.device.type == 'cpu':
+            self.cnn_model.share_memory()
+        gc.collect()
+        gc.freeze()
+        logger.info("✅ AI Engine preloaded for fork")
+
+    # --- WARM-UP / READINESS ---
+
+    def warm_up(self):
+        """
+        Loads every model family and runs synthetic inputs through each loaded model, so the first real
+        request does not pay for lazy allocations (kernel selection, booster caches, SHAP internals).
+        Nothing reaches the result cache or the prediction counters.
+        """
+        from .synthetic import sample_records
+
+        self._warmup_pid = os.getpid()
+        self.warmup = {'state': 'running', 'seconds': {}, 'errors': {}}
+        seconds, errors = self.warmup['seconds'], self.warmup['errors']
+        started = time.perf_counter()
+
+        def step(name, fn, *args):
+            step_started = time.perf_counter()
+            try:
+                fn(*args)
+            except Exception as e:
+                errors[name] = str(e)
+                logger.error(f"❌ Warm-up {name} failed: {e}")
+            seconds[name] = round(time.perf_counter() - step_started, 4)
+
+        # 1. Every model family
+        step('load', self.ensure_loaded)
+
+        # 2. Tabular pipelines per tier: one row, a mixed batch, multi-disease screening
+        if self.models.keys() & {'rf', 'xgb', 'lgbm'}:
+            X = self.engineer_features(sample_records(self, 8, np.random.default_rng(0)))
+            for tier in [t for t in MODEL_TIERS if t == 'full' or t in self.models]:
+                step(f'{tier}:single', self._warm_pipeline, self._run_pipeline, X[:1], ['AE'], [None], tier)
+                step(f'{tier}:batch', self._warm_pipeline, self._run_pipeline, X, ['AE', 'PV'] * 4, [None] * 8, tier)
+                step(f'{tier}:screening', self._warm_pipeline, self._run_screening, X, [None] * 8, tier)
+
+        # 3. CNN: forward + Grad-CAM backward at the batch sizes the batcher produces
+        if self.cnn_model is not None:
+            step('cnn', self._warm_cnn)
+
+        seconds['total'] = round(time.perf_counter() - started, 4)
+        self.warmup['state'] = 'failed' if errors else 'done'
+        if errors:
+            logger.warning(f"⚠️ AI Engine warm-up finished with errors in {', '.join(errors)}")
+        else:
+            logger.info(f"🔥 AI Engine warm in {seconds['total']:.2f} s")
+        return self.warmup
+
+    @staticmethod
+    def _warm_pipeline(run, *args):
+        _, failed = run(*args)
+        if failed.any(): raise RuntimeError("a stage fell back after an error")
+
+    def _warm_cnn(self):
+        import torch
+        import cv2 # Grad-CAM overlays
+        from .mri_preprocess import normalize
+
+        noise = np.random.default_rng(0).integers(0, 256, (224, 224, 3), dtype=np.uint8)
+        scan = torch.from_numpy(normalize(noise))
+        for n in sorted({1, max(1, CNN_BATCH_SIZE)}):
+            batch = torch.stack([scan] * n).to(self.device)
+            if self.cnn_fast is not None: self.cnn_fast(batch)
+            self._cnn_eager(batch, cam_rows=[0])
+
+    def start_warmup(self):
+        """
+        Runs warm_up() on a background thread, once per process (a forked worker warms its own copy).
+        """
+        with self._warmup_lock:
+            if self._warmup_pid == os.getpid(): return
+            self._warmup_pid = os.getpid()
+            self.warmup = {'state': 'running', 'seconds': {}, 'errors': {}}
+        threading.Thread(target=self.warm_up, name='engine-warmup', daemon=True).start()
+
+    def readiness(self):
+        """
+        Ready = warm-up finished without errors, no model artifact failed to load, and a tabular model is up.
+        """
+        ready = (self.warmup['state'] == 'done' and not self.load_errors
+                 and bool(self.models.keys() & {'rf', 'xgb', 'lgbm'}))
+        return {
+            'ready': ready,
+            'warmup': self.warmup,
+            'models': sorted(self.models),
+            'model_load_seconds': self.model_load_seconds,
+            'family_load_seconds': self.load_seconds,
+            'load_errors': self.load_errors,
+        }
+
+    def describe(self):
+        """
+        What this process has loaded, and whether it is backed by shared memory.
+        """
+        return {
+            'loaded': sorted(self._loaded),
+            'models': sorted(self.models),
+            'mmapped_forests': sorted(k for k, f in self.forests.items() if isinstance(f.threshold, np.memmap)),
+            'tier': self.tier,
+            'cnn_backend': self.cnn_fast.backend if self.cnn_fast is not None else ('eager' if self.cnn_model else None),
+            'cnn_shared': bool(self.cnn_model is not None and all(p.is_shared() for p in self.cnn_model.parameters())),
+            'version': self.version,
+            'fingerprint': self.fingerprint,
+            'result_cache': self.result_cache.stats(),
+            'mri_cache': self.mri_preprocess.stats(),
+            'scan_cache': self.scan_scores.stats(),
+            'cnn_version': self.cnn_version,
+            'admission': admission.get_governor().stats(),
+            'threads': admission.threads_in_use(),
+        }
+
+    def _load_models(self):
+        import joblib
+        import xgboost as xgb
+
+        self.model_paths = {}
+        # Uncompressed joblib dumps expose their numpy arrays as read-only memory maps
+        load = lambda path: joblib.load(path, mmap_mode=MMAP_MODE)
+
+        # Random Forest
+        if os.path.exists(os.path.join(MODEL_DIR, 'rf_model.pkl')):
+            with self._model_load('rf', os.path.join(MODEL_DIR, 'rf_model.pkl')) as path:
+                self.models['rf'] = load(path)
+                logger.info("✅ RF Model Loaded")
+
+        # XGBoost
+        if os.path.exists(os.path.join(MODEL_DIR, 'xgb_model.pkl')):
+            with self._model_load('xgb', os.path.join(MODEL_DIR, 'xgb_model.pkl')) as path:
+                self.models['xgb'] = load(path)
+                logger.info("✅ XGBoost Model Loaded")
+        elif os.path.exists(os.path.join(MODEL_DIR, 'xgb_model.json')):
+            with self._model_load('xgb', os.path.join(MODEL_DIR, 'xgb_model.json')) as path:
+                booster = xgb.Booster()
+                booster.load_model(path)
+                self.models['xgb'] = booster
+                logger.info("✅ XGBoost (JSON) Loaded")
+
+        # LightGBM
+        if os.path.exists(os.path.join(MODEL_DIR, 'lgb_model.pkl')):
+            with self._model_load('lgbm', os.path.join(MODEL_DIR, 'lgb_model.pkl')) as path:
+                self.models['lgbm'] = load(path)
+                logger.info("✅ LightGBM Model Loaded")
+        elif os.path.exists(os.path.join(MODEL_DIR, 'lgb_model.txt')):
+            with self._model_load('lgbm', os.path.join(MODEL_DIR, 'lgb_model.txt')) as path:
                 import lightgbm as lgb
-                self.models['lgbm'] = lgb.Booster(model_file=os.path.join(MODEL_DIR, 'lgb_model.txt'))
-                print("✅ LightGBM (TXT) Loaded")
-
-            # Meta Learner
-            if os.path.exists(os.path.join(MODEL_DIR, 'stacking_meta_learner.pkl')):
-                self.models['meta'] = joblib.load(os.path.join(MODEL_DIR, 'stacking_meta_learner.pkl'))
-                print("✅ Meta-Learner Loaded")
-                
+                self.models['lgbm'] = lgb.Booster(model_file=path)
+                logger.info("✅ LightGBM (TXT) Loaded")
+
+        # Meta Learner
+        if os.path.exists(os.path.join(MODEL_DIR, 'stacking_meta_learner.pkl')):
+            with self._model_load('meta', os.path.join(MODEL_DIR, 'stacking_meta_learner.pkl')) as path:
+                self.models['meta'] = load(path)
+                logger.info("✅ Meta-Learner Loaded")
+
+        # Distilled student (fast tier)
+        if os.path.exists(os.path.join(MODEL_DIR, distillation.MODEL_FILE)):
+            with self._model_load('fast', os.path.join(MODEL_DIR, distillation.MODEL_FILE)) as path:
+                booster = xgb.Booster()
+                booster.load_model(path)
+                self.fast_scale = distillation.output_scale(booster)
+                self.models['fast'] = booster
+                logger.info("✅ Distilled Model Loaded (fast tier)")
+            teacher = {key: self._source_stamp(path) for key, path in self.model_paths.items() if key != 'fast'}
+            if 'fast' in self.models and (distillation.read_report(MODEL_DIR) or {}).get('teacher') != teacher:
+                logger.warning("⚠️ Distilled model predates the current stack; re-run `manage.py distill_ensemble`")
+
+        for key, model in self.models.items():
+            self._limit_threads(key, model)
+
+    def _limit_threads(self, key, model):
+        """
+        Caps a model's own thread pool at the booster budget (native LightGBM boosters take it per call instead).
+        """
+        try:
+            if type(model).__module__.startswith('xgboost') and hasattr(model, 'set_param'):
+                model.set_param({'nthread': self.booster_threads})
+            elif hasattr(model, 'get_params') and 'n_jobs' in model.get_params():
+                model.set_params(n_jobs=self.booster_threads)
         except Exception as e:
-            print(f"❌ Error loading tabular models: {e}")
+            logger.warning(f"⚠️ Could not set {key.upper()} thread count: {e}")
 
-    def _load_explainers(self):
-        self.explainers = {}
-        
-        # 1. RF Explainer (Best for AE / Tabular)
+    @contextmanager
+    def _model_load(self, key, path):
+        """
+        Loads one artifact: times it, and records a failure (the model stays out) instead of aborting the rest.
+        """
+        started = time.perf_counter()
+        self.load_errors.pop(key, None)
         try:
-            shap_path = os.path.join(MODEL_DIR, 'shap_explainer_rf.pkl')
+            yield path
+        except Exception as e:
+            self.models.pop(key, None)
+            # First line only: native loaders append their whole stack trace
+            self.load_errors[key] = f"{os.path.basename(path)}: {str(e).strip().splitlines()[0] if str(e).strip() else type(e).__name__}"
+            logger.error(f"❌ Error loading {key.upper()} model: {self.load_errors[key]}")
+            return
+        self.model_paths[key] = path
+        self.model_load_seconds[key] = round(time.perf_counter() - started, 4)
+
+    @staticmethod
+    def _source_stamp(path):
+        stat = os.stat(path)
+        return {'file': os.path.basename(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+    def compile_forest(self, model_key):
+        """
+        Flattens one loaded booster into its array-backed form (see tree_compiler).
+        """
+        forest = compile_booster(self.models[model_key])
+        forest.meta['source'] = self._source_stamp(self.model_paths[model_key])
+        return forest
+
+    def _compile_forests(self):
+        """
+        Swaps the XGBoost/LightGBM booster APIs for compiled NumPy forests.
+        Tables prebuilt by `manage.py compile_forests` are reused when they match the artifact.
+        """
+        self.forests = {}
+        if TREE_BACKEND == 'native': return
+
+        for key in ('xgb', 'lgbm', 'fast'):
+            if key not in self.models: continue
+            try:
+                forest = None
+                cache_dir = os.path.join(COMPILED_DIR, key)
+                if os.path.exists(os.path.join(cache_dir, 'meta.json')):
+                    forest = CompiledForest.load(cache_dir, mmap_mode=MMAP_MODE)
+                    if forest.meta.get('source') != self._source_stamp(self.model_paths[key]):
+                        forest = None # Stale: artifact changed since compile
+                if forest is None:
+                    forest = self.compile_forest(key)
+                    if MMAP_MODE:
+                        # Persist once, then serve from the shared mapping instead of private heap arrays
+                        try:
+                            forest.save(cache_dir)
+                            forest = CompiledForest.load(cache_dir, mmap_mode=MMAP_MODE)
+                        except OSError as e:
+                            logger.warning(f"⚠️ {key.upper()} cache not written ({e}), keeping it in memory")
+
+                if forest.feature_names and list(forest.feature_names) != self.schema.names[key]:
+                    raise ValueError("feature order differs from the schema")
+                self.forests[key] = forest
+                logger.info(f"✅ {key.upper()} Compiled ({forest.meta['n_trees']} trees, depth {forest.max_depth})")
+            except Exception as e:
+                logger.warning(f"⚠️ {key.upper()} Compile Warning: {e} (using booster API)")
+
+    def _load_explainer(self, key):
+        """
+        Boosters explain themselves (native TreeSHAP contributions); anything else falls back to shap.
+        """
+        model = self.models.get(key)
+        if model is None: return
+
+        if supports_native(model):
+            self.explainers[key] = 'native'
+            self._check_base_values(key)
+            logger.info(f"✅ SHAP ({key.upper()}) Native contributions")
+            return
+
+        try:
+            import joblib
+            shap_path = os.path.join(MODEL_DIR, f'shap_explainer_{key}.pkl')
             if os.path.exists(shap_path):
-                self.explainers['rf'] = joblib.load(shap_path)
-                print("✅ SHAP (RF) Loaded from File")
-            elif 'rf' in self.models:
-                self.explainers['rf'] = shap.TreeExplainer(self.models['rf'])
-                print("✅ SHAP (RF) Initialized")
+                self.explainers[key] = joblib.load(shap_path)
+                logger.info(f"✅ SHAP ({key.upper()}) Loaded from File")
+            else:
+                import shap
+                self.explainers[key] = shap.TreeExplainer(model)
+                logger.info(f"✅ SHAP ({key.upper()}) Initialized")
         except Exception as e:
-            print(f"⚠️ SHAP (RF) Init Warning: {e}")
+            logger.warning(f"⚠️ SHAP ({key.upper()}) Init Warning: {e}")
 
-        # 2. XGB Explainer (Best for PV / Clinical)
-        # We try to load this to give better features for PV cases
+    def _check_base_values(self, key):
+        """
+        The bias column of the native contributions must match the training-time base values.
+        """
+        if key not in BASE_VALUE_KEYS: return
         try:
-            if 'xgb' in self.models:
-                self.explainers['xgb'] = shap.TreeExplainer(self.models['xgb'])
-                print("✅ SHAP (XGB) Initialized")
+            with open(os.path.join(MODEL_DIR, 'shap_base_values.json')) as f:
+                expected = json.load(f).get(BASE_VALUE_KEYS[key])
+            if expected is None: return
+            probe = np.zeros((1, len(self.schema.names[key])), dtype=np.float32)
+            bias = native_contributions(self.models[key], probe, self.booster_threads)[0, :, -1]
+            if len(bias) != len(expected) or not np.allclose(bias, expected, atol=1e-4):
+                logger.warning(f"⚠️ SHAP ({key.upper()}) base values differ from shap_base_values.json: {bias.tolist()}")
         except Exception as e:
-            print(f"⚠️ SHAP (XGB) Init Warning: {e}")
+            logger.warning(f"⚠️ SHAP ({key.upper()}) Base value check skipped: {e}")
 
     def _load_cnn(self):
         self.cnn_model = None
+        started = time.perf_counter()
         try:
             cnn_path = os.path.join(MODEL_DIR, 'ae_cnn_model.pth')
             if not os.path.exists(cnn_path): cnn_path = os.path.join(MODEL_DIR, 'fusion_ann.pth')
             
             if os.path.exists(cnn_path):
-                self.cnn_model = AE_CNN_Model().to(self.device)
+                import torch
+                from .cnn import AE_CNN_Model
+
+                # Micro-batched scans run one forward at a time on the batcher thread
+                admission.configure_torch(1 if self.cnn_batcher is not None else None)
+
+                self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+                model = AE_CNN_Model().to(self.device)
                 state_dict = torch.load(cnn_path, map_location=self.device)
-                self.cnn_model.load_state_dict(state_dict, strict=False)
-                self.cnn_model.eval()
-                print("✅ AE CNN Model Loaded")
+                missing, _ = model.load_state_dict(state_dict, strict=False)
+                if missing:
+                    logger.warning(f"⚠️ CNN checkpoint lacks {len(missing)} tensors; they stay randomly initialised")
+                model.eval()
+                self.cnn_model = model
+                self.cnn_path = cnn_path
+                self.model_load_seconds['cnn'] = round(time.perf_counter() - started, 4)
+                logger.info("✅ AE CNN Model Loaded")
+                self.cnn_fast = self._load_cnn_variant(model, cnn_path)
+                self.cnn_version = artifacts.file_version(cnn_path, self.cnn_fast.backend if self.cnn_fast is not None else 'eager')
         except Exception as e:
-            print(f"❌ CNN Load Error: {e}")
+            self.load_errors['cnn'] = str(e)
+            logger.error(f"❌ CNN Load Error: {e}")
 
-    def engineer_features(self, df):
+    def _load_cnn_variant(self, model, cnn_path):
         """
-        Master Feature Engineering - Generates SUPERSET of all possible features
+        Inference-only CNN build selected by AI_CNN_BACKEND; Grad-CAM keeps using the eager fp32 model.
+        Variants cached by `manage.py build_cnn_backends` are reused when they match the checkpoint.
         """
-        # 1. Base Columns
-        base_cols = [
-            'age', 'sex', 'seizures', 'memory_loss', 'psychiatric_symptoms',
-            'skin_blisters', 'mucosal_ulcers', 'pain_score', 'csf_protein',
-            'csf_cells', 'antibody_titer', 'dsg1_index', 'dsg3_index', 
-            'mri_abnormal', 'eeg_abnormal', 'tumor_status', 'infection_status'
-        ]
-        for col in base_cols:
-            if col not in df.columns: df[col] = 0
-
-        # 2. Derived Features
-        df['csf_protein_log'] = np.log1p(df['csf_protein'])
-        df['csf_cells_log'] = np.log1p(df['csf_cells'])
-        df['csf_inflammation'] = df['csf_protein'] * df['csf_cells']
-        df['csf_ratio'] = df['csf_protein'] / (df['csf_cells'] + 1)
-        df['imaging_score'] = df['mri_abnormal'] + df['eeg_abnormal']
-        df['age_x_csf'] = df['age'] * df['csf_protein']
-
-        df['neuro_score'] = df['seizures'] + df['memory_loss'] + df['psychiatric_symptoms']
-        df['skin_score'] = df['skin_blisters'] + df['mucosal_ulcers']
-        df['total_symptoms'] = df['neuro_score'] + df['skin_score']
-        df['clinical_contrast'] = df['neuro_score'] - df['skin_score']
-        df['pain_x_skin'] = df['pain_score'] * df['skin_score']
-        df['symptom_severity'] = df['total_symptoms'] * df['pain_score']
-
-        df['neuro_x_csf'] = df['neuro_score'] * df['csf_protein']
-        df['skin_x_pain'] = df['skin_score'] * df['pain_score']
-        df['csf_product'] = df['csf_protein'] * df['csf_cells'] 
-        
-        df['spurious_marker'] = 0 
-        
-        return df
+        from . import cnn_backends
+
+        if CNN_BACKEND == 'eager' or self.device.type != 'cpu': return None
+        cache_dir = os.path.join(COMPILED_DIR, 'cnn')
+        report = cnn_backends.read_report(cache_dir)
+        if report is not None and report.get('source') != self._source_stamp(cnn_path):
+            report = None # Stale: checkpoint changed since the build
 
-    def _prepare_input_for_model(self, df, model_key, fallback_cols=None):
+        backend = CNN_BACKEND
+        if backend == 'auto':
+            backend = (report or {}).get('recommended', 'eager')
+            if backend == 'eager': return None
+        try:
+            checked = (report or {}).get('backends', {}).get(backend)
+            if checked and not checked['ok']:
+                logger.warning(f"⚠️ CNN backend {backend} failed its accuracy check (max diff {checked['max_abs_diff']:.2e})")
+            if report is not None and os.path.exists(cnn_backends.artifact_path(cache_dir, backend)):
+                variant = cnn_backends.load(cache_dir, backend)
+            elif backend in cnn_backends.BUILD_ON_LOAD:
+                variant = cnn_backends.build(model, backend)
+            else:
+                raise ValueError("not built yet, run `manage.py build_cnn_backends`")
+        except Exception as e:
+            logger.warning(f"⚠️ CNN backend {backend} unavailable ({e}), using eager fp32")
+            return None
+        logger.info(f"✅ CNN backend: {backend}")
+        return variant
+
+    def _load_metadata(self):
+        """
+        Class mapping ("0": "AE (Autoimmune Encephalitis)", ...) and recommended thresholds from training.
+        """
+        import json
+
+        path = os.path.join(MODEL_DIR, 'model_metadata.json')
+        if not os.path.exists(path): return
+        try:
+            with open(path) as f:
+                meta = json.load(f)
+            mapping = meta.get('class_mapping') or {}
+            if mapping:
+                self.class_index = {name.split()[0]: int(idx) for idx, name in mapping.items()}
+            thresholds = meta.get('recommended_thresholds') or {}
+            self.thresholds.update({k: float(thresholds[k]) for k in ('high_confidence', 'suspected') if k in thresholds})
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"⚠️ Could not read model metadata: {e}")
+
+    def _model_columns(self, model_key, fallback_cols=None):
         """
         Strict feature alignment per model to prevent mismatch errors.
+        Returns the model's feature order, or None to feed every known feature.
         """
         model = self.models.get(model_key)
-        if not model: return None
-
         cols = []
-        
+
         # 1. Try to get features from model object
         if hasattr(model, 'feature_names_in_'):
             cols = list(model.feature_names_in_)
-        elif hasattr(model, 'feature_name'): # LightGBM/XGB Booster
+        elif hasattr(model, 'feature_name'): # LightGBM Booster
             cols = model.feature_name()
-        
+        elif getattr(model, 'feature_names', None): # XGBoost Booster
+            cols = list(model.feature_names)
+
         # 2. Use fallback if detection failed
         if not cols and fallback_cols:
             cols = fallback_cols
-            
-        # 3. If still no columns (e.g., LGBM), just use dataframe as is (risky but necessary)
-        if not cols:
-            return df
-
-        # 4. Filter/Order DataFrame
-        for c in cols:
-            if c not in df.columns:
-                df[c] = 0 # Impute missing columns
-        
-        return df[cols]
 
-    def generate_gradcam(self, image_path):
-        if not image_path or not self.cnn_model: return None
-        try:
-            img = Image.open(image_path).convert('RGB')
-            preprocess = transforms.Compose([
-                transforms.Resize((224, 224)),
-                transforms.ToTensor(),
-                transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-            ])
-            input_tensor = preprocess(img).unsqueeze(0).to(self.device)
-            input_tensor.requires_grad = True
-
-            # Define filename/path first
-            filename = f"gradcam_{os.path.basename(image_path)}"
-            save_path = os.path.join(MEDIA_ROOT, 'grad_cam', filename)
-            os.makedirs(os.path.dirname(save_path), exist_ok=True)
-
-            # --- PRE-CHECK: Prediction Probability ---
-            with torch.no_grad():
-                test_out = self.cnn_model(input_tensor)
-                probs = F.softmax(test_out, dim=1)
-                ae_prob = probs[0][1].item()
-            
-            # Prepare original image for saving (opencv format)
-            original_img = cv2.cvtColor(np.array(img.resize((224, 224))), cv2.COLOR_RGB2BGR)
+        # 3. If still no columns, the model sees the full feature superset
+        return cols or None
 
-            # If the model is less than 50% sure it's AE, return ORIGINAL IMAGE (Normal)
-            # This fixes "not displaying" while avoiding "red noise"
-            if ae_prob < 0.5:
-                cv2.imwrite(save_path, original_img)
-                return f"/media/grad_cam/{filename}"
-
-            # If AE (High Prob), Generate GradCAM
-            activations = []
-            gradients = []
-            def forward_hook(m, i, o): activations.append(o)
-            def backward_hook(m, gi, go): gradients.append(go[0])
-
-            target_layer = self.cnn_model.features[-1] 
-            h1 = target_layer.register_forward_hook(forward_hook)
-            h2 = target_layer.register_full_backward_hook(backward_hook)
-
-            output = self.cnn_model(input_tensor)
-            self.cnn_model.zero_grad()
-            score = output[:, 1]
-            score.backward()
-            h1.remove(); h2.remove()
-
-            grads = gradients[0].cpu().data.numpy()[0]
-            fmaps = activations[0].cpu().data.numpy()[0]
-            weights = np.mean(grads, axis=(1, 2))
-            cam = np.zeros(fmaps.shape[1:], dtype=np.float32)
-            for i, w in enumerate(weights): cam += w * fmaps[i]
-            cam = np.maximum(cam, 0)
-            if np.max(cam) > 0: cam = cam / np.max(cam)
-            
+    def _build_schema(self):
+        """
+        Compiles the feature layout once, right after the models load.
+        The meta-learner consumes the stacked probabilities, not the feature vector.
+        """
+        fallbacks = {'rf': self.rf_features_fallback, 'xgb': self.xgb_features, 'lgbm': None, 'fast': None}
+        model_columns = {
+            key: self._model_columns(key, fallback)
+            for key, fallback in fallbacks.items() if key in self.models
+        }
+        self.schema = FeatureSchema(model_columns)
+
+    def engineer_features(self, clinical_records):
+        """
+        Master Feature Engineering - vectorized kernel over the precompiled schema.
+        Only the derived features the loaded models (and the report) use are computed.
+        """
+        return self.schema.transform(clinical_records)
+
+    def _prepare_input_for_model(self, X, model_key):
+        """
+        Slices the model's columns out of the shared feature matrix.
+        """
+        model = self.models.get(model_key)
+        if not model: return None
+
+        X_model = self.schema.take(X, model_key)
+        if hasattr(model, 'feature_names_in_'):
+            import pandas as pd
+            # sklearn estimators fitted on DataFrames expect named columns
+            return pd.DataFrame(X_model, columns=self.schema.names[model_key])
+        return X_model
+
+    def gradcam_file(self, digest):
+        """
+        (path, URL) of the Grad-CAM overlay for a scan's sha256: one file per scan content and CNN build,
+        whatever the upload was called.
+        """
+        name = f"{digest[:2]}/{digest}-{self.cnn_version}.png"
+        return os.path.join(MEDIA_ROOT, 'grad_cam', name), f"/media/grad_cam/{name}"
+
+    def _save_gradcam(self, digest, rgb, cam=None):
+        """
+        Writes the Grad-CAM overlay on the 224x224 RGB scan (or the plain scan when cam is None) and returns its URL.
+        """
+        import cv2
+
+        save_path, url = self.gradcam_file(digest)
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
+
+        # Prepare original image for saving (opencv format)
+        original_img = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+        if cam is None:
+            image = original_img
+        else:
             heatmap = cv2.resize(cam, (224, 224))
             heatmap = np.uint8(255 * heatmap)
             heatmap_colored = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
-            
+
             # Superimpose
-            superimposed = cv2.addWeighted(heatmap_colored, 0.4, original_img, 0.6, 0)
-            cv2.imwrite(save_path, superimposed)
+            image = cv2.addWeighted(heatmap_colored, 0.4, original_img, 0.6, 0)
+
+        # Concurrent requests for the same scan write the same bytes; the rename keeps readers off partial files
+        tmp = f"{save_path}.tmp-{os.getpid()}-{threading.get_ident()}.png"
+        cv2.imwrite(tmp, image)
+        os.replace(tmp, save_path)
+        return url
+
+    def _predict_cnn(self, mri_path):
+        """
+        Fused CNN stage: one decode, one hooked forward pass (batched with concurrent scans).
+        Returns (cnn_prob, grad_cam_url); the backward pass only runs when the heatmap is drawn.
+        """
+        cnn_prob, scan = self._scan(mri_path)
+        return cnn_prob, self._draw_gradcam(cnn_prob, scan)
+
+    def _scan(self, mri_path, with_cam=True):
+        """
+        CNN probability of a scan, plus what _draw_gradcam needs: (digest, rgb, cam), or the URL of the
+        overlay already drawn for the same content (None when with_cam is False).
+        A scan seen before - same bytes, same CNN build - does not run the CNN again.
+        """
+        digest = self.scan_digest(mri_path)
+        key = f"{digest}:{self.cnn_version}"
+        cnn_prob = self.scan_scores.get(key)
+        if cnn_prob is not None:
+            path, url = self.gradcam_file(digest)
+            if not with_cam or os.path.exists(path):
+                count('immunoai_cnn_dedup_total')
+                return cnn_prob, url if with_cam else None
+
+        cnn_prob, rgb, cam = self._score_scan(mri_path, with_cam)
+        self.scan_scores.put(key, cnn_prob)
+        return cnn_prob, (digest, rgb, cam) if with_cam else None
+
+    def scan_digest(self, mri_path):
+        """
+        sha256 of a scan's content, hashed only the first time this version of the file is seen.
+        """
+        key = self._digest_key(mri_path)
+        digest = self.scan_digests.get(key)
+        if digest is None:
+            digest = file_digest(mri_path)
+            self.scan_digests.put(key, digest)
+        return digest
+
+    def remember_digest(self, mri_path, digest):
+        """
+        Records a scan's sha256 known elsewhere (the MRI store), so it is never recomputed from the file.
+        """
+        try:
+            self.scan_digests.put(self._digest_key(mri_path), digest)
+        except OSError:
+            pass # A missing scan fails in the CNN stage as before
+
+    @staticmethod
+    def _digest_key(mri_path):
+        stat = os.stat(mri_path)
+        return f"{mri_path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def remember_scan(self, digest, cnn_prob, cnn_version):
+        """
+        Seeds the scan cache with a probability stored elsewhere (the MRI store), if it came from this CNN build.
+        """
+        self._ensure('cnn')
+        if cnn_version and cnn_version == self.cnn_version:
+            self.scan_scores.put(f"{digest}:{cnn_version}", cnn_prob)
+
+    def _score_scan(self, mri_path, with_cam=True):
+        """
+        Decode + forward pass: (cnn_prob, rgb, cam or None).
+        with_cam=False skips the Grad-CAM backward pass (explanations deferred).
+        """
+        import torch
 
-            return f"/media/grad_cam/{filename}"
-        except: return None
+        with span('cnn_preprocess'):
+            scan, rgb = self.mri_preprocess(mri_path, self.scan_digest(mri_path))
+            input_tensor = torch.from_numpy(scan)
+
+        with span('cnn_forward'):
+            if self.cnn_batcher is not None:
+                cnn_prob, cam = self.cnn_batcher((input_tensor, with_cam))
+            else:
+                (cnn_prob, cam), = self._cnn_forward_batch([(input_tensor, with_cam)])
+        return cnn_prob, rgb, cam
 
-    def calculate_shap(self, df_processed, is_positive_prediction, disease_type='AE'):
+    def _draw_gradcam(self, cnn_prob, scan):
+        """
+        Grad-CAM URL for a scan from _scan(): the overlay already on disk, or drawn now.
+        """
+        if isinstance(scan, str): return scan
+        digest, rgb, cam = scan
+        with span('gradcam'):
+            # If the model is less than 50% sure it's AE, return ORIGINAL IMAGE (Normal)
+            # This fixes "not displaying" while avoiding "red noise"
+            if cnn_prob < 0.5:
+                return self._save_gradcam(digest, rgb)
+            if cam is None:
+                return None
+            return self._save_gradcam(digest, rgb, cam)
+
+    def _cnn_forward_batch(self, items):
+        """
+        One forward pass over a batch of (preprocessed scan, with_cam) items (through the AI_CNN_BACKEND build
+        when one is loaded), plus Grad-CAM maps for the with_cam scans the CNN calls AE.
+        Returns [(cnn_prob, cam or None)] in input order.
+        """
+        import torch
+
+        batch = torch.stack([tensor for tensor, _ in items]).to(self.device)
+        cam_mask = [with_cam for _, with_cam in items]
+        if self.cnn_fast is None:
+            return self._cnn_eager(batch, cam_mask=cam_mask)
+
+        probs = self.cnn_fast(batch).tolist()
+        cams = [None] * len(probs)
+        positive = [i for i, p in enumerate(probs) if p >= 0.5 and cam_mask[i]]
+        if positive:
+            # Grad-CAM needs autograd through the fp32 graph: only scans that get a heatmap take the eager pass
+            for i, (_, cam) in zip(positive, self._cnn_eager(batch[positive], cam_rows=range(len(positive)))):
+                cams[i] = cam
+        return list(zip(probs, cams))
+
+    def _cnn_eager(self, batch, cam_rows=None, cam_mask=None):
+        """
+        Hooked fp32 forward + Grad-CAM for cam_rows (default: the scans the CNN calls AE, among cam_mask if given).
+        A batch where no scan wants a map runs a plain no-grad forward.
+        """
+        import torch
+        import torch.nn.functional as F
+
+        if cam_rows is None and cam_mask is not None and not any(cam_mask):
+            with torch.no_grad():
+                return [(p, None) for p in F.softmax(self.cnn_model(batch), dim=1)[:, 1].tolist()]
+
+        # Hooks are shared by every thread using the model: keep only this thread's activations
+        activations, caller = [], threading.get_ident()
+        target_layer = self.cnn_model.features[-1]
+        hook = target_layer.register_forward_hook(
+            lambda m, i, o: activations.append(o) if threading.get_ident() == caller else None
+        )
+        try:
+            output = self.cnn_model(batch)
+        finally:
+            hook.remove()
+        probs = F.softmax(output.detach(), dim=1)[:, 1].tolist()
+
+        cams = [None] * len(probs)
+        positive = list(cam_rows) if cam_rows is not None else [
+            i for i, p in enumerate(probs) if p >= 0.5 and (cam_mask is None or cam_mask[i])
+        ]
+        if positive:
+            try:
+                # Rows are independent in eval mode: one backward of the summed AE logits
+                # gives every row the gradient of its own logit w.r.t. the last conv block
+                grads = torch.autograd.grad(output[positive, 1].sum(), activations[0])[0]
+                grads = grads[positive].cpu().numpy()
+                fmaps = activations[0].detach()[positive].cpu().numpy()
+                weights = np.mean(grads, axis=(2, 3))
+                for row, w, f in zip(positive, weights, fmaps):
+                    cam = np.maximum(np.tensordot(w, f, axes=1).astype(np.float32), 0)
+                    if np.max(cam) > 0: cam = cam / np.max(cam)
+                    cams[row] = cam
+            except Exception as e:
+                logger.warning(f"⚠️ Grad-CAM Error: {e}")
+        return list(zip(probs, cams))
+
+    def generate_gradcam(self, image_path):
+        if not image_path: return None
+        self._ensure('cnn')
+        if not self.cnn_model: return None
+        try:
+            return self._predict_cnn(image_path)[1]
+        except Exception: return None
+
+    def _shap_target(self, disease_type, tier='full'):
+        """
+        Selects the model that explains a disease type (see EXPLAINERS); the fast tier explains its own booster.
+        """
+        for key in (['fast'] if tier == 'fast' else EXPLAINERS.get(disease_type, EXPLAINERS['AE'])):
+            if key not in self.models: continue
+            self._ensure(f'explainer:{key}')
+            if key in self.explainers: return key
+        return None
+
+    def _contributions(self, model_key, X, disease_type):
+        """
+        Per-feature SHAP values for the disease's class, shape (rows, n_model_features).
+        """
+        explainer = self.explainers[model_key]
+        X_model = self._prepare_input_for_model(X, model_key)
+        # Multiclass: the disease's own class; binary: the positive class
+        pick = lambda n_classes: self.class_index.get(disease_type, 0) if n_classes > 2 else n_classes - 1
+
+        if explainer == 'native':
+            contribs = native_contributions(self.models[model_key], X_model, self.booster_threads)[:, :, :-1]
+            return contribs[:, pick(contribs.shape[1])]
+
+        # shap fallback: list per class, (rows, features, classes) or (rows, features)
+        shap_values = explainer.shap_values(X_model, check_additivity=False)
+        if isinstance(shap_values, list):
+            shap_values = shap_values[pick(len(shap_values))]
+        sv = np.asarray(shap_values)
+        if sv.ndim == 3: sv = sv[:, :, pick(sv.shape[2])]
+        return sv.reshape(len(X), -1)
+
+    def _format_shap_features(self, sv, indices, feature_names, feature_values):
+        """
+        Turns one row's top SHAP values into the UI feature cards.
+        """
+        features = []
+
+        for idx in indices:
+            impact = float(sv[idx])
+            if abs(impact) < 0.001: continue
+
+            name = str(feature_names[idx])
+            val = feature_values[idx]
+
+            direction = "Increased Risk" if impact > 0 else "Decreased Risk"
+
+            # --- CLINICAL OVERRIDE FOR UI CLARITY (WITH MEDICAL THRESHOLDS) ---
+            # Only force "Increased Risk" if the value is actually medically abnormal
+
+            if name == 'dsg1_index' and val > 20: direction = "Increased Risk"
+            elif name == 'dsg3_index' and val > 20: direction = "Increased Risk"
+            elif name == 'csf_protein' and val > 45: direction = "Increased Risk"
+            elif name == 'csf_cells' and val > 5: direction = "Increased Risk"
+            elif name in ['mucosal_ulcers', 'skin_blisters', 'seizures'] and val > 0: direction = "Increased Risk"
+
+            features.append({
+                "label": name,
+                "value": impact,
+                "display_value": min(100, abs(impact) * 50),
+                "raw_input": f"{val:.2f}",
+                "direction": direction
+            })
+
+        return features
+
+    def calculate_shap(self, X, disease_types, failed=None, tier='full'):
         """
         Calculates SHAP values dynamically based on Disease Type.
+        Rows sharing an explaining model are explained in a single call; returns one feature list per row.
+        Rows whose explanation errored are flagged in `failed` (bool array) when given.
+        """
+        results = [[] for _ in range(len(X))]
+
+        # 1. Group rows by disease type (and so by the model it selects)
+        groups = {}
+        for i, disease_type in enumerate(disease_types):
+            model_key = self._shap_target(disease_type, tier)
+            if model_key is not None: groups.setdefault((model_key, disease_type), []).append(i)
+
+        for (model_key, disease_type), rows in groups.items():
+            try:
+                # 2. Contributions + top-5 selection for the whole group at once
+                sv = self._contributions(model_key, X[rows], disease_type)
+                top = top_features(sv, 5)
+
+                feature_names = self.schema.names[model_key]
+                feature_values = self.schema.take(X[rows], model_key)
+                for pos, row in enumerate(rows):
+                    results[row] = self._format_shap_features(sv[pos], top[pos], feature_names, feature_values[pos])
+            except Exception as e:
+                logger.warning(f"⚠️ SHAP Calculation Error: {e}")
+                if failed is not None: failed[rows] = True
+
+        return results
+
+    def generate_explanation(self, results, confidences, rows, disease_types):
+        """
+        Builds the clinician-facing sentence for every row (rows are the engineered feature dicts).
+        """
+        explanations = []
+
+        for result, confidence, row, disease_type in zip(results, confidences, rows, disease_types):
+            if result == "Normal":
+                explanations.append(f"The AI analysis indicates a {confidence}% probability of Normal status.")
+                continue
+            reasons = []
+            if disease_type == 'AE':
+                if row['csf_protein'] > 45: reasons.append(f"high CSF protein ({row['csf_protein']} mg/dL)")
+                if row['seizures'] == 1: reasons.append("seizure activity")
+            elif disease_type == 'PV':
+                if row['dsg1_index'] > 20: reasons.append(f"elevated Dsg1 ({row['dsg1_index']})")
+                if row['dsg3_index'] > 20: reasons.append(f"elevated Dsg3 ({row['dsg3_index']})")
+            reason_str = ", ".join(reasons) if reasons else "clinical pattern matching"
+            explanations.append(f"The model predicts {result} ({confidence}% risk score) driven by {reason_str}.")
+
+        return explanations
+
+    def calibrate_prediction(self, ml_prob, X, disease_type):
         """
+        Clinical Guardrail - Overrides AI if biomarkers are definitively high.
+        Vectorized over rows; disease_type may be a single code or one per row.
+        """
+        col = lambda name: self.schema.column(X, name)
+        disease_type = np.broadcast_to(np.asarray(disease_type), (len(X),))
+        is_ae = disease_type == 'AE'
+        is_pv = disease_type == 'PV'
+        clinical_conf = np.zeros(len(X))
+
+        # AE: CSF protein, seizures and memory loss
+        clinical_conf += np.where(is_ae & (col('csf_protein') > 45), 35, 0)
+        clinical_conf += np.where(is_ae & (col('seizures') == 1), 25, 0)
+        clinical_conf += np.where(is_ae & (col('memory_loss') == 1), 20, 0)
+
+        # PV is driven heavily by Dsg1/Dsg3
+        clinical_conf += np.where(is_pv & (col('dsg1_index') > 20), 50, 0)
+        clinical_conf += np.where(is_pv & (col('dsg3_index') > 20), 30, 0)
+        clinical_conf += np.where(is_pv & (col('skin_blisters') == 1), 30, 0)
+        clinical_conf += np.where(is_pv & (col('mucosal_ulcers') == 1), 20, 0)
+
+        # If clinical signs are present, ensure we don't return less than their strength
+        # Normalize clinical_conf to max 0.99
+        clinical_prob = np.minimum(0.99, clinical_conf / 100.0)
+        return np.where(clinical_conf > 0, np.maximum(ml_prob, clinical_prob), ml_prob)
+
+    def _predict_proba(self, model_key, X):
+        """
+        Returns an (N, n_classes) probability matrix for compiled forests,
+        sklearn wrappers and native boosters alike.
+        """
+        forest = self.forests.get(model_key)
+        if forest is not None:
+            probs = forest.predict_proba(np.asarray(X))
+            if TREE_BACKEND == 'verify':
+                native = self._native_proba(model_key, X)
+                diff = float(np.max(np.abs(probs - native)))
+                if diff > 1e-5:
+                    logger.warning(f"⚠️ Compiled {model_key.upper()} diverges from booster by {diff:.2e}")
+                    return native
+            return probs
+        return self._native_proba(model_key, X)
+
+    def _native_proba(self, model_key, X):
+        model = self.models[model_key]
         try:
-            # 1. Select Explainer & Features based on Disease Type
-            explainer = None
-            cols = []
-            model_key = 'rf'
-
-            if disease_type == 'PV' and 'xgb' in self.explainers:
-                # Use XGB for PV as it contains skin/symptom features
-                explainer = self.explainers['xgb']
-                cols = self.xgb_features
-                model_key = 'xgb'
-            elif 'rf' in self.explainers:
-                # Default to RF for AE
-                explainer = self.explainers['rf']
-                cols = self.rf_features_fallback
-                model_key = 'rf'
-
-            if not explainer: return []
-
-            # 2. Prepare Input
-            X = self._prepare_input_for_model(df_processed, model_key, cols)
-            if X is None: return []
-
-            # 3. Calculate SHAP
-            shap_values = explainer.shap_values(X, check_additivity=False)
-            
-            sv = None
-            # Handle List output (common in classifiers)
-            if isinstance(shap_values, list):
-                idx = 1 if len(shap_values) > 1 else 0
-                sv = shap_values[idx]
-            elif isinstance(shap_values, np.ndarray):
-                sv = shap_values
-            
-            # Handle dimensions
-            if sv is not None:
-                if sv.ndim == 3: sv = sv[0,:,1] if sv.shape[2] > 1 else sv[0,:,0]
-                elif sv.ndim == 2: sv = sv[0] 
-            
-            if sv is None: return []
+            # Sklearn wrapper
+            probs = model.predict_proba(X)
+        except AttributeError:
+            # Native Booster
+            return native_predict_proba(model, X, self.booster_threads)
 
-            feature_names = X.columns.tolist()
-            feature_values = X.iloc[0]
-            features = []
-            
-            indices = np.argsort(np.abs(sv))[::-1][:5]
-            
-            for idx in indices:
-                impact = float(sv[idx])
-                if abs(impact) < 0.001: continue
-                
-                # Boundary check
-                if idx >= len(feature_names): continue
-
-                name = str(feature_names[idx])
-                val = feature_values.iloc[idx]
-                
-                direction = "Increased Risk" if impact > 0 else "Decreased Risk"
-                
-                # --- CLINICAL OVERRIDE FOR UI CLARITY (WITH MEDICAL THRESHOLDS) ---
-                # Only force "Increased Risk" if the value is actually medically abnormal
-                
-                if name == 'dsg1_index' and val > 20: direction = "Increased Risk"
-                elif name == 'dsg3_index' and val > 20: direction = "Increased Risk"
-                elif name == 'csf_protein' and val > 45: direction = "Increased Risk"
-                elif name == 'csf_cells' and val > 5: direction = "Increased Risk"
-                elif name in ['mucosal_ulcers', 'skin_blisters', 'seizures'] and val > 0: direction = "Increased Risk"
-
-                features.append({
-                    "label": name,
-                    "value": impact,
-                    "display_value": min(100, abs(impact) * 50),
-                    "raw_input": f"{val:.2f}",
-                    "direction": direction
-                })
-            
-            return features
+        probs = np.asarray(probs, dtype=np.float64)
+        if probs.ndim == 1:
+            # Native usually returns single float per row for binary
+            probs = np.column_stack([1 - probs, probs])
+        return probs
+
+    def _class_column(self, probs, disease_types):
+        """
+        Each row's probability for its own disease type, using the metadata class mapping.
+        Binary (2-column) models keep the old convention: column 1 is the positive class.
+        """
+        disease_types = np.broadcast_to(np.asarray(disease_types), (len(probs),))
+        cols = np.array([self._column_for(d, probs.shape[1]) for d in disease_types], dtype=np.intp)
+        return probs[np.arange(len(probs)), cols]
+
+    def _column_for(self, disease_type, width):
+        if width < 3: return width - 1
+        return self.class_index.get(disease_type, self.class_index['AE'])
+
+    @staticmethod
+    def _broadcast(values, n, default):
+        if values is None or isinstance(values, str):
+            return [values if values is not None else default] * n
+        values = list(values)
+        if len(values) != n:
+            raise ValueError(f"Expected {n} values, got {len(values)}")
+        return values
+
+    def predict_batch(self, clinical_records, disease_types=None, mri_paths=None, tier=None, explain=True):
+        """
+        Runs the full pipeline once over N patients.
+        disease_types / mri_paths may be a single value or one entry per record; tier is 'full' or 'fast' (default: AI_MODEL_TIER).
+        explain=False leaves out SHAP and Grad-CAM ("shap_features" [], "grad_cam" None; see explain()).
+        Returns one result dict per patient, in the same shape as predict().
+        Repeat submissions (same engineered features, disease, MRI content and models) come from the result cache.
+        """
+        n = len(clinical_records)
+        if n == 0: return []
+        disease_types = self._broadcast(disease_types, n, 'AE')
+        mri_paths = self._broadcast(mri_paths, n, None)
+        self._ensure('tabular')
+        tier = self._resolve_tier(tier)
+
+        with span('features'):
+            X = self.engineer_features(list(clinical_records))
+        run = lambda X, diseases, mri: self._run_pipeline(X, diseases, mri, tier, explain)
+        return self._memoized(X, disease_types, mri_paths, run, tier, explain)
+
+    def predict_all_batch(self, clinical_records, mri_paths=None, tier=None):
+        """
+        Screens every patient for AE and PV with ONE ensemble pass (the boosters are 3-class).
+        Returns predict()-shaped dicts plus calibrated "scores" {AE, PV, Normal} and a
+        "screening" status per disease from the metadata's recommended thresholds.
+        """
+        n = len(clinical_records)
+        if n == 0: return []
+        mri_paths = self._broadcast(mri_paths, n, None)
+        self._ensure('tabular')
+        tier = self._resolve_tier(tier)
+
+        with span('features'):
+            X = self.engineer_features(list(clinical_records))
+        return self._memoized(X, ['ALL'] * n, mri_paths, lambda X, _, mri: self._run_screening(X, mri, tier), tier)
+
+    def _resolve_tier(self, tier):
+        """
+        The tier a request runs on; 'fast' falls back to the full stack when no distilled model is loaded.
+        """
+        tier = tier or self.tier
+        if tier not in MODEL_TIERS:
+            raise ValueError(f"Unknown model tier '{tier}' (expected one of {', '.join(MODEL_TIERS)})")
+        if tier == 'fast' and 'fast' not in self.models:
+            logger.debug("⚠️ No distilled model, fast tier served by the full stack")
+            return 'full'
+        return tier
+
+    def _memoized(self, X, disease_types, mri_paths, run, tier='full', explain=True):
+        """
+        Serves rows from the result cache and sends the misses through run(X, disease_types, mri_paths).
+        Each tier, and results without explanations, have their own entries.
+        """
+        n = len(X)
+        results, keys = [None] * n, [None] * n
+        self._check_artifacts()
+        if self.result_cache.enabled:
+            with span('cache_lookup'):
+                for i, (disease_type, mri_path) in enumerate(zip(disease_types, mri_paths)):
+                    keys[i], results[i] = self._cache_lookup(X[i], disease_type, mri_path, tier, explain)
+
+        # Everything else goes through the models
+        misses = [i for i in range(n) if results[i] is None]
+        if len(misses) < n:
+            logger.debug("⚡ Result cache: %d/%d hit", n - len(misses), n)
+        if misses:
+            # Admission: a slot per model family the misses need (raises admission.Overloaded at capacity)
+            families = self._families([disease_types[i] for i in misses], [mri_paths[i] for i in misses])
+            with admission.admit(*families):
+                fresh, failed = run(X[misses], [disease_types[i] for i in misses], [mri_paths[i] for i in misses])
+            for pos, i in enumerate(misses):
+                results[i] = fresh[pos]
+                count('immunoai_predictions_total', disease=disease_types[i], source='model')
+                # Degraded results (a stage fell back after an error) are never memoized
+                if keys[i] is not None and not failed[pos]:
+                    self.result_cache.put(keys[i], fresh[pos])
+        return results
+
+    def _cache_lookup(self, x, disease_type, mri_path, tier, explain=True):
+        """
+        (key, cached result or None) for one engineered row; the key is None when the MRI cannot be read.
+        """
+        if not self.result_cache.enabled: return None, None
+        try:
+            uses_mri = disease_type in ('AE', 'ALL') and mri_path
+            mri_digest = self.scan_digest(mri_path) if uses_mri else None
+        except OSError:
+            return None, None
+        cache_disease = disease_type if tier == 'full' else f"{disease_type}:{tier}"
+        if not explain: cache_disease += ':unexplained'
+        key = result_key(x, cache_disease, mri_digest, self.fingerprint)
+        cached = self.result_cache.get(key)
+        # Overlays are content-addressed and shared, but `manage.py gc_mri_store` may have removed this one
+        if cached is not None and cached.get('grad_cam') and not os.path.exists(self.gradcam_path(cached['grad_cam'])):
+            cached = None
+        if cached is not None:
+            count('immunoai_predictions_total', disease=disease_type, source='cache')
+        return key, cached
+
+    @staticmethod
+    def _families(disease_types, mri_paths):
+        """
+        Model families (admission slots) a set of rows can need.
+        """
+        if any(d in ('AE', 'ALL') and p for d, p in zip(disease_types, mri_paths)): return ('tabular', 'cnn')
+        return ('tabular',)
+
+    @staticmethod
+    def gradcam_path(url):
+        return os.path.join(MEDIA_ROOT, 'grad_cam', url.split('/media/grad_cam/', 1)[-1])
+
+    def _base_proba(self, key, X):
+        with span(key):
+            return self._predict_proba(key, self._prepare_input_for_model(X, key))
+
+    def _ensemble_proba(self, X, failed, exit_for=None):
+        """
+        Base models + meta-learner over the feature matrix: (n, n_classes) class probabilities.
+        exit_for: per row, the disease types whose LightGBM probability must clear the early-exit band.
+        """
+        band = self.early_exit_band
+        if not band or exit_for is None or 'lgbm' not in self.models or not self.models.keys() & {'rf', 'xgb'}:
+            return self._stack_proba(X, failed)
+
+        # --- 0. EARLY EXIT: LIGHTGBM FIRST ---
+        try:
+            lgb_probs = self._base_proba('lgbm', X)
+        except Exception:
+            return self._stack_proba(X, failed)
+        decisive = self._early_exits(lgb_probs, exit_for, band)
+        count('immunoai_early_exit_total', int(decisive.sum()), outcome='exit')
+        count('immunoai_early_exit_total', int((~decisive).sum()), outcome='full_stack')
+        if decisive.all(): return lgb_probs
+
+        # Undecided rows take the full stack, reusing their LightGBM output
+        rest = np.flatnonzero(~decisive)
+        probs = lgb_probs.copy()
+        probs[rest] = self._stack_proba(X[rest], failed, lgb_probs=lgb_probs[rest])
+        return probs
+
+    def _early_exits(self, lgb_probs, exit_for, band):
+        """
+        Rows whose LightGBM probability for every listed disease lies outside the (low, high) band.
+        """
+        checked = self._checked_columns(lgb_probs, exit_for)
+        return ((checked < band[0]) | (checked > band[1])).all(axis=1)
+
+    def _checked_columns(self, probs, checks):
+        """
+        (n, k) probabilities of the k disease types listed per row.
+        """
+        cols = np.array([[self._column_for(d, probs.shape[1]) for d in types] for types in checks], dtype=np.intp)
+        return np.take_along_axis(probs, cols, axis=1)
+
+    def _tier_proba(self, X, failed, checks, tier):
+        """
+        Class probabilities from the requested tier. The fast tier falls back to the full stack if its
+        booster errors, and sends a FAST_VERIFY_RATE share of its rows to the stack in the background.
+        checks: per row, the disease types its result depends on.
+        """
+        if tier != 'fast': return self._ensemble_proba(X, failed, checks)
+        try:
+            probs = self._base_proba('fast', X) * self.fast_scale
         except Exception as e:
-            print(f"⚠️ SHAP Calculation Error: {e}")
-            return []
-
-    def generate_explanation(self, result, confidence, df, disease_type):
-        if result == "Normal":
-            return f"The AI analysis indicates a {confidence}% probability of Normal status."
-        row = df.iloc[0]
-        reasons = []
-        if disease_type == 'AE':
-            if row['csf_protein'] > 45: reasons.append(f"high CSF protein ({row['csf_protein']} mg/dL)")
-            if row['seizures'] == 1: reasons.append("seizure activity")
-        elif disease_type == 'PV':
-            if row['dsg1_index'] > 20: reasons.append(f"elevated Dsg1 ({row['dsg1_index']})")
-            if row['dsg3_index'] > 20: reasons.append(f"elevated Dsg3 ({row['dsg3_index']})")
-        reason_str = ", ".join(reasons) if reasons else "clinical pattern matching"
-        return f"The model predicts {result} ({confidence}% risk score) driven by {reason_str}."
-
-    def calibrate_prediction(self, ml_prob, df, disease_type):
+            logger.warning(f"⚠️ Fast tier error ({e}), using the full stack")
+            count('immunoai_stage_errors_total', stage='fast')
+            return self._ensemble_proba(X, failed, checks)
+
+        if self.fast_verify_rate > 0:
+            rows = np.flatnonzero(self._verify_rng.random(len(X)) < self.fast_verify_rate)
+            if len(rows): submit(self._verify_fast, X[rows], probs[rows], [checks[i] for i in rows])
+        return probs
+
+    def _verify_fast(self, X, fast_probs, checks):
         """
-        Clinical Guardrail - Overrides AI if biomarkers are definitively high.
+        Shadow check: the full stack re-scores fast-tier rows; agreement goes to the metrics, results stay as served.
         """
-        row = df.iloc[0]
-        clinical_conf = 0
-        
-        if disease_type == 'AE':
-            if row['csf_protein'] > 45: clinical_conf += 35
-            if row['seizures'] == 1: clinical_conf += 25
-            if row['memory_loss'] == 1: clinical_conf += 20
-        elif disease_type == 'PV':
-            # PV is driven heavily by Dsg1/Dsg3
-            if row['dsg1_index'] > 20: clinical_conf += 50
-            if row['dsg3_index'] > 20: clinical_conf += 30
-            if row['skin_blisters'] == 1: clinical_conf += 30
-            if row['mucosal_ulcers'] == 1: clinical_conf += 20
-        
-        if clinical_conf > 0:
-             # If clinical signs are present, ensure we don't return < 0.5 if signs are strong
-             # Normalize clinical_conf to max 0.99
-             clinical_prob = min(0.99, clinical_conf / 100.0)
-             
-             # If clinical_conf is very high (>50), force the probability to be at least that high
-             if clinical_conf >= 50:
-                 return max(ml_prob, clinical_prob)
-             
-             # Otherwise, blend them
-             return max(ml_prob, clinical_prob)
-             
-        return ml_prob
-
-    def predict(self, clinical_data, mri_path=None, disease_type='AE'):
-        print(f"📥 Pipeline: {disease_type}")
-        df = pd.DataFrame([clinical_data])
-        df = df.apply(pd.to_numeric, errors='coerce').fillna(0)
-        df_processed = self.engineer_features(df)
-
-        ml_result = "Normal"
-        ml_prob = 0.0
-        
+        failed = np.zeros(len(X), dtype=bool)
+        full_probs = self._stack_proba(X, failed)
+        if failed.any(): return
+
+        agree = ((self._checked_columns(fast_probs, checks) > 0.5) == (self._checked_columns(full_probs, checks) > 0.5)).all(axis=1)
+        count('immunoai_fast_verify_total', int(agree.sum()), outcome='agree')
+        count('immunoai_fast_verify_total', int((~agree).sum()), outcome='disagree')
+        for diff in np.abs(fast_probs - full_probs).max(axis=1).tolist():
+            observe('immunoai_fast_verify_abs_diff', diff)
+        if not agree.all():
+            logger.warning(f"⚠️ Fast tier disagreed with the full stack on {int((~agree).sum())}/{len(X)} verified rows")
+
+    def _stack_proba(self, X, failed, lgb_probs=None):
+        n = len(X)
         try:
-            # --- 1. PREDICT: RANDOM FOREST ---
-            rf_probs = np.array([0.5, 0.5]) # Default
-            rf_final_prob = 0.5
-            
-            if 'rf' in self.models:
-                X_rf = self._prepare_input_for_model(df_processed, 'rf', self.rf_features_fallback)
-                rf_raw = self.models['rf'].predict_proba(X_rf) # Shape (1, n_classes)
-                rf_probs = rf_raw[0] # Shape (n_classes,)
-                rf_final_prob = rf_probs[1] if len(rf_probs) > 1 else rf_probs[0]
-
-            # --- 2. PREDICT: XGBOOST ---
-            xgb_probs = rf_probs # Fallback
-            xgb_final_prob = rf_final_prob
-            
-            if 'xgb' in self.models:
-                # Use strict XGB features from log
-                X_xgb = self._prepare_input_for_model(df_processed, 'xgb', self.xgb_features)
-                try:
-                    # Sklearn wrapper
-                    xgb_raw = self.models['xgb'].predict_proba(X_xgb)
-                    xgb_probs = xgb_raw[0]
-                    xgb_final_prob = xgb_probs[1] if len(xgb_probs) > 1 else xgb_probs[0]
-                except AttributeError:
-                    # Native Booster
-                    dmatrix = xgb.DMatrix(X_xgb)
-                    pred = float(self.models['xgb'].predict(dmatrix)[0])
-                    # Native usually returns single float for binary
-                    xgb_probs = np.array([1-pred, pred]) 
-                    xgb_final_prob = pred
-
-            # --- 3. PREDICT: LIGHTGBM ---
-            lgb_probs = rf_probs # Fallback
-            lgb_final_prob = rf_final_prob
-            
-            if 'lgbm' in self.models:
-                # Try to auto-detect LGBM features (likely different from XGB/RF)
-                # If auto-detect fails, we pass df_processed; LGBM might select cols by name or index
-                X_lgb = self._prepare_input_for_model(df_processed, 'lgbm', None)
-                
-                try:
-                    # Sklearn wrapper
-                    lgb_raw = self.models['lgbm'].predict_proba(X_lgb)
-                    lgb_probs = lgb_raw[0]
-                    lgb_final_prob = lgb_probs[1] if len(lgb_probs) > 1 else lgb_probs[0]
-                except AttributeError:
-                    # Native Booster
-                    pred = float(self.models['lgbm'].predict(X_lgb)[0])
-                    lgb_probs = np.array([1-pred, pred])
-                    lgb_final_prob = pred
-
-            print(f"📊 Bases: RF={rf_final_prob:.2f}, XGB={xgb_final_prob:.2f}, LGB={lgb_final_prob:.2f}")
+            # --- 1-3. BASE MODELS: RANDOM FOREST, XGBOOST, LIGHTGBM (in parallel) ---
+            keys = [key for key in ('rf', 'xgb', 'lgbm') if key in self.models and not (key == 'lgbm' and lgb_probs is not None)]
+            futures = {key: submit(self._base_proba, key, X) for key in keys}
+            base = {key: future.result() for key, future in futures.items()}
+            if lgb_probs is not None: base['lgbm'] = lgb_probs
+
+            width = max((probs.shape[1] for probs in base.values()), default=2)
+            rf_probs = base.get('rf', np.full((n, width), 0.5)) # Default
+            xgb_probs = base.get('xgb', rf_probs) # Fallback
+            lgb_probs = base.get('lgbm', rf_probs) # Fallback
+
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("📊 Bases (class means of %d): RF=%s, XGB=%s, LGB=%s", n,
+                             rf_probs.mean(axis=0).round(2), xgb_probs.mean(axis=0).round(2), lgb_probs.mean(axis=0).round(2))
 
             # --- 4. META LEARNER (STACKING) ---
             if 'meta' in self.models:
-                # ERROR FIX: "Expecting 9 features"
-                # This implies 3 models x 3 classes (Normal, AE, PV) = 9 features
-                # We concatenate the full probability vectors
-                
-                # Check dimensions to ensure we have enough data to fill 9 slots if needed
-                # If binary (2 classes), we might need to pad or the meta model expects something else
-                # But given the error "X has 3 features... expecting 9", concatenating vectors is the standard fix
-                
-                stack_input = np.concatenate([rf_probs, xgb_probs, lgb_probs])
-                
-                # Reshape for single sample prediction: (1, 9)
-                stack_input = stack_input.reshape(1, -1)
-                
-                # Determine prob from meta
-                meta_raw = self.models['meta'].predict_proba(stack_input)[0]
-                ml_prob = meta_raw[1] if len(meta_raw) > 1 else meta_raw[0]
-            else:
-                ml_prob = (rf_final_prob + xgb_final_prob + lgb_final_prob) / 3.0
+                # The meta-learner expects 3 models x n_classes features per row,
+                # so we concatenate the full probability vectors: (n, 9)
+                with span('meta'):
+                    stack_input = np.hstack([rf_probs, xgb_probs, lgb_probs])
+                    return self._predict_proba('meta', stack_input)
+            return (rf_probs + xgb_probs + lgb_probs) / 3.0
 
         except Exception as e:
-            print(f"❌ Stack Error: {e}")
-            traceback.print_exc()
-            ml_prob = 0.0
+            logger.exception(f"❌ Stack Error: {e}")
+            failed[:] = True
+            count('immunoai_stage_errors_total', stage='stack')
+            return np.zeros((n, len(self.class_index)))
 
-        # Calibration
-        ml_prob = self.calibrate_prediction(ml_prob, df_processed, disease_type)
+    def _cnn_stage(self, mri_paths, use_mri, failed, with_cam=True):
+        """
+        CNN probability, plus the scan _gradcam_stage draws from (see _scan), for the rows that carry an MRI.
+        with_cam=False scores the scans only (no Grad-CAM to draw).
+        Returns (cnn_probs, scans, scored): only the scored rows have a probability (no CNN loaded, or an error, leaves none).
+        """
+        cnn_probs = np.zeros(len(use_mri))
+        scored = np.zeros(len(use_mri), dtype=bool)
+        scans = [None] * len(use_mri)
+        if not use_mri.any(): return cnn_probs, scans, scored
+        self._ensure('cnn')
+        if self.cnn_model:
+            for i in np.flatnonzero(use_mri):
+                try:
+                    cnn_probs[i], scans[i] = self._scan(mri_paths[i], with_cam)
+                    scored[i] = True
+                except:
+                    failed[i] = True
+                    count('immunoai_stage_errors_total', stage='cnn')
+        return cnn_probs, scans, scored
 
-        # Fusion
-        cnn_prob = 0.0
-        grad_cam_url = None
-        if disease_type == 'AE' and mri_path and self.cnn_model:
+    def _cnn_status(self, use_mri, skipped, scored):
+        """
+        Per row: 'skipped' (cascade), 'scored', 'failed' (the CNN raised), 'unavailable' (no CNN loaded), None without a scan.
+        """
+        return [
+            'skipped' if skip else 'scored' if ok else ('failed' if self.cnn_model else 'unavailable') if mri else None
+            for mri, skip, ok in zip(use_mri.tolist(), skipped.tolist(), scored.tolist())
+        ]
+
+    def _gradcam_stage(self, cnn_probs, scans, failed):
+        """
+        Grad-CAM overlay URL per scored scan (None for the rest).
+        """
+        grad_cam_urls = [None] * len(scans)
+        for i, scan in enumerate(scans):
+            if scan is None: continue
             try:
-                img = Image.open(mri_path).convert('RGB')
-                preprocess = transforms.Compose([transforms.Resize((224, 224)), transforms.ToTensor(), transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])])
-                output = self.cnn_model(preprocess(img).unsqueeze(0).to(self.device))
-                cnn_prob = F.softmax(output, dim=1)[0][1].item()
-                grad_cam_url = self.generate_gradcam(mri_path)
-            except: pass
-
-        if disease_type == 'AE' and mri_path:
-            final_prob = (ml_prob * 0.7) + (cnn_prob * 0.3)
-        else:
-            final_prob = ml_prob
+                grad_cam_urls[i] = self._draw_gradcam(cnn_probs[i], scan)
+            except:
+                failed[i] = True
+                count('immunoai_stage_errors_total', stage='gradcam')
+        return grad_cam_urls
+
+    def _shap_stage(self, X, disease_types, failed, tier='full'):
+        with span('shap'):
+            return self.calculate_shap(X, disease_types, failed, tier)
+
+    @staticmethod
+    def _label(final_probs, disease_types):
+        """
+        Result label and clamped confidence (%) per row.
+        """
+        ml_results, final_confs = [], []
+        for final_prob, disease_type in zip(final_probs.tolist(), disease_types):
+            if final_prob > 0.5:
+                ml_results.append("Autoimmune Encephalitis (AE)" if disease_type == 'AE' else "Pemphigus Vulgaris (PV)")
+                final_conf = round(final_prob * 100, 2)
+            else:
+                ml_results.append("Normal")
+                final_conf = round((1.0 - final_prob) * 100, 2)
+            final_confs.append(max(5.0, min(95.0, final_conf)))
+        return ml_results, final_confs
+
+    def _screening_status(self, score):
+        if score > self.thresholds['high_confidence']: return "positive"
+        if score >= self.thresholds['suspected']: return "suspected"
+        return "negative"
+
+    def _run_pipeline(self, X, disease_types, mri_paths, tier='full', explain=True):
+        """
+        Stacked ensemble (or the distilled fast tier) -> calibration -> CNN fusion -> explanations over an engineered feature matrix.
+        Returns (results, failed) where failed flags rows produced through an error fallback.
+        """
+        for stage, outcome in self._pipeline_events(X, disease_types, mri_paths, tier, explain):
+            if stage == 'complete': return outcome
+
+    def _pipeline_events(self, X, disease_types, mri_paths, tier='full', explain=True):
+        """
+        The pipeline as it progresses: yields (stage, [fields per row]) for 'ensemble', then 'fusion' and
+        'grad_cam' when a row carries an MRI, then 'shap', and finally ('complete', (results, failed)).
+        Each stage's fields are a subset of the final result dict. explain=False skips the SHAP and Grad-CAM stages.
+        """
+        n = len(X)
+        failed = np.zeros(n, dtype=bool)
+        logger.debug("📥 Pipeline: %s x%d", ', '.join(sorted(set(disease_types))), n)
+
+        # The MRI branch and SHAP only need the inputs: start them alongside the tabular ensemble
+        # (in cascade mode the MRI branch waits for the ensemble to decide whether it is needed at all)
+        use_mri = np.array([d == 'AE' and bool(p) for d, p in zip(disease_types, mri_paths)])
+        cnn_future = None if CNN_CASCADE else submit_to('cnn', self._cnn_stage, mri_paths, use_mri, failed, explain)
+        shap_future = submit(self._shap_stage, X, disease_types, failed, tier) if explain else None
+
+        ml_probs = self._class_column(self._tier_proba(X, failed, [[d] for d in disease_types], tier), disease_types)
+
+        # Calibration
+        with span('calibration'):
+            ml_probs = self.calibrate_prediction(ml_probs, X, disease_types)
+
+        ml_results, ml_confs = self._label(ml_probs, disease_types)
+        yield 'ensemble', [
+            {"result": ml_results[i], "confidence": ml_confs[i], "tabular_probability": float(ml_probs[i]), "tier": tier}
+            for i in range(n)
+        ]
+
+        # Cascade
+        skipped = np.zeros(n, dtype=bool)
+        if cnn_future is None:
+            skipped = use_mri & ~self._cnn_can_flip(ml_probs)
+            use_mri = use_mri & ~skipped
+            if skipped.any(): count('immunoai_cnn_skipped_total', int(skipped.sum()))
+            cnn_future = submit_to('cnn', self._cnn_stage, mri_paths, use_mri, failed, explain)
+
+        # Fusion (a scan the CNN could not score leaves the tabular probability alone)
+        cnn_probs, scans, scored = cnn_future.result()
+        final_probs = np.where(scored, (ml_probs * (1 - CNN_WEIGHT)) + (cnn_probs * CNN_WEIGHT), ml_probs)
 
         # Result
-        final_conf = round(final_prob * 100, 2)
-        if final_prob > 0.5:
-            ml_result = "Autoimmune Encephalitis (AE)" if disease_type == 'AE' else "Pemphigus Vulgaris (PV)"
-            is_positive = True
+        ml_results, final_confs = self._label(final_probs, disease_types)
+        statuses = self._cnn_status(use_mri | skipped, skipped, scored)
+        cnn = [
+            {
+                "status": statuses[i],
+                "probability": float(cnn_probs[i]) if scored[i] else None,
+                "tabular_probability": float(ml_probs[i]),
+            }
+            for i in range(n)
+        ]
+        if (use_mri | skipped).any():
+            yield 'fusion', [{"result": ml_results[i], "confidence": final_confs[i], "cnn": cnn[i]} for i in range(n)]
+
+        if n == 1:
+            logger.debug("🤖 Final: %s (%s%%)", ml_results[0], final_confs[0])
         else:
-            ml_result = "Normal"
-            final_conf = round((1.0 - final_prob) * 100, 2)
-            is_positive = False
+            logger.debug("🤖 Final: %d/%d positive", sum(r != 'Normal' for r in ml_results), n)
 
-        final_conf = max(5.0, min(95.0, final_conf))
-        print(f"🤖 Final: {ml_result} ({final_conf}%)")
+        grad_cam_urls = self._gradcam_stage(cnn_probs, scans, failed)
+        if explain and use_mri.any():
+            yield 'grad_cam', [{"grad_cam": url} for url in grad_cam_urls]
 
-        shap_data = self.calculate_shap(df_processed, is_positive, disease_type)
-        explanation = self.generate_explanation(ml_result, final_conf, df_processed, disease_type)
-        
-        return {
-            "result": ml_result,
-            "confidence": final_conf,
-            "explanation": explanation,
-            "grad_cam": grad_cam_url,
-            "shap_features": shap_data,
-            "full_data": df_processed.iloc[0].to_dict()
-        }
+        shap_data = [[] for _ in range(n)]
+        if shap_future is not None:
+            shap_data = shap_future.result()
+            yield 'shap', [{"shap_features": features} for features in shap_data]
+
+        full_data = self.schema.to_records(X)
+        with span('explanation'):
+            explanations = self.generate_explanation(ml_results, final_confs, full_data, disease_types)
+
+        results = [
+            {
+                "result": ml_results[i],
+                "confidence": final_confs[i],
+                "explanation": explanations[i],
+                "grad_cam": grad_cam_urls[i],
+                "shap_features": shap_data[i],
+                "full_data": full_data[i],
+                "tier": tier,
+                "cnn": cnn[i],
+            }
+            for i in range(n)
+        ]
+        yield 'complete', (results, failed)
+
+    @staticmethod
+    def _cnn_can_flip(ml_probs):
+        """
+        Whether the CNN could still decide each row. Over every possible CNN output the fused score spans
+        [0.7 ml, 0.7 ml + 0.3], so ml > 5/7 is positive and ml <= 2/7 negative whatever the scan shows.
+        Skipped rows report ml itself, which always lies inside that span.
+        """
+        low = ml_probs * (1 - CNN_WEIGHT)
+        return (low <= 0.5) & (low + CNN_WEIGHT > 0.5)
+
+    def score_mri(self, tabular_prob, mri_path):
+        """
+        Scores a scan the cascade skipped (on demand): CNN probability, Grad-CAM and the fused AE result.
+        The label cannot differ from the cascade's; the confidence becomes the fused one.
+        """
+        self._ensure('cnn')
+        if not self.cnn_model: raise RuntimeError("AE CNN model is not available")
+        with admission.admit('cnn'):
+            cnn_prob, grad_cam = self._predict_cnn(mri_path)
+        final_prob = tabular_prob * (1 - CNN_WEIGHT) + cnn_prob * CNN_WEIGHT
+        (result,), (confidence,) = self._label(np.array([final_prob]), ['AE'])
+        return {"result": result, "confidence": confidence, "grad_cam": grad_cam, "cnn_probability": cnn_prob}
+
+    def _run_screening(self, X, mri_paths, tier='full'):
+        """
+        One ensemble pass, then per-disease calibration of the AE and PV columns.
+        The headline result follows the higher disease score; SHAP explains that disease.
+        """
+        n = len(X)
+        failed = np.zeros(n, dtype=bool)
+        logger.debug("📥 Screening: AE+PV x%d", n)
+
+        use_mri = np.array([bool(p) for p in mri_paths])
+        cnn_future = submit_to('cnn', self._cnn_stage, mri_paths, use_mri, failed)
+        probs = self._tier_proba(X, failed, [('AE', 'PV')] * n, tier)
+        if probs.shape[1] < 3:
+            raise ValueError("Multi-disease screening needs the 3-class (AE/PV/Normal) models")
+
+        with span('calibration'):
+            ae = self.calibrate_prediction(probs[:, self.class_index['AE']], X, 'AE')
+            pv = self.calibrate_prediction(probs[:, self.class_index['PV']], X, 'PV')
+
+        cnn_probs, scans, scored = cnn_future.result()
+        ae = np.where(scored, (ae * (1 - CNN_WEIGHT)) + (cnn_probs * CNN_WEIGHT), ae)
+        # Normal can never exceed what the (floored) disease scores leave over
+        normal = np.minimum(probs[:, self.class_index['Normal']], 1.0 - np.maximum(ae, pv))
+
+        top = ['AE' if a >= p else 'PV' for a, p in zip(ae.tolist(), pv.tolist())]
+        ml_results, final_confs = self._label(np.maximum(ae, pv), top)
+
+        # SHAP explains the winning disease, so it can only start once the scores exist
+        shap_future = submit(self._shap_stage, X, top, failed, tier)
+        grad_cam_urls = self._gradcam_stage(cnn_probs, scans, failed)
+        full_data = self.schema.to_records(X)
+        with span('explanation'):
+            explanations = self.generate_explanation(ml_results, final_confs, full_data, top)
+        shap_data = shap_future.result()
+
+        results = []
+        for i in range(n):
+            scores = {'AE': round(float(ae[i]), 4), 'PV': round(float(pv[i]), 4), 'Normal': round(float(normal[i]), 4)}
+            results.append({
+                "result": ml_results[i],
+                "confidence": final_confs[i],
+                "explanation": explanations[i],
+                "grad_cam": grad_cam_urls[i],
+                "shap_features": shap_data[i],
+                "full_data": full_data[i],
+                "scores": scores,
+                "tier": tier,
+                "screening": {d: self._screening_status(scores[d]) for d in ('AE', 'PV')}
+            })
+        return results, failed
+
+    def predict(self, clinical_data, mri_path=None, disease_type='AE', tier=None, explain=True):
+        return self.predict_batch([clinical_data], [disease_type], [mri_path], tier, explain)[0]
+
+    def predict_all(self, clinical_data, mri_path=None, tier=None):
+        return self.predict_all_batch([clinical_data], [mri_path], tier)[0]
+
+    def predict_stream(self, clinical_data, mri_path=None, disease_type='AE', tier=None):
+        """
+        predict() one stage at a time: yields (stage, fields) as soon as each part of the result exists -
+        'ensemble' (tabular label), 'fusion' and 'grad_cam' (AE with an MRI), 'shap' - then ('complete', result).
+        A cached result arrives as 'complete' alone. The admission slots are held until the stream ends.
+        """
+        self._ensure('tabular')
+        tier = self._resolve_tier(tier)
+        with span('features'):
+            X = self.engineer_features([clinical_data])
+        self._check_artifacts()
+        with span('cache_lookup'):
+            key, cached = self._cache_lookup(X[0], disease_type, mri_path, tier)
+        if cached is not None:
+            yield 'complete', cached
+            return
+
+        with admission.admit(*self._families([disease_type], [mri_path])):
+            for stage, rows in self._pipeline_events(X, [disease_type], [mri_path], tier):
+                if stage != 'complete':
+                    yield stage, rows[0]
+                    continue
+                (result,), (failed,) = rows
+                count('immunoai_predictions_total', disease=disease_type, source='model')
+                if key is not None and not failed:
+                    self.result_cache.put(key, result)
+                yield 'complete', result
+
+    def explain(self, clinical_data, disease_type='AE', mri_path=None, tier=None):
+        """
+        The explanation artifacts predict(..., explain=False) left out: top SHAP features, and the Grad-CAM
+        overlay when an AE scan is given (pass only scans the CNN scored). Returns
+        {"shap_features", "grad_cam", "failed"}.
+        """
+        self._ensure('tabular')
+        tier = self._resolve_tier(tier)
+        X = self.engineer_features([clinical_data])
+        failed = np.zeros(1, dtype=bool)
+        use_mri = np.array([disease_type == 'AE' and bool(mri_path)])
+
+        with admission.admit(*self._families([disease_type], [mri_path])):
+            shap_future = submit(self._shap_stage, X, [disease_type], failed, tier)
+            cnn_probs, scans, _ = self._cnn_stage([mri_path], use_mri, failed)
+            grad_cam = self._gradcam_stage(cnn_probs, scans, failed)[0]
+            shap_features = shap_future.result()[0]
+        return {"shap_features": shap_features, "grad_cam": grad_cam, "failed": bool(failed[0])}
 
     def predict_pv_ensemble(self, data): return self.predict(data, disease_type='PV')
-    def predict_ae_fusion(self, data, mri): return self.predict(data, mri_path=mri, disease_type='AE')
\ No newline at end of file
+    def predict_ae_fusion(self, data, mri): return self.predict(data, mri_path=mri, disease_type='AE')
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """
+    Process-wide engine, created on first use (model families still load lazily inside it).
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = HybridAIEngine()
+    return _engine
+
+
+def start_warmup(after_fork=False):
+    """
+    Warms the process-wide engine in the background. after_fork=True defers that to every worker forked
+    from this process instead (a preloaded parent must not start torch threads before the fork).
+    """
+    engine = get_engine()
+    if after_fork:
+        os.register_at_fork(after_in_child=lambda: get_engine().start_warmup())
+    else:
+        engine.start_warmup()
+    return engine
+
+
+def preload_engine():
+    """
+    Builds the process-wide engine with every model loaded; call in the parent before workers fork.
+    """
+    engine = get_engine()
+    engine.preload()
+    return engine
+
+
+# --- HOT RELOAD ---
+
+_reload = {'state': 'idle', 'error': None, 'started_at': None, 'finished_at': None, 'outcome': None,
+           'failed_signature': None}
+_reload_lock = threading.Lock()
+
+
+def reload_status():
+    status = {k: v for k, v in _reload.items() if k != 'failed_signature'}
+    return {**status, 'version': get_engine().version}
+
+
+def reload_engine(force=False, wait=False):
+    """
+    Loads ml_models into a fresh engine on a background thread, warms it, then swaps it in atomically:
+    requests already running finish on the engine they started with, later ones get the new models
+    (and a fresh result cache). Unchanged content only updates the stat signature unless force is set.
+    Returns False if a reload is already running in this process.
+    """
+    with _reload_lock:
+        if _reload['state'] == 'loading': return False
+        _reload.update(state='loading', error=None, started_at=time.time(), finished_at=None)
+    thread = threading.Thread(target=_reload_worker, args=(force,), name='engine-reload', daemon=True)
+    thread.start()
+    if wait: thread.join()
+    return True
+
+
+def _reload_worker(force):
+    current = get_engine()
+    signature = None
+    try:
+        # 1. Wait for the set to settle (a deploy may still be copying files)
+        signature = artifacts.stat_signature(MODEL_DIR)
+        while True:
+            time.sleep(MODEL_RELOAD_SETTLE)
+            settled = artifacts.stat_signature(MODEL_DIR)
+            if settled == signature: break
+            signature = settled
+
+        # 2. Same content (files only touched or rewritten identically since the last reload): keep the loaded models.
+        # The set is only hashed here, once its stat changed.
+        version = artifacts.content_version(MODEL_DIR, signature)
+        if not force and version == current.version:
+            current.signature = signature
+            outcome = 'unchanged'
+        else:
+            # 3. Load and warm the new set off the request path; a broken set never replaces a working one
+            with span('reload'):
+                fresh = HybridAIEngine(version)
+                fresh.warm_up()
+            report = fresh.readiness()
+            if not report['ready']:
+                raise RuntimeError(f"new model set is not ready: {report['load_errors'] or report['warmup']['errors']}")
+            _swap_engine(fresh)
+            outcome = 'swapped'
+    except Exception as e:
+        logger.error(f"❌ Model reload failed, still serving version {current.version}: {e}")
+        _reload.update(state='failed', error=str(e), failed_signature=signature, outcome='failed', finished_at=time.time())
+        count('immunoai_model_reloads_total', outcome='failed')
+        return
+    _reload.update(state='idle', failed_signature=None, outcome=outcome, finished_at=time.time())
+    count('immunoai_model_reloads_total', outcome=outcome)
+
+
+def _swap_engine(fresh):
+    global _engine
+    with _engine_lock:
+        old, _engine = _engine, fresh
+    if old is not None:
+        old.retire()
+        logger.info(f"🔄 Models swapped: version {old.version} -> {fresh.version}")
@@ -0,0 +1,56 @@
+import hashlib
+import os
+import threading
+
+from .result_cache import file_digest
+
+# Content hashes by (path, size, mtime_ns): unchanged files are never re-read
+_digests = {}
+_digests_lock = threading.Lock()
+
+
+def stat_signature(model_dir):
+    """
+    Cheap change detector over the artifact set: (name, size, mtime_ns) per file.
+    Files still being written by an atomic writer ('<name>.tmp-<pid>') are not part of the set.
+    """
+    signature = []
+    for name in sorted(os.listdir(model_dir)):
+        path = os.path.join(model_dir, name)
+        if '.tmp-' in name or not os.path.isfile(path): continue
+        stat = os.stat(path)
+        signature.append((name, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def content_version(model_dir, signature=None):
+    """
+    Model version: short sha256 over every artifact's name and content hash. Touching a file without
+    changing it keeps the version; the mtime in the signature only decides which files get re-hashed.
+    """
+    signature = signature if signature is not None else stat_signature(model_dir)
+    version = hashlib.sha256()
+    for name, size, mtime_ns in signature:
+        digest = _cached_digest(os.path.join(model_dir, name), size, mtime_ns)
+        version.update(f"{name}:{digest}|".encode())
+    return version.hexdigest()[:12]
+
+
+def file_version(path, *extra):
+    """
+    Short version of one artifact: its content hash plus whatever else shapes its outputs (e.g. the build).
+    """
+    stat = os.stat(path)
+    digest = _cached_digest(path, stat.st_size, stat.st_mtime_ns)
+    return hashlib.sha256("|".join([digest, *map(str, extra)]).encode()).hexdigest()[:12]
+
+
+def _cached_digest(path, size, mtime_ns):
+    key = (path, size, mtime_ns)
+    with _digests_lock:
+        digest = _digests.get(key)
+    if digest is None:
+        digest = file_digest(path)
+        with _digests_lock:
+            _digests[key] = digest
+    return digest
@@ -0,0 +1,100 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from .telemetry import describe, observe
+
+describe('immunoai_batch_size', "Items per micro-batch, by batcher", buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32))
+describe('immunoai_batch_wait_seconds', "Time an item queued before its micro-batch started, by batcher")
+
+
+class MicroBatcher:
+    """
+    Collects concurrent single-item requests into one batched call on a dedicated thread.
+
+    A batch closes when it holds max_batch items or max_wait seconds after its first item was
+    queued; items that piled up while the previous batch ran are taken without further waiting.
+    run_batch(items) must return one result per item, in order.
+    After close() the thread finishes what is queued and exits; later items run alone in the caller's thread.
+    """
+    def __init__(self, run_batch, max_batch=8, max_wait=0.005, name='batch'):
+        self.run_batch = run_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.name = name
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, item):
+        """
+        Queues one item and returns a Future for its result.
+        """
+        future = Future()
+        with self._lock:
+            if not self._closed:
+                self._start().put((item, future, time.perf_counter()))
+                return future
+        try:
+            future.set_result(self.run_batch([item])[0])
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._pid == os.getpid(): self._queue.put(None)
+
+    def _start(self):
+        # Called with the lock held. The worker thread does not survive fork(): a forked process starts its own
+        if self._pid != os.getpid():
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._loop, args=(self._queue,),
+                                            name=f'{self.name}-batcher', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+        return self._queue
+
+    def _collect(self, pending):
+        """
+        Next batch, and whether close() was reached (None in the queue marks it).
+        """
+        first = pending.get()
+        if first is None: return [], True
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = pending.get(timeout=remaining) if remaining > 0 else pending.get_nowait()
+            except queue.Empty:
+                break
+            if item is None: return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _loop(self, pending):
+        closing = False
+        while not closing:
+            batch, closing = self._collect(pending)
+            if not batch: break
+            started = time.perf_counter()
+            observe('immunoai_batch_size', len(batch), batcher=self.name)
+            for _, _, queued in batch:
+                observe('immunoai_batch_wait_seconds', started - queued, batcher=self.name)
+
+            try:
+                results = self.run_batch([item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch: future.set_exception(e)
+                continue
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
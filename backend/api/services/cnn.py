@@ -0,0 +1,25 @@
+import torch
+import torch.nn as nn
+import torchvision.models as models
+
+
+class AE_CNN_Model(nn.Module):
+    """
+    Standard ResNet50 Classifier for Autoimmune Encephalitis.
+    Built without pretrained weights: every tensor comes from our checkpoint,
+    so construction never touches the network.
+    """
+    def __init__(self):
+        super(AE_CNN_Model, self).__init__()
+        resnet = models.resnet50(weights=None)
+
+        self.features = nn.Sequential(*list(resnet.children())[:-2])
+        self.avgpool = nn.AdaptiveAvgPool2d((1, 1))
+        self.fc = nn.Linear(2048, 2)
+
+    def forward(self, x):
+        x = self.features(x)
+        x = self.avgpool(x)
+        x = torch.flatten(x, 1)
+        x = self.fc(x)
+        return x
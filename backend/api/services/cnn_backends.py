@@ -0,0 +1,129 @@
+import copy
+import io
+import json
+import os
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# 'eager' is today's fp32 module; the others are inference-only builds of it
+BACKENDS = ('eager', 'torchscript', 'channels_last', 'int8_dynamic', 'int8_static')
+# Built from the checkpoint alone at load time; int8_static needs sample scans (manage.py build_cnn_backends)
+BUILD_ON_LOAD = ('eager', 'torchscript', 'channels_last', 'int8_dynamic')
+INPUT_SHAPE = (3, 224, 224)
+REPORT_FILE = 'report.json'
+
+
+class CNNVariant:
+    """
+    Inference-only build of the AE CNN: (N, 3, 224, 224) batch -> (N,) AE probabilities.
+    """
+    def __init__(self, backend, module, archive=None):
+        self.backend = backend
+        # TorchScript bytes for the cache, taken before optimize_for_inference (which rewrites the graph in place
+        # into ops that do not serialize)
+        self.archive = archive
+        self.module = torch.jit.optimize_for_inference(module) if backend == 'torchscript' else module
+
+    def __call__(self, batch):
+        if self.backend == 'channels_last':
+            batch = batch.contiguous(memory_format=torch.channels_last)
+        with torch.inference_mode():
+            return F.softmax(self.module(batch).float(), dim=1)[:, 1]
+
+
+
+def _frozen(backend, module):
+    """
+    Traces and freezes a module into a TorchScript graph (weights folded in as constants).
+    """
+    example = torch.zeros((1,) + INPUT_SHAPE)
+    with torch.no_grad():
+        frozen = torch.jit.freeze(torch.jit.trace(module.eval(), example))
+    buffer = io.BytesIO()
+    torch.jit.save(frozen, buffer)
+    return CNNVariant(backend, frozen, archive=buffer.getvalue())
+
+
+def build(model, backend, calibration=None):
+    """
+    Builds one backend from the fp32 eager model (left untouched).
+    calibration: (N, 3, 224, 224) preprocessed scans, required for int8_static.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown CNN backend '{backend}' (expected one of {', '.join(BACKENDS)})")
+    model = copy.deepcopy(model).cpu().eval()
+
+    if backend == 'eager':
+        return CNNVariant(backend, model)
+    if backend == 'channels_last':
+        return CNNVariant(backend, model.to(memory_format=torch.channels_last))
+    if backend == 'torchscript':
+        # Freezing folds BatchNorm into the convolutions; optimize_for_inference fuses what is left
+        return _frozen(backend, model)
+    if backend == 'int8_dynamic':
+        # Dynamic quantization covers Linear layers only (the classifier head of this network)
+        quantized = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        return _frozen(backend, quantized)
+
+    # int8_static: FX graph-mode post-training quantization, activation ranges observed on sample scans
+    if calibration is None or not len(calibration):
+        raise ValueError("int8_static needs calibration scans")
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    example = (torch.zeros((1,) + INPUT_SHAPE),)
+    prepared = prepare_fx(model, get_default_qconfig_mapping(torch.backends.quantized.engine), example)
+    with torch.inference_mode():
+        for chunk in calibration.split(8):
+            prepared(chunk)
+    return _frozen(backend, convert_fx(prepared))
+
+
+def artifact_path(cache_dir, backend):
+    return os.path.join(cache_dir, f"{backend}.pt")
+
+
+def save(variant, cache_dir):
+    """
+    Writes a scripted variant's TorchScript archive (eager builds are rebuilt at load instead).
+    """
+    if variant.archive is None: return None
+    os.makedirs(cache_dir, exist_ok=True)
+    path = artifact_path(cache_dir, variant.backend)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, 'wb') as f:
+        f.write(variant.archive)
+    os.replace(tmp, path)
+    return path
+
+
+def load(cache_dir, backend):
+    return CNNVariant(backend, torch.jit.load(artifact_path(cache_dir, backend), map_location='cpu'))
+
+
+def read_report(cache_dir):
+    path = os.path.join(cache_dir, REPORT_FILE)
+    if not os.path.exists(path): return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_report(cache_dir, report):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, REPORT_FILE)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp, path)
+
+
+def recommend(results, tolerance):
+    """
+    Fastest backend whose probabilities stay within tolerance of fp32 eager.
+    results: {backend: {'max_abs_diff': float, 'ms_per_scan': float}}
+    """
+    passing = {b: r for b, r in results.items() if r['max_abs_diff'] <= tolerance}
+    if not passing: return 'eager'
+    return min(passing, key=lambda b: passing[b]['ms_per_scan'])
@@ -0,0 +1,50 @@
+import numpy as np
+
+
+def _unwrap(model):
+    """
+    The native booster behind an sklearn wrapper (XGBClassifier / LGBMClassifier), or the model itself.
+    """
+    module = type(model).__module__
+    if module.startswith('xgboost') and hasattr(model, 'get_booster'):
+        return model.get_booster()
+    if module.startswith('lightgbm') and hasattr(model, 'booster_'):
+        return model.booster_
+    return model
+
+
+def supports_native(model):
+    module = type(_unwrap(model)).__module__
+    return module.startswith('xgboost') or module.startswith('lightgbm')
+
+
+def native_contributions(model, X, threads=0):
+    """
+    Exact TreeSHAP contributions from the booster itself (xgboost pred_contribs / lightgbm pred_contrib).
+    Returns shape (N, n_classes, n_features + 1); the last column is the bias (expected margin).
+    threads caps LightGBM's OpenMP threads (xgboost uses the booster's 'nthread' param).
+    """
+    booster = _unwrap(model)
+    X = np.asarray(X)
+    n = len(X)
+
+    if type(booster).__module__.startswith('xgboost'):
+        import xgboost as xgb
+        dmatrix = xgb.DMatrix(X.astype(np.float32, copy=False), feature_names=booster.feature_names)
+        contribs = booster.predict(dmatrix, pred_contribs=True)
+    elif type(booster).__module__.startswith('lightgbm'):
+        contribs = booster.predict(X, pred_contrib=True, **({'num_threads': threads} if threads else {}))
+    else:
+        raise TypeError(f"No native contributions for {type(model).__name__}")
+
+    contribs = np.asarray(contribs, dtype=np.float64)
+    width = X.shape[1] + 1
+    # Binary models return (N, F+1); multiclass xgboost (N, C, F+1); multiclass lightgbm (N, C*(F+1))
+    return contribs.reshape(n, -1, width)
+
+
+def top_features(values, k=5):
+    """
+    Column indices of the k largest |values| per row, largest first: shape (N, min(k, F)).
+    """
+    return np.argsort(np.abs(values), axis=1)[:, ::-1][:, :k]
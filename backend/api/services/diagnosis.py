@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from ..models import DiagnosticSession
+from ..serializers import DiagnosticSessionSerializer
+from . import mri_store
+from .admission import Overloaded
+from .ai_engine import get_engine
+from .telemetry import span
+
+logger = logging.getLogger(__name__)
+
+# 'inline', 'on_demand' or 'background' (see settings.AI_EXPLANATIONS)
+EXPLANATIONS = getattr(settings, 'AI_EXPLANATIONS', 'on_demand')
+# cnn_status of an AE scan without a CNN probability: score_skipped_mri() can still score it
+UNSCORED = ('skipped', 'unavailable', 'failed')
+
+
+def run_diagnosis(session, engine=None, explain=None):
+    """
+    Runs the AI pipeline for a saved session and stores the result on it.
+    Shared by the synchronous predict endpoint and the inference workers; returns the raw engine result.
+    Unless explain (default: AI_EXPLANATIONS == 'inline'), SHAP and Grad-CAM are left for explain_session().
+    """
+    engine = engine or get_engine()
+    explain = EXPLANATIONS == 'inline' if explain is None else explain
+    mri_path = scan_path(session, engine)
+
+    with span('predict', disease=session.disease_type):
+        ai_result = engine.predict(session.clinical_data, mri_path, session.disease_type, explain=explain)
+
+    apply_result(session, ai_result, engine.version, explain)
+    session.status = 'completed'
+    with span('db_save'):
+        session.save()
+    record_scan(session, engine)
+    return ai_result
+
+
+def fail_sessions(*session_ids):
+    """
+    Marks sessions whose analysis can no longer finish as 'failed' (only while still 'pending').
+    """
+    return DiagnosticSession.objects.filter(id__in=session_ids, status='pending').update(status='failed')
+
+
+def scan_path(session, engine):
+    """
+    The session's AE scan for the engine (None otherwise). The scan's sha256 and any CNN probability the MRI
+    store already holds for it go to the engine first, so the file is not re-hashed and a duplicate upload
+    does not run the CNN.
+    """
+    if session.disease_type != 'AE' or not session.mri_scan: return None
+    blob = session.mri_blob
+    if blob is not None:
+        # The store already hashed the scan: the engine never reads it for its digest
+        engine.remember_digest(session.mri_scan.path, blob.sha256)
+        if blob.cnn_probability is not None:
+            engine.remember_scan(blob.sha256, blob.cnn_probability, blob.cnn_version)
+    return session.mri_scan.path
+
+
+def record_scan(session, engine):
+    """
+    Keeps the CNN probability of a scored scan on its MriBlob.
+    """
+    if session.cnn_status == 'scored':
+        mri_store.remember_score(session.mri_blob, session.cnn_probability, engine.cnn_version)
+
+
+def apply_result(session, ai_result, model_version, explained=True):
+    """
+    Copies a full engine result onto the session (not saved).
+    """
+    session.prediction_result = ai_result.get('result')
+    session.confidence_score = ai_result.get('confidence')
+    session.ai_explanation_text = ai_result.get('explanation')
+    session.grad_cam_url = ai_result.get('grad_cam') or ''
+    session.shap_features = ai_result.get('shap_features') or []
+
+    cnn = ai_result.get('cnn') or {}
+    session.tabular_probability = cnn.get('tabular_probability')
+    session.cnn_probability = cnn.get('probability')
+    session.cnn_status = cnn.get('status') or ''
+    session.model_version = model_version
+    session.explanation_status = '' if explained else 'pending'
+
+    if ai_result.get('full_data'):
+        session.clinical_data = ai_result.get('full_data')
+
+
+def save_stage(session, stage, fields, model_version):
+    """
+    Stores one streamed stage on the session, writing only the columns it fills.
+    The session stays 'pending' until the complete result is in.
+    """
+    if stage == 'complete':
+        apply_result(session, fields, model_version)
+        session.status = 'completed'
+        with span('db_save'):
+            session.save()
+        return
+
+    updated = []
+    if 'result' in fields:
+        session.prediction_result, session.confidence_score = fields['result'], fields['confidence']
+        updated += ['prediction_result', 'confidence_score']
+    if 'tabular_probability' in fields:
+        session.tabular_probability, session.model_version = fields['tabular_probability'], model_version
+        updated += ['tabular_probability', 'model_version']
+    if 'cnn' in fields:
+        session.cnn_probability, session.cnn_status = fields['cnn']['probability'], fields['cnn']['status'] or ''
+        updated += ['cnn_probability', 'cnn_status']
+    if 'grad_cam' in fields:
+        session.grad_cam_url = fields['grad_cam'] or ''
+        updated.append('grad_cam_url')
+    if 'shap_features' in fields:
+        session.shap_features = fields['shap_features'] or []
+        updated.append('shap_features')
+    with span('db_save'):
+        session.save(update_fields=updated)
+
+
+async def stream_diagnosis(session, engine=None):
+    """
+    run_diagnosis() for the streaming endpoint: an async generator of (stage, fields) that stores each stage
+    on the session before handing it on. The models run on a worker thread, the ORM on Django's sync thread.
+    A stream that raises, or is cancelled or closed before 'complete', leaves the session 'failed'.
+    """
+    engine = engine or get_engine()
+    mri_path = await sync_to_async(scan_path)(session, engine)
+    stages = engine.predict_stream(session.clinical_data, mri_path, session.disease_type)
+    step = sync_to_async(lambda: next(stages, None), thread_sensitive=False)
+    running, completed = None, False
+    try:
+        while True:
+            # Shielded: a cancelled stream lets the stage on the worker thread finish instead of orphaning it
+            running = asyncio.ensure_future(step())
+            event = await asyncio.shield(running)
+            running = None
+            if event is None: break
+            stage, fields = event
+            await sync_to_async(save_stage)(session, stage, fields, engine.version)
+            if stage == 'complete':
+                completed = True
+                await sync_to_async(record_scan)(session, engine)
+            yield stage, fields
+    finally:
+        # 1. Wait out a stage still running (the pipeline cannot be closed mid-stage)
+        if running is not None:
+            with suppress(Exception):
+                await running
+        # 2. Close the pipeline now, which hands its admission slots back
+        await sync_to_async(stages.close, thread_sensitive=False)()
+        if not completed:
+            await sync_to_async(fail_sessions)(session.id)
+
+
+def session_payload(session, ai_result):
+    """
+    The predict response body: the serialized session plus the Grad-CAM and SHAP extras.
+    """
+    return {
+        **DiagnosticSessionSerializer(session).data,
+        "grad_cam_url": ai_result.get('grad_cam') or session.grad_cam_url or None,
+        "shap_features": ai_result.get('shap_features') or session.shap_features
+    }
+
+
+def explain_session(session, engine=None):
+    """
+    Computes the explanations left out of a session's result (SHAP, and Grad-CAM for a scored AE scan) and
+    stores them on it. Raises Overloaded when the models are at capacity (the session stays 'pending').
+    """
+    engine = engine or get_engine()
+    mri_path = scan_path(session, engine) if session.cnn_status not in UNSCORED else None
+
+    with span('explain', disease=session.disease_type):
+        explained = engine.explain(session.clinical_data, session.disease_type, mri_path)
+
+    session.shap_features = explained['shap_features'] or []
+    session.grad_cam_url = explained['grad_cam'] or ''
+    session.explanation_status = 'failed' if explained['failed'] else 'ready'
+    with span('db_save'):
+        session.save(update_fields=['shap_features', 'grad_cam_url', 'explanation_status'])
+    return explained
+
+
+def ensure_explanations(session, engine=None):
+    """
+    explain_session() for a completed session still waiting on its explanations; never raises.
+    Returns False when they could not be computed right now.
+    """
+    if session.explanation_status != 'pending' or session.status == 'pending': return True
+    try:
+        explain_session(session, engine)
+        return True
+    except Overloaded as e:
+        logger.warning(f"⏳ Explanations for session {session.id} deferred: {e}")
+    except Exception:
+        logger.exception(f"❌ Explanations for session {session.id} failed")
+    return False
+
+
+def request_explanations(session):
+    """
+    For read endpoints: queues the explanations a completed session is still waiting on (explain_later)
+    instead of computing them in the request. Returns True while they are pending.
+    """
+    if session.explanation_status != 'pending' or session.status in ('pending', 'failed'): return False
+    explain_later(session.id)
+    return True
+
+
+_explainer = None
+_explainer_pid = None
+_explainer_lock = threading.Lock()
+# Sessions queued on this process's explainer: a page polling for them does not queue them again
+_queued = set()
+
+
+def explain_later(session_id):
+    """
+    Queues explain_session() for a session on this process's background explainer thread (once while queued).
+    """
+    global _explainer, _explainer_pid
+    with _explainer_lock:
+        # A forked worker gets its own thread
+        if _explainer is None or _explainer_pid != os.getpid():
+            _explainer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='explain')
+            _explainer_pid = os.getpid()
+            _queued.clear()
+        if session_id in _queued: return None
+        _queued.add(session_id)
+        return _explainer.submit(_explain_in_background, session_id)
+
+
+def _explain_in_background(session_id):
+    try:
+        session = DiagnosticSession.objects.filter(id=session_id).first()
+        if session is not None:
+            ensure_explanations(session)
+    finally:
+        with _explainer_lock:
+            _queued.discard(session_id)
+        close_old_connections()
+
+
+def score_skipped_mri(session, engine=None):
+    """
+    Runs the CNN for a session whose scan has no probability yet (cascade skip, or the CNN was unavailable or
+    failed at prediction time) and stores the fused result. Returns the Grad-CAM URL.
+    """
+    engine = engine or get_engine()
+    with span('predict', disease='AE'):
+        scored = engine.score_mri(session.tabular_probability, scan_path(session, engine))
+
+    session.cnn_probability = scored['cnn_probability']
+    session.cnn_status = 'scored'
+    session.confidence_score = scored['confidence']
+    session.grad_cam_url = scored['grad_cam'] or ''
+    with span('db_save'):
+        session.save(update_fields=['cnn_probability', 'cnn_status', 'confidence_score', 'grad_cam_url'])
+    record_scan(session, engine)
+    return scored['grad_cam']
@@ -0,0 +1,89 @@
+import json
+import os
+
+import numpy as np
+
+# Student artifacts live next to the stack they were distilled from
+MODEL_FILE = 'distilled_model.json'
+REPORT_FILE = 'distilled_report.json'
+
+
+def soft_label_rows(X, teacher_probs):
+    """
+    Soft targets as weighted hard labels: every row once per class, weighted by the teacher's
+    probability for it. Multiclass log-loss over these rows is the cross-entropy against the
+    teacher's distribution, so a plain multi:softprob booster learns the soft outputs.
+    """
+    n, n_classes = teacher_probs.shape
+    X_rep = np.repeat(X, n_classes, axis=0)
+    y_rep = np.tile(np.arange(n_classes), n)
+    w_rep = teacher_probs.reshape(-1)
+    keep = w_rep > 1e-6
+    return X_rep[keep], y_rep[keep], w_rep[keep]
+
+
+def train_student(X, teacher_probs, feature_names, n_trees=200, max_depth=4, learning_rate=0.3, threads=0):
+    """
+    One small XGBoost booster fitted to the stack's class probabilities (see soft_label_rows).
+
+    The stack's rows need not sum to 1 (its mean includes a 0.5 placeholder for a missing base model);
+    the student learns the normalized distribution and keeps the row sum as its 'output_scale' attribute.
+    """
+    import xgboost as xgb
+
+    row_sums = teacher_probs.sum(axis=1)
+    X_rep, y_rep, w_rep = soft_label_rows(np.asarray(X, dtype=np.float32), teacher_probs / row_sums[:, None])
+    dtrain = xgb.DMatrix(X_rep, label=y_rep, weight=w_rep, feature_names=list(feature_names))
+    params = {
+        'objective': 'multi:softprob',
+        'num_class': teacher_probs.shape[1],
+        'max_depth': max_depth,
+        'eta': learning_rate,
+        'tree_method': 'hist',
+        'eval_metric': 'mlogloss',
+        'seed': 42,
+    }
+    if threads: params['nthread'] = threads
+    booster = xgb.train(params, dtrain, num_boost_round=n_trees)
+    booster.set_attr(output_scale=repr(float(row_sums.mean())))
+    return booster
+
+
+def output_scale(booster):
+    return float(booster.attr('output_scale') or 1.0)
+
+
+def fidelity(student_probs, teacher_probs):
+    """
+    How closely the student's class probabilities track the teacher's.
+    """
+    diff = np.abs(student_probs - teacher_probs)
+    return {
+        'mean_abs_diff': diff.mean(axis=0).round(5).tolist(),
+        'max_abs_diff': diff.max(axis=0).round(5).tolist(),
+        'top_class_agreement': round(float(np.mean(student_probs.argmax(axis=1) == teacher_probs.argmax(axis=1))), 5),
+    }
+
+
+def save(booster, report, model_dir):
+    """
+    Writes the student and its report (the report first: a student never appears without one).
+    """
+    report_path = os.path.join(model_dir, REPORT_FILE)
+    tmp = f"{report_path}.tmp-{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp, report_path)
+
+    model_path = os.path.join(model_dir, MODEL_FILE)
+    tmp = f"{model_path}.tmp-{os.getpid()}.json"
+    booster.save_model(tmp)
+    os.replace(tmp, model_path)
+    return model_path
+
+
+def read_report(model_dir):
+    path = os.path.join(model_dir, REPORT_FILE)
+    if not os.path.exists(path): return None
+    with open(path) as f:
+        return json.load(f)
@@ -0,0 +1,129 @@
+import math
+import numpy as np
+
+# Raw clinical inputs the intake form sends (missing ones are imputed as 0)
+BASE_FEATURES = [
+    'age', 'sex', 'seizures', 'memory_loss', 'psychiatric_symptoms',
+    'skin_blisters', 'mucosal_ulcers', 'pain_score', 'csf_protein',
+    'csf_cells', 'antibody_titer', 'dsg1_index', 'dsg3_index',
+    'mri_abnormal', 'eeg_abnormal', 'tumor_status', 'infection_status'
+]
+
+# Derived features: name -> (dependencies, kernel over float64 columns)
+# Order matters: a feature may only depend on inputs or on features listed above it.
+DERIVED_FEATURES = {
+    # --- Model 1 (CSF / imaging) ---
+    'csf_protein_log': (('csf_protein',), lambda c: np.log1p(c['csf_protein'])),
+    'csf_cells_log': (('csf_cells',), lambda c: np.log1p(c['csf_cells'])),
+    'csf_inflammation': (('csf_protein', 'csf_cells'), lambda c: c['csf_protein'] * c['csf_cells']),
+    'csf_ratio': (('csf_protein', 'csf_cells'), lambda c: c['csf_protein'] / (c['csf_cells'] + 1)),
+    'imaging_score': (('mri_abnormal', 'eeg_abnormal'), lambda c: c['mri_abnormal'] + c['eeg_abnormal']),
+    'age_x_csf': (('age', 'csf_protein'), lambda c: c['age'] * c['csf_protein']),
+
+    # --- Model 2 (symptoms) ---
+    'neuro_score': (('seizures', 'memory_loss', 'psychiatric_symptoms'),
+                    lambda c: c['seizures'] + c['memory_loss'] + c['psychiatric_symptoms']),
+    'skin_score': (('skin_blisters', 'mucosal_ulcers'), lambda c: c['skin_blisters'] + c['mucosal_ulcers']),
+    'total_symptoms': (('neuro_score', 'skin_score'), lambda c: c['neuro_score'] + c['skin_score']),
+    'clinical_contrast': (('neuro_score', 'skin_score'), lambda c: c['neuro_score'] - c['skin_score']),
+    'pain_x_skin': (('pain_score', 'skin_score'), lambda c: c['pain_score'] * c['skin_score']),
+    'symptom_severity': (('total_symptoms', 'pain_score'), lambda c: c['total_symptoms'] * c['pain_score']),
+
+    # --- Model 3 (interactions) ---
+    'neuro_x_csf': (('neuro_score', 'csf_protein'), lambda c: c['neuro_score'] * c['csf_protein']),
+    'skin_x_pain': (('skin_score', 'pain_score'), lambda c: c['skin_score'] * c['pain_score']),
+    'csf_product': (('csf_protein', 'csf_cells'), lambda c: c['csf_protein'] * c['csf_cells']),
+
+    # Legacy placeholder
+    'spurious_marker': ((), lambda c: 0.0),
+}
+
+# Derived features surfaced to clinicians (results page, PDF report) even if no model uses them
+REPORT_FEATURES = ['neuro_score', 'csf_ratio', 'imaging_score', 'skin_score']
+
+
+def _to_number(value):
+    """
+    Mirrors pd.to_numeric(errors='coerce').fillna(0) for a single value.
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if math.isnan(value) else value
+
+
+class FeatureSchema:
+    """
+    Feature layout compiled once from the loaded models.
+
+    Every request is engineered into ONE contiguous float32 matrix (rows x columns);
+    each model then reads its own fixed column-index permutation out of it.
+    """
+    def __init__(self, model_columns, report_columns=REPORT_FEATURES):
+        # model_columns: {model_key: [feature names] or None (= every known feature)}
+        wanted = list(report_columns)
+        for cols in model_columns.values():
+            wanted.extend(cols if cols is not None else list(DERIVED_FEATURES))
+
+        # 1. Resolve which derived kernels we actually need (transitively)
+        needed = set()
+        stack = [c for c in wanted if c in DERIVED_FEATURES]
+        while stack:
+            name = stack.pop()
+            if name in needed: continue
+            needed.add(name)
+            stack.extend(d for d in DERIVED_FEATURES[name][0] if d in DERIVED_FEATURES)
+
+        # 2. Inputs: the base features plus anything a model expects that we cannot derive
+        self.inputs = list(BASE_FEATURES)
+        for c in wanted:
+            if c not in DERIVED_FEATURES and c not in self.inputs:
+                self.inputs.append(c)
+
+        self.derived = [name for name in DERIVED_FEATURES if name in needed]
+        self.columns = self.inputs + self.derived
+        self.positions = {name: i for i, name in enumerate(self.columns)}
+
+        # 3. Per-model column permutations over the shared matrix
+        self.names = {}
+        self.index = {}
+        for key, cols in model_columns.items():
+            cols = list(cols) if cols is not None else list(self.columns)
+            self.names[key] = cols
+            self.index[key] = np.array([self.positions[c] for c in cols], dtype=np.intp)
+
+    def transform(self, records):
+        """
+        Vectorized feature kernel: list of clinical dicts -> (N, len(columns)) float32 matrix.
+        """
+        n = len(records)
+        raw = np.array(
+            [[_to_number(rec.get(name)) for name in self.inputs] for rec in records],
+            dtype=np.float64,
+        ).reshape(n, len(self.inputs))
+
+        cols = {name: raw[:, i] for i, name in enumerate(self.inputs)}
+        X = np.empty((n, len(self.columns)), dtype=np.float32)
+        X[:, :len(self.inputs)] = raw
+
+        for offset, name in enumerate(self.derived, start=len(self.inputs)):
+            cols[name] = DERIVED_FEATURES[name][1](cols)
+            X[:, offset] = cols[name]
+        return X
+
+    def take(self, X, model_key):
+        """
+        Contiguous (N, n_model_features) view-copy in the model's own column order.
+        """
+        return X.take(self.index[model_key], axis=1)
+
+    def column(self, X, name):
+        return X[:, self.positions[name]]
+
+    def to_records(self, X):
+        """
+        Row dicts for persistence; float32 values are rendered at their shortest repr (60.3, not 60.2999...).
+        """
+        values = X.astype(str).astype(np.float64)
+        return [dict(zip(self.columns, row)) for row in values.tolist()]
@@ -0,0 +1,122 @@
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from ..models import InferenceJob
+from . import diagnosis
+from .admission import Overloaded
+from .diagnosis import explain_session, fail_sessions, run_diagnosis
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(session):
+    """
+    Queues a saved (pending) session for the inference workers.
+    """
+    return InferenceJob.objects.create(session=session, stage='queued')
+
+
+def worker_name(index=0):
+    return f"{socket.gethostname()}:{os.getpid()}:{index}"
+
+
+def claim_next(worker):
+    """
+    Atomically takes the oldest queued job that is due. The conditional UPDATE makes the claim
+    safe across processes without row locks (works on SQLite and Postgres alike).
+    """
+    while True:
+        due = Q(available_at__isnull=True) | Q(available_at__lte=timezone.now())
+        job_id = (InferenceJob.objects.filter(due, status='queued')
+                  .order_by('created_at', 'id').values_list('id', flat=True).first())
+        if job_id is None: return None
+
+        claimed = InferenceJob.objects.filter(id=job_id, status='queued').update(
+            status='running', stage='starting', worker=worker, started_at=timezone.now(),
+            attempts=F('attempts') + 1
+        )
+        if claimed:
+            return InferenceJob.objects.select_related('session').get(id=job_id)
+        # Another worker won the race, try the next one
+
+
+def set_stage(job, stage):
+    InferenceJob.objects.filter(id=job.id).update(stage=stage)
+
+
+def process(job, engine=None):
+    """
+    Runs one claimed job and records its outcome on the job row (a failed job fails its session too).
+    Returns True when done, False when failed, None when admission control deferred it.
+    """
+    try:
+        set_stage(job, 'inference')
+        ai_result = run_diagnosis(job.session, engine)
+        if diagnosis.EXPLANATIONS == 'background':
+            # The result is already readable; the job finishes once its explanations are stored too
+            set_stage(job, 'explaining')
+            ai_result = {**ai_result, **explain_session(job.session, engine)}
+        InferenceJob.objects.filter(id=job.id).update(
+            status='done', stage='done', finished_at=timezone.now(), error='',
+            result={'grad_cam': ai_result.get('grad_cam'), 'shap_features': ai_result.get('shap_features')}
+        )
+        return True
+    except Overloaded as e:
+        # At capacity is not a failure: back in the queue after Retry-After, without using up an attempt
+        logger.warning(f"⏳ Job {job.id} (session {job.session_id}) deferred {e.retry_after} s: {e}")
+        InferenceJob.objects.filter(id=job.id).update(
+            status='queued', stage='deferred', worker='', attempts=F('attempts') - 1,
+            available_at=timezone.now() + timedelta(seconds=e.retry_after)
+        )
+        return None
+    except Exception as e:
+        logger.exception(f"❌ Job {job.id} (session {job.session_id}) failed")
+        InferenceJob.objects.filter(id=job.id).update(
+            status='failed', stage='failed', finished_at=timezone.now(), error=str(e)
+        )
+        fail_sessions(job.session_id)
+        return False
+
+
+def requeue_stale(max_age_seconds, max_attempts=3):
+    """
+    Returns jobs left 'running' by a crashed worker to the queue (or fails them after max_attempts).
+    """
+    cutoff = timezone.now() - timedelta(seconds=max_age_seconds)
+    stale = InferenceJob.objects.filter(status='running', started_at__lt=cutoff)
+    with transaction.atomic():
+        exhausted = stale.filter(attempts__gte=max_attempts)
+        session_ids = list(exhausted.values_list('session_id', flat=True))
+        failed = exhausted.update(
+            status='failed', stage='failed', finished_at=timezone.now(), error='Worker lost too many times'
+        )
+        fail_sessions(*session_ids)
+        requeued = stale.update(status='queued', stage='requeued', worker='')
+    return requeued, failed
+
+
+def work(worker, poll_interval=0.5, max_jobs=None, stop=None):
+    """
+    Worker loop: claim, run, repeat. Sleeps poll_interval when the queue is empty.
+    """
+    from .ai_engine import get_engine
+
+    done = 0
+    while (max_jobs is None or done < max_jobs) and not (stop and stop.is_set()):
+        job = claim_next(worker)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        # Looked up per job: a hot reload swaps the process-wide engine
+        ok = process(job, get_engine())
+        if ok is None: continue
+        logger.info(f"{'✅' if ok else '❌'} [{worker}] session {job.session_id} {'done' if ok else 'failed'}")
+        done += 1
+    return done
@@ -0,0 +1,39 @@
+import os
+import sys
+
+# smaps_rollup fields (kB) we report; USS = private pages only this process holds
+_SMAPS_FIELDS = ('Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty', 'Swap')
+
+
+def process_memory(pid='self'):
+    """
+    Memory of one process in MB: rss, pss, uss (private) and shared.
+    USS is what the process would free on exit, so it shows whether preloaded models really are shared.
+    Linux reads /proc/<pid>/smaps_rollup; elsewhere only the peak RSS is available.
+    """
+    path = f"/proc/{pid}/smaps_rollup"
+    if os.path.exists(path):
+        kb = {}
+        with open(path) as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                if key in _SMAPS_FIELDS:
+                    kb[key] = int(rest.split()[0])
+        mb = lambda *keys: round(sum(kb.get(k, 0) for k in keys) / 1024, 1)
+        return {
+            'pid': os.getpid() if pid == 'self' else int(pid),
+            'rss_mb': mb('Rss'),
+            'pss_mb': mb('Pss'),
+            'uss_mb': mb('Private_Clean', 'Private_Dirty'),
+            'shared_mb': mb('Shared_Clean', 'Shared_Dirty'),
+            'swap_mb': mb('Swap'),
+        }
+
+    try:
+        import resource # Not available on Windows
+    except ImportError:
+        return {'pid': os.getpid()}
+    # ru_maxrss is kB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {'pid': os.getpid(), 'peak_rss_mb': round(peak / scale, 1)}
@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .result_cache import file_digest
+
+# ResNet50 input: 224x224 RGB, ImageNet normalization
+TARGET_SIZE = (224, 224)
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+# Large images are shrunk by whole factors first (JPEG: in the DCT domain while decoding), keeping at
+# least this multiple of the target size for the final bilinear pass
+REDUCING_GAP = 3.0
+
+# uint8 -> normalized float32 per channel; same float32 arithmetic as ToTensor() + Normalize()
+_LUT = ((np.arange(256, dtype=np.float32) / np.float32(255))[None, :] - MEAN[:, None]) / STD[:, None]
+# Per-thread model input buffers (see input_buffer)
+_buffers = threading.local()
+
+
+def decode(path, size=TARGET_SIZE):
+    """
+    Scan file -> (H, W, 3) uint8 RGB at the model's input size, without a full-resolution decode of big JPEGs.
+    """
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img.draft('RGB', (size[0] * REDUCING_GAP, size[1] * REDUCING_GAP))
+        rgb = img.convert('RGB').resize(size, Image.BILINEAR, reducing_gap=REDUCING_GAP)
+    return np.asarray(rgb)
+
+
+def normalize(rgb, out=None):
+    """
+    (H, W, 3) uint8 -> (3, H, W) float32 model input, one table lookup per pixel into the output buffer.
+    """
+    if out is None:
+        out = np.empty((3,) + rgb.shape[:2], dtype=np.float32)
+    for c in range(3):
+        np.take(_LUT[c], rgb[:, :, c], out=out[c])
+    return out
+
+
+def input_buffer(size=TARGET_SIZE):
+    """
+    This thread's preallocated (3, H, W) float32 model input, reused for every scan the thread preprocesses.
+    """
+    shape = (3, size[1], size[0])
+    buffer = getattr(_buffers, 'input', None)
+    if buffer is None or buffer.shape != shape:
+        buffer = _buffers.input = np.empty(shape, dtype=np.float32)
+    return buffer
+
+
+class MRIPreprocessor:
+    """
+    Decode + resize + normalize for the CNN, with the decoded scans memoized by file content.
+
+    Returns (input, display): the (3, 224, 224) float32 model input and the (224, 224, 3) uint8 RGB
+    image Grad-CAM draws on. The display image is shared with the cache (read-only). The input is the
+    calling thread's input_buffer(): valid until that thread preprocesses its next scan, and only ever
+    copied (torch.stack) by the CNN stage, so normalizing never allocates.
+    """
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def __call__(self, path, digest=None):
+        """
+        digest: the file's sha256 when the caller already has it (the file is then not hashed again).
+        """
+        if self.max_entries <= 0:
+            rgb = decode(path)
+            return normalize(rgb, input_buffer()), rgb
+
+        key = digest or file_digest(path)
+        with self._lock:
+            rgb = self._entries.get(key)
+            if rgb is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if rgb is None:
+            rgb = decode(path)
+            rgb.setflags(write=False)
+            with self._lock:
+                self._entries[key] = rgb
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return normalize(rgb, input_buffer()), rgb
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'max_entries': self.max_entries, 'hits': self.hits, 'misses': self.misses}
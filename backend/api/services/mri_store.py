@@ -0,0 +1,185 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from ..models import DiagnosticSession, MriBlob, MriUpload
+from .telemetry import count
+
+# Scans live under MEDIA_ROOT/<STORE_DIR>/ab/<sha256>.<ext>
+STORE_DIR = getattr(settings, 'AI_MRI_STORE_DIR', 'mri')
+# Seconds an unreferenced scan is kept before `manage.py gc_mri_store` deletes it
+GRACE_SECONDS = getattr(settings, 'AI_MRI_STORE_GRACE', 24 * 3600)
+# Extensions kept on stored names (the decoder reads the content; the extension is for browsers)
+EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+def blob_name(digest, ext=''):
+    """
+    Storage name of a scan, relative to MEDIA_ROOT.
+    """
+    return f"{STORE_DIR}/{digest[:2]}/{digest}{ext}"
+
+
+def extension(filename):
+    ext = os.path.splitext(filename or '')[1].lower()
+    return ext if ext in EXTENSIONS else ''
+
+
+def store(upload):
+    """
+    Adds an uploaded scan to the store and takes a reference on it. Identical content is written once;
+    a repeat upload only bumps the reference count. Returns the MriBlob.
+    """
+    digest = hashlib.sha256()
+    for chunk in upload.chunks():
+        digest.update(chunk)
+
+    def write(path):
+        with open(path, 'wb') as f:
+            for chunk in upload.chunks():
+                f.write(chunk)
+
+    return add(digest.hexdigest(), extension(upload.name), upload.size, write)
+
+
+def add(digest, ext, size, write):
+    """
+    Takes a reference on the scan with this sha256, creating its row and calling write(path) to put the
+    bytes on disk when the store does not hold them yet.
+    """
+    waited = 0
+    while True:
+        blob = MriBlob.objects.filter(sha256=digest).first()
+        if blob is None:
+            try:
+                with transaction.atomic():
+                    blob = MriBlob.objects.create(sha256=digest, file=blob_name(digest, ext), size=size)
+            except IntegrityError:
+                continue # The same scan arrived concurrently: take that row
+
+        # The reference comes first: the collector never deletes a referenced scan, so the file checked below stays.
+        # Zero rows means collect() is deleting this one (refcount -1): wait for the row to go, then store it anew.
+        if not MriBlob.objects.filter(id=blob.id, refcount__gte=0).update(refcount=F('refcount') + 1, last_used_at=timezone.now()):
+            waited += 1
+            # A tombstone still there after seconds was left by a collector that died midway
+            if waited > 100: MriBlob.objects.filter(id=blob.id, refcount__lt=0).delete()
+            time.sleep(0.05)
+            continue
+        blob.refcount += 1
+
+        path = blob.file.path
+        if os.path.exists(path):
+            count('immunoai_mri_store_total', outcome='deduplicated')
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Concurrent writers of one scan write the same bytes; the rename keeps readers off partial files
+            tmp = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+            write(tmp)
+            os.replace(tmp, path)
+            count('immunoai_mri_store_total', outcome='stored')
+        return blob
+
+
+def release(blob_id):
+    """
+    Drops one reference; the scan stays until the garbage collector finds it unreferenced past the grace period.
+    """
+    MriBlob.objects.filter(id=blob_id, refcount__gt=0).update(refcount=F('refcount') - 1, last_used_at=timezone.now())
+
+
+def session_fields(upload):
+    """
+    DiagnosticSession fields for an uploaded scan (stored first), or none without one.
+    """
+    if not upload: return {}
+    blob = store(upload)
+    return {'mri_scan': blob.file.name, 'mri_blob': blob}
+
+
+def remember_score(blob, cnn_probability, cnn_version):
+    """
+    Keeps a scan's CNN probability for its later duplicates (other processes and restarts included).
+    """
+    if blob is None or cnn_probability is None or not cnn_version or blob.cnn_version == cnn_version: return
+    MriBlob.objects.filter(id=blob.id).update(cnn_probability=cnn_probability, cnn_version=cnn_version)
+    blob.cnn_probability, blob.cnn_version = cnn_probability, cnn_version
+
+
+def gradcam_files(digest):
+    """
+    Grad-CAM overlays drawn for a scan (one per CNN build, see HybridAIEngine.gradcam_file).
+    """
+    directory = os.path.join(settings.MEDIA_ROOT, 'grad_cam', digest[:2])
+    if not os.path.isdir(directory): return []
+    return [os.path.join(directory, name) for name in os.listdir(directory) if name.startswith(f"{digest}-")]
+
+
+def recount():
+    """
+    Resets every refcount to the number of sessions (and finalized uploads awaiting one) that point at the scan
+    (drift from deleted users, crashed requests). Returns how many were off.
+    """
+    drifted = 0
+    counted = MriBlob.objects.filter(refcount__gte=0).annotate(
+        actual=Count('sessions', distinct=True) + Count('uploads', filter=Q(uploads__status='complete'), distinct=True)
+    )
+    for blob_id, refcount, actual in counted.values_list('id', 'refcount', 'actual'):
+        if refcount != actual:
+            MriBlob.objects.filter(id=blob_id).update(refcount=actual)
+            drifted += 1
+    return drifted
+
+
+def collect(grace_seconds=GRACE_SECONDS, dry_run=False):
+    """
+    Deletes scans that have been unreferenced for grace_seconds, with their Grad-CAM overlays.
+    Returns (scans, bytes, overlays).
+    """
+    cutoff = timezone.now() - timedelta(seconds=grace_seconds)
+    scans = freed = overlays = 0
+    for blob in MriBlob.objects.filter(refcount__lte=0, last_used_at__lt=cutoff):
+        files = [blob.file.path, *gradcam_files(blob.sha256)]
+        if not dry_run:
+            # 1. Tombstone (refcount -1): only if no store() took a reference since the query, and none can now
+            if not MriBlob.objects.filter(id=blob.id, refcount__lte=0, last_used_at__lt=cutoff).update(refcount=-1): continue
+            # 2. A session or upload may still point at it when the count had drifted low
+            holders = (DiagnosticSession.objects.filter(mri_blob=blob).count()
+                       + MriUpload.objects.filter(blob=blob, status='complete').count())
+            if holders:
+                MriBlob.objects.filter(id=blob.id).update(refcount=holders)
+                continue
+            # 3. Files first, then the row (a store() waiting on the tombstone writes the scan again)
+            for path in files:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            MriBlob.objects.filter(id=blob.id).delete()
+        scans += 1
+        freed += blob.size
+        overlays += len(files) - 1
+    return scans, freed, overlays
+
+
+def orphans(grace_seconds=GRACE_SECONDS):
+    """
+    Files under the store with no MriBlob row (interrupted writes), older than grace_seconds.
+    """
+    root = os.path.join(settings.MEDIA_ROOT, STORE_DIR)
+    known = set(MriBlob.objects.values_list('file', flat=True))
+    cutoff = time.time() - grace_seconds
+    found = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            name = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+            if name not in known and os.path.getmtime(path) < cutoff:
+                found.append(path)
+    return found
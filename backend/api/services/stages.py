@@ -0,0 +1,67 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+
+# Booster predictions, torch kernels and image decoding release the GIL, so a few threads overlap them well
+STAGE_THREADS = getattr(settings, 'AI_STAGE_THREADS', min(4, (os.cpu_count() or 1) - 1))
+# The CNN stage waits on the micro-batcher and holds its thread for the whole forward pass: it gets its own pool,
+# so cheap tabular and SHAP stages of other requests never queue behind it (and concurrent scans can batch)
+CNN_STAGE_THREADS = getattr(settings, 'AI_CNN_STAGE_THREADS', 8)
+THREAD_PREFIX = 'ai-stage'
+LANES = {'stage': STAGE_THREADS, 'cnn': CNN_STAGE_THREADS}
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # Threads never survive fork(): a worker forked from a preloaded parent starts its own pool
+    global _pools, _pool_lock
+    _pools = {}
+    _pool_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def pool(lane='stage'):
+    """
+    The process-wide pool of a lane (None when its thread count is 0).
+    """
+    threads = LANES[lane]
+    if threads <= 0: return None
+    if lane not in _pools:
+        with _pool_lock:
+            if lane not in _pools:
+                _pools[lane] = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f"{THREAD_PREFIX}-{lane}")
+    return _pools[lane]
+
+
+def submit(fn, *args, **kwargs):
+    """
+    Runs one pipeline stage on the shared pool, inside a copy of the caller's context (request trace).
+
+    Stages are leaves: only the request thread fans out and joins, so a saturated pool cannot deadlock.
+    A stage submitted from inside a pool, or with the pool disabled, runs inline.
+    """
+    return submit_to('stage', fn, *args, **kwargs)
+
+
+def submit_to(lane, fn, *args, **kwargs):
+    """
+    submit() on a given lane's pool ('stage' or 'cnn').
+    """
+    ctx = contextvars.copy_context()
+    executor = pool(lane)
+    if executor is not None and not threading.current_thread().name.startswith(THREAD_PREFIX):
+        return executor.submit(ctx.run, fn, *args, **kwargs)
+
+    future = Future()
+    try:
+        future.set_result(ctx.run(fn, *args, **kwargs))
+    except Exception as e:
+        future.set_exception(e)
+    return future
@@ -0,0 +1,56 @@
+import numpy as np
+
+from .feature_schema import BASE_FEATURES
+
+# Clinical ranges for intake fields no booster records (calibration-only markers and unused history flags)
+FALLBACK_RANGES = {
+    'age': (1, 84),
+    'dsg1_index': (0.0, 60.0),
+    'dsg3_index': (0.0, 60.0),
+    'antibody_titer': (0.0, 100.0),
+    'tumor_status': (0, 1),
+    'infection_status': (0, 1),
+}
+
+
+def feature_ranges(engine):
+    """
+    (min, max) per raw intake field, from the training ranges LightGBM keeps in its model file.
+    """
+    ranges = dict(FALLBACK_RANGES)
+    booster = engine.models.get('lgbm')
+    if booster is not None:
+        booster = getattr(booster, 'booster_', booster)
+        infos = booster.dump_model(num_iteration=1).get('feature_infos', {})
+        for name, info in infos.items():
+            if name in BASE_FEATURES and 'min_value' in info:
+                ranges[name] = (info['min_value'], info['max_value'])
+    return ranges
+
+
+def sample_records(engine, n, rng=None):
+    """
+    n synthetic intake forms, each field drawn uniformly over its training range
+    (integer fields stay integers). Good for agreement/fidelity checks, not for training.
+    """
+    rng = rng if rng is not None else np.random.default_rng(42)
+    ranges = feature_ranges(engine)
+    columns = {}
+    for name in BASE_FEATURES:
+        low, high = ranges.get(name, (0, 1))
+        if float(low).is_integer() and float(high).is_integer():
+            columns[name] = rng.integers(int(low), int(high) + 1, n).tolist()
+        else:
+            columns[name] = np.round(rng.uniform(low, high, n), 1).tolist()
+    return [{name: columns[name][i] for name in BASE_FEATURES} for i in range(n)]
+
+
+def stored_records(limit, disease_type=None):
+    """
+    Clinical data of past sessions (newest first): the realistic benchmark set when there is enough of it.
+    """
+    from ..models import DiagnosticSession
+
+    sessions = DiagnosticSession.objects.exclude(clinical_data={}).order_by('-created_at')
+    if disease_type: sessions = sessions.filter(disease_type=disease_type)
+    return [(s.clinical_data, s.disease_type) for s in sessions[:limit]]
@@ -0,0 +1,145 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets (seconds): sub-millisecond cache hits up to multi-second CNN + Grad-CAM runs
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_histograms = {} # (name, labels) -> [bucket counts..., +Inf count, sum]
+_counters = {} # (name, labels) -> value
+_help = {}
+_buckets = {} # name -> bucket bounds, for histograms that do not measure seconds
+
+# Timings of the request currently being traced (None when nobody asked for them)
+_trace = contextvars.ContextVar('ai_trace', default=None)
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def describe(name, text, buckets=None):
+    _help[name] = text
+    if buckets is not None: _buckets[name] = tuple(buckets)
+
+
+def observe(name, value, **labels):
+    key = (name, _labels(labels))
+    bounds = _buckets.get(name, BUCKETS)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(bounds) + 1) + [0.0]
+        hist[bisect.bisect_left(bounds, value)] += 1
+        hist[-1] += value
+
+
+def count(name, value=1, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+@contextmanager
+def span(stage, **labels):
+    """
+    Times one pipeline stage into the immunoai_stage_seconds histogram (and the active trace, if any).
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe('immunoai_stage_seconds', elapsed, stage=stage, **labels)
+        timings = _trace.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+@contextmanager
+def trace(enabled=True):
+    """
+    Collects {stage: seconds} for everything timed inside the block (same thread / context).
+    """
+    if not enabled:
+        yield None
+        return
+    timings = {}
+    token = _trace.set(timings)
+    try:
+        yield timings
+    finally:
+        _trace.reset(token)
+
+
+def server_timing(timings):
+    """
+    Server-Timing header value, e.g. 'features;dur=0.41, xgb;dur=1.92'.
+    """
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items())
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs: return ''
+    escape = lambda v: v.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in pairs) + '}'
+
+
+def render_prometheus(gauges=None):
+    """
+    Prometheus text exposition (v0.0.4) of this process's counters, histograms and the given gauges.
+    """
+    with _lock:
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        counters = dict(_counters)
+
+    lines, typed = [], set()
+    def header(name, kind):
+        if name in typed: return
+        typed.add(name)
+        if name in _help: lines.append(f"# HELP {name} {_help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, 'counter')
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), hist in sorted(histograms.items()):
+        header(name, 'histogram')
+        bounds = _buckets.get(name, BUCKETS)
+        cumulative = 0
+        for bound, bucket in zip(bounds, hist):
+            cumulative += bucket
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', repr(bound))])} {cumulative}")
+        cumulative += hist[len(bounds)]
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {hist[-1]}")
+        lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+    for name, samples in sorted((gauges or {}).items()):
+        header(name, 'gauge')
+        for labels, value in samples:
+            lines.append(f"{name}{_format_labels(_labels(labels))} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+describe('immunoai_stage_seconds', "Latency of each diagnostic pipeline stage")
+describe('immunoai_predictions_total', "Predictions served, by disease type and source (model or cache)")
+describe('immunoai_stage_errors_total', "Pipeline stages that fell back after an error")
+describe('immunoai_cnn_skipped_total', "AE scans the cascade left unscored because the tabular ensemble was decisive")
+describe('immunoai_cnn_dedup_total', "AE scans whose content the CNN had already scored (no forward pass, overlay reused)")
+describe('immunoai_mri_store_total', "MRI uploads added to the content-addressed store: stored (new content) or deduplicated")
+describe('immunoai_uploads_total', "Resumable MRI uploads: created, finalized, or rejected on a (chunk) checksum mismatch")
+describe('immunoai_upload_bytes_total', "Bytes written by resumable upload chunks")
+describe('immunoai_early_exit_total', "Rows LightGBM settled alone (exit) or sent on to the full stack")
+describe('immunoai_admission_total', "Inference admission decisions per model family: admitted at once, queued then admitted, or rejected (queue full / wait timeout)")
+describe('immunoai_admission_wait_seconds', "Time queued requests waited for an inference slot")
+describe('immunoai_model_reloads_total', "Background model reloads: swapped in, unchanged content, or failed (old models kept)")
+describe('immunoai_fast_verify_total', "Fast-tier rows re-scored by the full stack, by whether the decision agreed")
+describe('immunoai_fast_verify_abs_diff', "Largest class-probability gap between the fast tier and the full stack, per verified row",
+         buckets=(0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0))
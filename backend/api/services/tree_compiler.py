@@ -0,0 +1,324 @@
+import json
+import os
+import numpy as np
+
+# LightGBM treats |x| <= kZeroThreshold as zero for "Zero" missing handling
+K_ZERO_THRESHOLD = 1e-35
+
+# Missing-value rules per node
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+
+# Rows per traversal chunk; keeps the (rows x trees) index arrays cache-resident
+CHUNK_ROWS = 256
+
+ARRAY_NAMES = ['feature', 'threshold', 'children', 'default_left', 'missing', 'value', 'roots', 'class_matrix', 'base_score']
+
+
+class CompiledForest:
+    """
+    Array-backed tree ensemble.
+
+    Every tree of the booster is flattened into one node table
+    (feature, threshold, [left, right], default_left, missing rule, leaf value).
+    Leaves point to themselves, so a fixed number of vectorized steps
+    (the deepest tree's depth) walks all rows through all trees at once.
+    """
+    def __init__(self, arrays, meta):
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.meta = meta
+        self.kind = meta['kind']
+        self.objective = meta['objective']
+        self.n_classes = meta['n_classes']
+        self.max_depth = meta['max_depth']
+        self.feature_names = meta['feature_names']
+        self.sigmoid = meta.get('sigmoid', 1.0)
+        # XGBoost: x < threshold goes left. LightGBM: x <= threshold goes left.
+        self._strict = self.kind == 'xgboost'
+        self._zero_rule = bool(np.any(self.missing == MISSING_ZERO))
+
+    # --- Inference ---
+
+    def predict_margin(self, X):
+        """
+        Raw scores, shape (N, n_classes). Rows are walked in cache-sized chunks.
+        """
+        X = np.ascontiguousarray(X, dtype=self.threshold.dtype)
+        if len(X) <= CHUNK_ROWS:
+            return self._walk(X)
+        return np.vstack([self._walk(X[i:i + CHUNK_ROWS]) for i in range(0, len(X), CHUNK_ROWS)])
+
+    def _walk(self, X):
+        n, width = X.shape
+        flat = X.ravel()
+        offsets = (np.arange(n, dtype=np.intp) * width)[:, None]
+        check_missing = self._zero_rule or bool(np.isnan(flat).any())
+        children = self.children.ravel()
+
+        node = np.tile(self.roots, (n, 1))
+        for _ in range(self.max_depth):
+            x = flat[offsets + self.feature[node]]
+            thr = self.threshold[node]
+
+            if check_missing:
+                nan = np.isnan(x)
+                miss = self.missing[node]
+                x = np.where(nan & (miss != MISSING_NAN), 0, x)
+                use_default = ((miss == MISSING_ZERO) & (np.abs(x) <= K_ZERO_THRESHOLD)) | ((miss == MISSING_NAN) & nan)
+                go_right = (x >= thr) if self._strict else (x > thr)
+                go_right = np.where(use_default, ~self.default_left[node], go_right)
+            else:
+                go_right = (x >= thr) if self._strict else (x > thr)
+
+            # children is [left, right] per node, flattened: right child sits at 2*node + 1
+            node = children[2 * node + go_right]
+
+        return self.value[node] @ self.class_matrix + self.base_score
+
+    def predict_proba(self, X):
+        """
+        Class probabilities, shape (N, n_classes); binary models return (N, 2).
+        """
+        margin = self.predict_margin(X)
+        if self.objective == 'softmax':
+            margin = margin - margin.max(axis=1, keepdims=True)
+            exp = np.exp(margin)
+            return exp / exp.sum(axis=1, keepdims=True)
+        pos = 1.0 / (1.0 + np.exp(-self.sigmoid * margin[:, 0]))
+        return np.column_stack([1 - pos, pos])
+
+    def verify(self, booster, X, atol=1e-5):
+        """
+        Compares our probabilities with the original booster's on X.
+        Returns the max absolute difference; raises if it exceeds atol.
+        """
+        ours = self.predict_proba(X)
+        theirs = native_predict_proba(booster, X)
+        diff = float(np.max(np.abs(ours - theirs))) if len(X) else 0.0
+        if diff > atol:
+            raise AssertionError(f"Compiled {self.kind} forest diverges from booster by {diff:.2e}")
+        return diff
+
+    # --- Persistence ---
+
+    def save(self, directory):
+        """
+        One .npy per array plus meta.json, so the tables can be memory-mapped later.
+        """
+        os.makedirs(directory, exist_ok=True)
+        # Each file is written aside and renamed into place, meta.json last, so a process
+        # loading the cache while another one rebuilds it never maps a half-written table
+        tmp = f".tmp-{os.getpid()}"
+        for name in ARRAY_NAMES:
+            path = os.path.join(directory, f"{name}.npy")
+            with open(path + tmp, 'wb') as f:
+                np.save(f, getattr(self, name))
+            os.replace(path + tmp, path)
+        path = os.path.join(directory, 'meta.json')
+        with open(path + tmp, 'w') as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(path + tmp, path)
+
+    @classmethod
+    def load(cls, directory, mmap_mode=None):
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+        return cls(arrays, meta)
+
+
+def native_predict_proba(booster, X, threads=0):
+    """
+    Reference predictions from an xgboost/lightgbm Booster, shape (N, n_classes).
+    threads caps LightGBM's OpenMP threads per call (xgboost takes its 'nthread' from the booster params).
+    """
+    if type(booster).__module__.startswith('xgboost'):
+        probs = booster.inplace_predict(np.asarray(X, dtype=np.float32))
+    elif threads:
+        probs = booster.predict(X, num_threads=threads)
+    else:
+        probs = booster.predict(X)
+    probs = np.asarray(probs, dtype=np.float64)
+    if probs.ndim == 1:
+        probs = np.column_stack([1 - probs, probs])
+    return probs
+
+
+def _tree_depth(children, root):
+    depth, frontier = 0, [root]
+    while True:
+        nxt = [c for n in frontier for c in children[n] if c != n]
+        if not nxt: return depth
+        depth += 1
+        frontier = nxt
+
+
+def _assemble(trees, n_classes, threshold_dtype, meta):
+    """
+    Packs per-tree node lists into the flat tables.
+    trees: list of (class_id, feature, threshold, left, right, default_left, missing, value) with local indices.
+    """
+    feature, threshold, children, default_left, missing, value, roots = [], [], [], [], [], [], []
+    class_matrix = np.zeros((len(trees), n_classes), dtype=np.float64)
+    max_depth = 0
+
+    offset = 0
+    for t, (class_id, f, thr, left, right, dl, miss, val) in enumerate(trees):
+        size = len(f)
+        kids = np.column_stack([left, right]).astype(np.int64)
+        # Leaves (-1) loop back onto themselves
+        own = np.arange(size)
+        kids = np.where(kids < 0, own[:, None], kids)
+        max_depth = max(max_depth, _tree_depth(kids.tolist(), 0))
+
+        feature.append(np.asarray(f))
+        threshold.append(np.asarray(thr, dtype=threshold_dtype))
+        children.append(kids + offset)
+        default_left.append(np.asarray(dl, dtype=bool))
+        missing.append(np.asarray(miss, dtype=np.int8))
+        value.append(np.asarray(val, dtype=np.float64))
+        roots.append(offset)
+        class_matrix[t, class_id] = 1.0
+        offset += size
+
+    arrays = {
+        'feature': np.concatenate(feature).astype(np.intp),
+        'threshold': np.concatenate(threshold),
+        'children': np.ascontiguousarray(np.concatenate(children).astype(np.intp)),
+        'default_left': np.concatenate(default_left),
+        'missing': np.concatenate(missing),
+        'value': np.concatenate(value),
+        'roots': np.asarray(roots, dtype=np.intp),
+        'class_matrix': class_matrix,
+        'base_score': np.zeros(n_classes, dtype=np.float64),
+    }
+    meta = dict(meta, n_classes=n_classes, max_depth=max_depth, n_trees=len(trees), n_nodes=offset)
+    return arrays, meta
+
+
+def compile_xgboost(booster):
+    """
+    Flattens an xgboost Booster (gbtree, numeric splits) into a CompiledForest.
+    """
+    model = json.loads(booster.save_raw(raw_format='json'))
+    learner = model['learner']
+    objective = learner['objective']['name']
+    gbm = learner['gradient_booster']
+    if gbm['name'] != 'gbtree':
+        raise NotImplementedError(f"Unsupported XGBoost booster: {gbm['name']}")
+    if objective.startswith('multi:'):
+        kind = 'softmax'
+    elif objective in ('binary:logistic', 'reg:logistic'):
+        kind = 'sigmoid'
+    else:
+        raise NotImplementedError(f"Unsupported XGBoost objective: {objective}")
+
+    n_classes = max(1, int(learner['learner_model_param']['num_class']))
+    trees = []
+    for tree, class_id in zip(gbm['model']['trees'], gbm['model']['tree_info']):
+        if int(tree['tree_param'].get('size_leaf_vector', '1')) > 1 or any(tree['split_type']):
+            raise NotImplementedError("Vector leaves / categorical splits are not supported")
+        left = tree['left_children']
+        is_leaf = np.asarray(left) == -1
+        split = np.asarray(tree['split_conditions'], dtype=np.float64)
+        trees.append((
+            class_id,
+            np.where(is_leaf, 0, tree['split_indices']),
+            np.where(is_leaf, 0.0, split),
+            left,
+            tree['right_children'],
+            tree['default_left'],
+            np.full(len(left), MISSING_NAN),
+            np.where(is_leaf, split, 0.0),  # Leaf values live in split_conditions
+        ))
+
+    meta = {'kind': 'xgboost', 'objective': kind, 'feature_names': list(booster.feature_names or [])}
+    arrays, meta = _assemble(trees, n_classes, np.float32, meta)
+    forest = CompiledForest(arrays, meta)
+
+    # The intercept's encoding (probability vs margin) differs across XGBoost versions;
+    # probe it from the booster instead of re-implementing each convention.
+    probe = np.zeros((1, int(learner['learner_model_param']['num_feature'])), dtype=np.float32)
+    native_margin = np.asarray(booster.inplace_predict(probe, predict_type='margin'), dtype=np.float64).reshape(1, -1)
+    forest.base_score = (native_margin - forest.predict_margin(probe))[0]
+    forest.meta['base_score'] = forest.base_score.tolist()
+    return forest
+
+
+def compile_lightgbm(booster):
+    """
+    Flattens a LightGBM Booster (numeric splits, non-linear trees) into a CompiledForest.
+    """
+    lines = booster.model_to_string().splitlines()
+    header, blocks, current = {}, [], None
+    for line in lines:
+        if line.startswith('Tree='):
+            current = {}
+            blocks.append(current)
+        elif line == 'end of trees':
+            break
+        elif '=' in line:
+            key, _, val = line.partition('=')
+            (current if current is not None else header)[key] = val
+
+    objective = header.get('objective', '').split()
+    if not objective or objective[0] not in ('multiclass', 'softmax', 'binary'):
+        raise NotImplementedError(f"Unsupported LightGBM objective: {header.get('objective')}")
+    if 'average_output' in header:
+        raise NotImplementedError("LightGBM random-forest mode is not supported")
+    params = dict(p.split(':', 1) for p in objective[1:] if ':' in p)
+
+    per_iter = int(header.get('num_tree_per_iteration', 1))
+    n_classes = int(header.get('num_class', 1))
+    trees = []
+    for t, block in enumerate(blocks):
+        if int(block.get('num_cat', 0)) > 0 or int(block.get('is_linear', 0)):
+            raise NotImplementedError("Categorical / linear LightGBM trees are not supported")
+        num_leaves = int(block['num_leaves'])
+        leaf_value = np.array(block['leaf_value'].split(), dtype=np.float64)
+        n_internal = num_leaves - 1
+
+        if n_internal == 0:
+            # Single-leaf tree
+            trees.append((t % per_iter, [0], [0.0], [-1], [-1], [True], [MISSING_NONE], leaf_value))
+            continue
+
+        ints = lambda key: np.array(block[key].split(), dtype=np.int64)
+        decision = ints('decision_type')
+        # Children < 0 encode leaf ~child; leaves are appended after internal nodes
+        remap = lambda c: np.where(c < 0, n_internal + ~c, c)
+        pad = np.zeros(num_leaves)
+        trees.append((
+            t % per_iter,
+            np.concatenate([ints('split_feature'), pad.astype(np.int64)]),
+            np.concatenate([np.array(block['threshold'].split(), dtype=np.float64), pad]),
+            np.concatenate([remap(ints('left_child')), np.full(num_leaves, -1)]),
+            np.concatenate([remap(ints('right_child')), np.full(num_leaves, -1)]),
+            np.concatenate([(decision & 2) > 0, np.zeros(num_leaves, dtype=bool)]),
+            np.concatenate([(decision >> 2) & 3, np.zeros(num_leaves, dtype=np.int64)]),
+            np.concatenate([np.zeros(n_internal), leaf_value]),
+        ))
+
+    meta = {
+        'kind': 'lightgbm',
+        'objective': 'softmax' if per_iter > 1 else 'sigmoid',
+        'sigmoid': float(params.get('sigmoid', 1.0)),
+        'feature_names': header.get('feature_names', '').split(),
+    }
+    arrays, meta = _assemble(trees, max(n_classes, per_iter), np.float64, meta)
+    return CompiledForest(arrays, meta)
+
+
+def compile_booster(booster):
+    """
+    Dispatches on the booster's library; sklearn wrappers are unwrapped first.
+    """
+    if hasattr(booster, 'get_booster'): booster = booster.get_booster()
+    elif hasattr(booster, 'booster_'): booster = booster.booster_
+
+    module = type(booster).__module__
+    if module.startswith('xgboost'):
+        return compile_xgboost(booster)
+    if module.startswith('lightgbm'):
+        return compile_lightgbm(booster)
+    raise NotImplementedError(f"Cannot compile {type(booster).__name__}")
@@ -0,0 +1,218 @@
+import base64
+import hashlib
+import logging
+import os
+import re
+import shutil
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import MriUpload
+from . import mri_store
+from .result_cache import file_digest
+from .telemetry import count
+
+logger = logging.getLogger(__name__)
+
+# Partial uploads, outside MEDIA_ROOT (never served)
+UPLOAD_DIR = getattr(settings, 'AI_UPLOAD_DIR', os.path.join(settings.BASE_DIR, 'upload_parts'))
+MAX_SIZE = getattr(settings, 'AI_UPLOAD_MAX_SIZE', 200 * 1024 * 1024)
+MAX_CHUNK = getattr(settings, 'AI_UPLOAD_MAX_CHUNK', 16 * 1024 * 1024)
+EXPIRY_SECONDS = getattr(settings, 'AI_UPLOAD_EXPIRY', 24 * 3600)
+# A chunk writer that died keeps the upload locked this long
+LOCK_SECONDS = 60
+# Bytes read from the request per write: a chunk never sits in memory whole
+READ_SIZE = 64 * 1024
+# Per-chunk checksums (tus checksum extension: "Upload-Checksum: <algorithm> <base64 digest>")
+CHUNK_ALGORITHMS = ('sha1', 'sha256', 'md5')
+
+
+class UploadError(Exception):
+    """
+    A request the upload cannot take; status is the HTTP answer (460 = checksum mismatch, as in tus).
+    """
+    def __init__(self, message, status=400):
+        self.status = status
+        super().__init__(message)
+
+
+def part_path(upload):
+    return os.path.join(UPLOAD_DIR, f"{upload.id}.part")
+
+
+def create(owner, length, filename='', checksum=''):
+    """
+    Opens an upload of `length` bytes; checksum is the sha256 (hex) of the whole scan, if known up front.
+    """
+    try:
+        length = int(length)
+    except (TypeError, ValueError):
+        raise UploadError("length (or the Upload-Length header) must be the scan size in bytes")
+    if length <= 0: raise UploadError("length must be positive")
+    if length > MAX_SIZE: raise UploadError(f"Scans are limited to {MAX_SIZE} bytes", 413)
+    checksum = _sha256_hex(checksum)
+
+    upload = MriUpload.objects.create(
+        owner=owner, filename=os.path.basename(filename or '')[:255], length=length, checksum=checksum,
+        expires_at=timezone.now() + timedelta(seconds=EXPIRY_SECONDS)
+    )
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    open(part_path(upload), 'wb').close()
+    count('immunoai_uploads_total', outcome='created')
+    return upload
+
+
+def append(upload, offset, stream, content_length, chunk_checksum=''):
+    """
+    Writes one chunk at `offset`, streamed to disk READ_SIZE bytes at a time. Returns the new offset.
+    Bytes that arrived before a dropped connection are kept, so the client resumes from there -
+    unless the chunk carried a checksum, which only a whole chunk can match.
+    """
+    if upload.status != 'uploading': raise UploadError(f"Upload is {upload.status}", 409)
+    if offset != upload.offset: raise UploadError(f"Upload-Offset {offset} does not match the upload's offset {upload.offset}", 409)
+    if content_length > MAX_CHUNK: raise UploadError(f"Chunks are limited to {MAX_CHUNK} bytes", 413)
+    if offset + content_length > upload.length: raise UploadError("Chunk runs past Upload-Length", 413)
+    algorithm, expected = _chunk_checksum(chunk_checksum)
+    _lock(upload, offset)
+
+    digest = hashlib.new(algorithm) if algorithm else None
+    written, dropped = 0, None
+    try:
+        with open(part_path(upload), 'r+b') as f:
+            f.seek(offset)
+            try:
+                while written < content_length:
+                    piece = stream.read(min(READ_SIZE, content_length - written))
+                    if not piece: break
+                    f.write(piece)
+                    written += len(piece)
+                    if digest: digest.update(piece)
+            except OSError as e: # The client went away mid-chunk
+                dropped = e
+            if digest and (written < content_length or digest.digest() != expected):
+                written = 0
+            # Drops whatever an earlier, rejected chunk left past the offset
+            f.truncate(offset + written)
+    finally:
+        MriUpload.objects.filter(id=upload.id).update(offset=offset + written, locked_at=None)
+    upload.offset = offset + written
+    count('immunoai_upload_bytes_total', written)
+
+    if dropped is not None:
+        logger.info(f"📶 Upload {upload.id}: connection dropped at {upload.offset}/{upload.length} bytes")
+    if digest and not written and content_length:
+        count('immunoai_uploads_total', outcome='chunk_checksum_mismatch')
+        raise UploadError("Chunk checksum mismatch", 460)
+    return upload.offset
+
+
+def finalize(upload, checksum=''):
+    """
+    Checks the complete scan against its sha256, if the client sent one (chunks can carry their own
+    Upload-Checksum instead), and moves it into the MRI store (the upload keeps the reference until a session
+    takes it over). Finalizing twice returns the same result.
+    """
+    if upload.status == 'complete': return upload
+    if upload.status != 'uploading': raise UploadError(f"Upload is {upload.status}", 409)
+    if upload.offset != upload.length:
+        raise UploadError(f"Only {upload.offset} of {upload.length} bytes received", 409)
+    expected = _sha256_hex(checksum) or upload.checksum
+    _lock(upload, upload.offset)
+
+    path = part_path(upload)
+    try:
+        digest = file_digest(path)
+        if expected and digest != expected:
+            os.remove(path)
+            upload.status = 'failed'
+            MriUpload.objects.filter(id=upload.id).update(status='failed', locked_at=None)
+            count('immunoai_uploads_total', outcome='checksum_mismatch')
+            raise UploadError("Checksum mismatch: the received scan does not match its sha256, upload it again", 460)
+
+        blob = mri_store.add(digest, mri_store.extension(upload.filename), upload.length,
+                             lambda target: shutil.move(path, target))
+        if os.path.exists(path): os.remove(path) # The store already had this scan
+    except UploadError:
+        raise
+    except Exception:
+        MriUpload.objects.filter(id=upload.id).update(locked_at=None)
+        raise
+
+    upload.status, upload.blob = 'complete', blob
+    MriUpload.objects.filter(id=upload.id).update(status='complete', blob=blob, locked_at=None)
+    count('immunoai_uploads_total', outcome='finalized')
+    return upload
+
+
+def attach(upload_id, owner):
+    """
+    DiagnosticSession fields for a finalized upload; its store reference passes to the session (once).
+    """
+    try:
+        upload = MriUpload.objects.filter(id=uuid.UUID(str(upload_id)), owner=owner).select_related('blob').first()
+    except ValueError:
+        upload = None
+    if upload is None: raise UploadError("Unknown upload_id", 404)
+    if not MriUpload.objects.filter(id=upload.id, status='complete').update(status='attached'):
+        raise UploadError(f"Upload is {upload.status}, not a finalized scan awaiting a session", 409)
+    return {'mri_scan': upload.blob.file.name, 'mri_blob': upload.blob}
+
+
+def detach(upload_id):
+    """
+    Undoes attach() for a session dropped before it was scored (e.g. 429): the upload is finalized again and
+    keeps its store reference, so the client can retry with the same upload_id.
+    """
+    MriUpload.objects.filter(id=uuid.UUID(str(upload_id)), status='attached').update(status='complete')
+
+
+def discard(upload):
+    """
+    Deletes an upload: its partial file, or its store reference once finalized.
+    """
+    if upload.status == 'complete': mri_store.release(upload.blob_id)
+    try:
+        os.remove(part_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+def expire():
+    """
+    Discards uploads past their expiry (attached ones only lose the row). Returns how many.
+    """
+    expired = MriUpload.objects.filter(expires_at__lt=timezone.now())
+    for upload in expired:
+        discard(upload)
+    return len(expired)
+
+
+def _lock(upload, offset):
+    # One writer per upload: a second PATCH (a client retrying too early) is turned away
+    stale = timezone.now() - timedelta(seconds=LOCK_SECONDS)
+    claimed = (MriUpload.objects.filter(Q(locked_at__isnull=True) | Q(locked_at__lt=stale))
+               .filter(id=upload.id, offset=offset, status='uploading').update(locked_at=timezone.now()))
+    if not claimed: raise UploadError("Another request is writing this upload, retry from its current offset", 409)
+
+
+def _sha256_hex(checksum):
+    checksum = (checksum or '').strip().lower()
+    if checksum and not re.fullmatch(r'[0-9a-f]{64}', checksum):
+        raise UploadError("checksum must be the sha256 of the scan in hex")
+    return checksum
+
+
+def _chunk_checksum(header):
+    if not header: return None, None
+    try:
+        algorithm, encoded = header.split()
+        expected = base64.b64decode(encoded, validate=True)
+    except ValueError:
+        raise UploadError("Upload-Checksum must be '<algorithm> <base64 digest>'")
+    if algorithm not in CHUNK_ALGORITHMS: raise UploadError(f"Upload-Checksum algorithm must be one of {', '.join(CHUNK_ALGORITHMS)}")
+    return algorithm, expected
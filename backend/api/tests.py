@@ -1,3 +1,1110 @@
-from django.test import TestCase
+import base64
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import DiagnosticSession, InferenceJob, MriBlob, MriUpload, User
+from .services import (admission, ai_engine, cnn_backends, diagnosis, distillation, job_queue, mri_preprocess, mri_store,
+                       result_cache, stages, tree_compiler, uploads)
+from .services.batching import MicroBatcher
+from .services.result_cache import ResultCache, result_key
+
+MODEL_DIR = os.path.join(settings.BASE_DIR, 'ml_models')
+# Tabular probabilities of the shipped AE models: decisive for the cascade, and one the CNN can still flip
+DECISIVE_AE = {'age': 35, 'csf_protein': 70, 'seizures': 1, 'memory_loss': 1} # 0.8
+UNDECIDED_AE = {'age': 40, 'csf_protein': 55, 'seizures': 1} # 0.6
+
+
+def engine_with_cnn(cnn_model=None):
+    """
+    A fresh engine (own caches) with the tabular models loaded and cnn_model standing in for the checkpoint.
+    """
+    engine = ai_engine.HybridAIEngine()
+    engine._ensure('tabular')
+    engine._loaded.add('cnn')
+    engine.cnn_model, engine.cnn_version = cnn_model, 'test' if cnn_model is not None else None
+    return engine
+
+
+def temp_dir(test):
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    return directory.name
+
+
+def scan_file(test, content=b'scan bytes'):
+    path = os.path.join(temp_dir(test), 'scan.png')
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path
+
+
+def cnn_model():
+    """
+    The AE CNN with seeded random weights (no checkpoint ships with the repo).
+    """
+    import torch
+    from .services.cnn import AE_CNN_Model
+
+    torch.manual_seed(0)
+    return AE_CNN_Model().eval()
+
+
+def png_scan(test, seed=0, size=(256, 256)):
+    from PIL import Image
+
+    path = scan_file(test, b'')
+    Image.fromarray(np.random.default_rng(seed).integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)).save(path)
+    return path
+
+
+# 1. Compiled forests (services/tree_compiler.py)
+class TreeCompilerTests(SimpleTestCase):
+    """
+    The NumPy node tables must give the boosters' own probabilities, missing values included.
+    """
+    def rows(self, n_features, n=512):
+        rng = np.random.default_rng(7)
+        X = rng.normal(0, 50, size=(n, n_features)).astype(np.float32)
+        X[rng.random(X.shape) < 0.1] = np.nan
+        return X
+
+    def check(self, booster, n_features):
+        forest = tree_compiler.compile_booster(booster)
+        X = self.rows(n_features)
+        np.testing.assert_allclose(forest.predict_proba(X), tree_compiler.native_predict_proba(booster, X), atol=1e-5)
+        self.assertLessEqual(forest.verify(booster, X), 1e-5)
+        return forest
+
+    def test_xgboost_matches_native(self):
+        import xgboost as xgb
+
+        booster = xgb.Booster()
+        booster.load_model(os.path.join(MODEL_DIR, 'xgb_model.json'))
+        self.check(booster, booster.num_features())
+
+    def test_lightgbm_matches_native(self):
+        import lightgbm as lgb
+
+        booster = lgb.Booster(model_file=os.path.join(MODEL_DIR, 'lgb_model.txt'))
+        self.check(booster, booster.num_feature())
+
+    def test_saved_tables_predict_the_same(self):
+        import xgboost as xgb
+
+        booster = xgb.Booster()
+        booster.load_model(os.path.join(MODEL_DIR, 'xgb_model.json'))
+        forest = self.check(booster, booster.num_features())
+        X = self.rows(booster.num_features(), 64)
+        with tempfile.TemporaryDirectory() as directory:
+            forest.save(directory)
+            loaded = tree_compiler.CompiledForest.load(directory, mmap_mode='r')
+            np.testing.assert_array_equal(loaded.predict_proba(X), forest.predict_proba(X))
+
+
+# 2. Result cache (services/result_cache.py)
+class ResultCacheTests(SimpleTestCase):
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ResultCache(max_entries=2, ttl=60)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_entries_expire_after_ttl(self):
+        cache = ResultCache(max_entries=4, ttl=10)
+        with mock.patch.object(result_cache.time, 'monotonic', return_value=100.0):
+            cache.put('a', 1)
+        with mock.patch.object(result_cache.time, 'monotonic', return_value=111.0):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_cached_values_are_copies(self):
+        cache = ResultCache()
+        value = {'shap_features': [1]}
+        cache.put('a', value)
+        value['shap_features'].append(2)
+        cache.get('a')['shap_features'].append(3)
+        self.assertEqual(cache.get('a'), {'shap_features': [1]})
+
+    def test_disabled_cache_stores_nothing(self):
+        cache = ResultCache(max_entries=0)
+        cache.put('a', 1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_key_covers_features_disease_scan_and_models(self):
+        row = np.array([0.0, 1.5, 2.0], dtype=np.float32)
+        key = result_key(row, 'AE', 'scan', 'models')
+        self.assertEqual(key, result_key(np.array([-0.0, 1.5, 2.0], dtype=np.float32), 'AE', 'scan', 'models'))
+        self.assertNotEqual(key, result_key(np.array([0.0, 1.5, 2.5], dtype=np.float32), 'AE', 'scan', 'models'))
+        self.assertNotEqual(key, result_key(row, 'PV', 'scan', 'models'))
+        self.assertNotEqual(key, result_key(row, 'AE', 'other scan', 'models'))
+        self.assertNotEqual(key, result_key(row, 'AE', 'scan', 'retrained models'))
+
+    def test_engine_serves_repeats_until_the_models_change(self):
+        from .services.ai_engine import HybridAIEngine
+
+        engine = HybridAIEngine()
+        clinical = {'age': 47, 'dsg1_index': 38, 'skin_blisters': 1}
+        first = engine.predict(clinical, disease_type='PV')
+        self.assertEqual(engine.predict(clinical, disease_type='PV'), first)
+        self.assertEqual(engine.result_cache.stats()['hits'], 1)
+
+        # New artifacts mean a new fingerprint: the old entries are never served again
+        engine._version = 'retrained'
+        engine.predict(clinical, disease_type='PV')
+        self.assertEqual(engine.result_cache.stats()['hits'], 1)
+
+
+# 3. Inference jobs (services/job_queue.py)
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user('patient', password='x', is_patient=True)
+
+    def queue(self):
+        session = DiagnosticSession.objects.create(patient=self.patient, disease_type='PV', clinical_data={'age': 40})
+        return job_queue.enqueue(session)
+
+    def test_claim_takes_the_oldest_job_once(self):
+        first, second = self.queue(), self.queue()
+        job = job_queue.claim_next('w1')
+        self.assertEqual((job.id, job.status, job.worker, job.attempts), (first.id, 'running', 'w1', 1))
+        self.assertEqual(job_queue.claim_next('w2').id, second.id)
+        self.assertIsNone(job_queue.claim_next('w3'))
+
+    def test_stale_job_is_requeued_then_failed(self):
+        job = self.queue()
+        job_queue.claim_next('w1')
+        InferenceJob.objects.filter(id=job.id).update(started_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(job_queue.requeue_stale(60, max_attempts=2), (1, 0))
+        self.assertEqual(InferenceJob.objects.get(id=job.id).status, 'queued')
+
+        job_queue.claim_next('w2')
+        InferenceJob.objects.filter(id=job.id).update(started_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(job_queue.requeue_stale(60, max_attempts=2), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.session.status, 'failed')
+
+    def test_recent_running_job_is_left_alone(self):
+        job = self.queue()
+        job_queue.claim_next('w1')
+        self.assertEqual(job_queue.requeue_stale(60), (0, 0))
+        self.assertEqual(InferenceJob.objects.get(id=job.id).status, 'running')
+
+    def test_failed_job_fails_its_session(self):
+        self.queue()
+        job = job_queue.claim_next('w1')
+        with mock.patch.object(job_queue, 'run_diagnosis', side_effect=RuntimeError('model missing')):
+            self.assertFalse(job_queue.process(job))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ('failed', 'model missing'))
+        self.assertEqual(DiagnosticSession.objects.get(id=job.session_id).status, 'failed')
+
+    def test_job_turned_away_at_capacity_is_deferred(self):
+        self.queue()
+        job = job_queue.claim_next('w1')
+        busy = admission.Overloaded('tabular', 'queue_full', 30)
+        with mock.patch.object(job_queue, 'run_diagnosis', side_effect=busy):
+            self.assertIsNone(job_queue.process(job))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.stage, job.attempts), ('queued', 'deferred', 0))
+        self.assertEqual(job.session.status, 'pending')
+        self.assertIsNone(job_queue.claim_next('w2'))
+
+        InferenceJob.objects.filter(id=job.id).update(available_at=timezone.now())
+        self.assertEqual(job_queue.claim_next('w2').id, job.id)
+
+
+# 4. Admission control (services/admission.py)
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AdmissionTests(TestCase):
+    """
+    A request turned away at capacity leaves nothing behind: no session, no reference on the scan.
+    """
+    def setUp(self):
+        self.patient = User.objects.create_user('patient', password='x', is_patient=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+        # One slot per family, already taken, and no queue
+        governor = admission.InferenceGovernor({'tabular': 1, 'cnn': 1}, queue_size=0, timeout=1)
+        patcher = mock.patch.object(admission, '_governor', governor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        busy = governor.admit(*admission.FAMILIES)
+        busy.__enter__()
+        self.addCleanup(busy.__exit__, None, None, None)
+
+    def test_rejected_predict_drops_session_and_scan_reference(self):
+        scan = SimpleUploadedFile('scan.png', b'not really a png', 'image/png')
+        response = self.client.post('/api/predict/', {
+            'disease_type': 'AE', 'clinical_data': '{"age": 33, "csf_protein": 61}', 'mri_scan': scan
+        }, format='multipart')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], str(response.data['retry_after']))
+        self.assertFalse(DiagnosticSession.objects.exists())
+        self.assertEqual(MriBlob.objects.get().refcount, 0)
+        self.assertEqual(admission.get_governor().stats()['tabular']['rejected'], 1)
+
+    async def test_rejected_stream_drops_session(self):
+        from asgiref.sync import sync_to_async
+        from django.test import AsyncClient
+
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.patient).access_token))()
+        response = await AsyncClient().post('/api/predict/stream/', {
+            'disease_type': 'PV', 'clinical_data': '{"age": 61, "dsg1_index": 12}'
+        }, headers={'Authorization': f'Bearer {token}'})
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(await DiagnosticSession.objects.aexists())
+
+
+# 5. Resumable uploads (services/uploads.py)
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class UploadTests(TestCase):
+    SCAN = bytes(range(256)) * 40
+
+    def setUp(self):
+        patcher = mock.patch.object(uploads, 'UPLOAD_DIR', tempfile.mkdtemp())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.patient = User.objects.create_user('patient', password='x', is_patient=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.patient)
+
+    def create(self, **body):
+        response = self.client.post('/api/uploads/', {'length': len(self.SCAN), 'filename': 'scan.png', **body}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['data']['upload_id']
+
+    def patch(self, upload_id, offset, chunk, checksum=None):
+        headers = {'HTTP_UPLOAD_OFFSET': str(offset)}
+        if checksum: headers['HTTP_UPLOAD_CHECKSUM'] = checksum
+        return self.client.generic('PATCH', f'/api/uploads/{upload_id}/', chunk,
+                                   content_type='application/offset+octet-stream', **headers)
+
+    def upload(self, **body):
+        upload_id = self.create(**body)
+        half = len(self.SCAN) // 2
+        self.assertEqual(self.patch(upload_id, 0, self.SCAN[:half])['Upload-Offset'], str(half))
+        self.assertEqual(self.patch(upload_id, half, self.SCAN[half:])['Upload-Offset'], str(len(self.SCAN)))
+        response = self.client.post(f'/api/uploads/{upload_id}/finalize/')
+        self.assertEqual(response.status_code, 200)
+        return upload_id
+
+    def predict(self, upload_id):
+        return self.client.post('/api/predict/', {
+            'disease_type': 'PV', 'clinical_data': '{"age": 58, "dsg1_index": 41}', 'upload_id': upload_id
+        }, format='json')
+
+    def test_chunks_assemble_into_the_stored_scan(self):
+        upload_id = self.upload(checksum=hashlib.sha256(self.SCAN).hexdigest())
+        upload = MriUpload.objects.select_related('blob').get(id=upload_id)
+        self.assertEqual((upload.status, upload.blob.refcount), ('complete', 1))
+        with open(upload.blob.file.path, 'rb') as f:
+            self.assertEqual(f.read(), self.SCAN)
+        self.assertFalse(os.path.exists(uploads.part_path(upload)))
+
+    def test_wrong_offset_is_refused(self):
+        upload_id = self.create()
+        self.patch(upload_id, 0, self.SCAN[:100])
+        self.assertEqual(self.patch(upload_id, 0, self.SCAN[:100]).status_code, 409)
+        self.assertEqual(self.client.get(f'/api/uploads/{upload_id}/').data['data']['offset'], 100)
+
+    def test_chunk_checksum_mismatch_keeps_nothing(self):
+        upload_id = self.create()
+        bad = 'sha256 ' + base64.b64encode(hashlib.sha256(b'other bytes').digest()).decode()
+        self.assertEqual(self.patch(upload_id, 0, self.SCAN[:100], bad).status_code, 460)
+        self.assertEqual(MriUpload.objects.get(id=upload_id).offset, 0)
+
+    def test_scan_checksum_mismatch_fails_the_upload(self):
+        upload_id = self.create(checksum=hashlib.sha256(b'another scan').hexdigest())
+        self.patch(upload_id, 0, self.SCAN)
+        self.assertEqual(self.client.post(f'/api/uploads/{upload_id}/finalize/').status_code, 460)
+        self.assertEqual(MriUpload.objects.get(id=upload_id).status, 'failed')
+        self.assertFalse(MriBlob.objects.exists())
+
+    def test_upload_attaches_to_one_session(self):
+        upload_id = self.upload()
+        response = self.predict(upload_id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(MriUpload.objects.get(id=upload_id).status, 'attached')
+        self.assertEqual(DiagnosticSession.objects.get().mri_blob.refcount, 1)
+        self.assertEqual(self.predict(upload_id).status_code, 409)
+
+    def test_rejected_predict_hands_the_upload_back(self):
+        upload_id = self.upload()
+        governor = admission.InferenceGovernor({'tabular': 1, 'cnn': 1}, queue_size=0, timeout=1)
+        with mock.patch.object(admission, '_governor', governor):
+            with governor.admit(*admission.FAMILIES):
+                self.assertEqual(self.predict(upload_id).status_code, 429)
+            upload = MriUpload.objects.select_related('blob').get(id=upload_id)
+            self.assertEqual((upload.status, upload.blob.refcount), ('complete', 1))
+            self.assertFalse(DiagnosticSession.objects.exists())
+
+            # The retry with the same upload_id goes through
+            self.assertEqual(self.predict(upload_id).status_code, 200)
+        self.assertEqual(MriUpload.objects.get(id=upload_id).status, 'attached')
+        self.assertEqual(MriBlob.objects.get().refcount, 1)
+
+
+# 6. MRI preprocessing (services/mri_preprocess.py)
+class MRIPreprocessTests(SimpleTestCase):
+    def setUp(self):
+        from PIL import Image
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        rng = np.random.default_rng(3)
+        self.paths = []
+        for i, size in enumerate([(1800, 1500), (300, 260), (224, 224)]):
+            path = os.path.join(self.directory, f'scan_{i}.jpg')
+            Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)).save(path, quality=90)
+            self.paths.append(path)
+
+    def test_scans_are_decoded_at_the_model_size(self):
+        for path in self.paths:
+            self.assertEqual(mri_preprocess.decode(path).shape, (224, 224, 3))
+
+    def test_normalize_matches_imagenet_normalization(self):
+        rgb = mri_preprocess.decode(self.paths[1])
+        expected = ((rgb.astype(np.float32) / np.float32(255) - mri_preprocess.MEAN) / mri_preprocess.STD).transpose(2, 0, 1)
+        np.testing.assert_allclose(mri_preprocess.normalize(rgb), expected, atol=1e-6)
+
+    def test_input_is_written_into_the_thread_buffer(self):
+        preprocess = mri_preprocess.MRIPreprocessor(4)
+        first, _ = preprocess(self.paths[0])
+        second, rgb = preprocess(self.paths[1])
+        self.assertIs(first, second)
+        self.assertIs(second, mri_preprocess.input_buffer())
+        np.testing.assert_array_equal(second, mri_preprocess.normalize(rgb))
+
+    def test_decoded_scans_are_memoized_by_content(self):
+        preprocess = mri_preprocess.MRIPreprocessor(2)
+        _, rgb = preprocess(self.paths[0])
+        self.assertIs(preprocess(self.paths[0], result_cache.file_digest(self.paths[0]))[1], rgb)
+        self.assertFalse(rgb.flags.writeable)
+        preprocess(self.paths[1])
+        preprocess(self.paths[2])
+        self.assertIsNot(preprocess(self.paths[0])[1], rgb)
+        self.assertEqual(preprocess.stats(), {'size': 2, 'max_entries': 2, 'hits': 1, 'misses': 4})
+
+
+# 7. CNN fusion and the cascade (services/ai_engine.py)
+class CNNFusionTests(SimpleTestCase):
+    """
+    Only a probability the CNN actually produced is fused, reported as 'scored' and worth keeping.
+    """
+    def predict(self, engine, clinical=UNDECIDED_AE):
+        return engine.predict(clinical, scan_file(self), 'AE', explain=False)
+
+    def test_scored_scan_is_fused(self):
+        engine = engine_with_cnn(mock.Mock())
+        with mock.patch.object(engine, '_scan', return_value=(0.9, None)):
+            result = self.predict(engine)
+        self.assertEqual(result['cnn'], {'status': 'scored', 'probability': 0.9, 'tabular_probability': 0.6})
+        self.assertEqual(result['confidence'], round((0.6 * 0.7 + 0.9 * 0.3) * 100, 2))
+
+    def test_without_a_checkpoint_the_tabular_result_stands(self):
+        result = self.predict(engine_with_cnn(None), DECISIVE_AE)
+        self.assertEqual(result['cnn'], {'status': 'unavailable', 'probability': None, 'tabular_probability': 0.8})
+        self.assertEqual(result['confidence'], 80.0)
+
+    def test_cnn_error_leaves_the_tabular_result(self):
+        engine = engine_with_cnn(mock.Mock())
+        with mock.patch.object(engine, '_scan', side_effect=RuntimeError('corrupt scan')):
+            result = self.predict(engine, DECISIVE_AE)
+        self.assertEqual((result['cnn']['status'], result['cnn']['probability']), ('failed', None))
+        self.assertEqual(result['confidence'], 80.0)
+        # Results produced through an error fallback are not memoized
+        self.assertEqual(engine.result_cache.stats()['entries'], 0)
+
+    def test_cascade_skips_the_cnn_when_tabular_is_decisive(self):
+        engine = engine_with_cnn(mock.Mock())
+        with mock.patch.object(ai_engine, 'CNN_CASCADE', True), \
+                mock.patch.object(engine, '_scan', return_value=(0.1, None)) as scan:
+            decisive = self.predict(engine, DECISIVE_AE)
+            self.assertFalse(scan.called)
+            undecided = self.predict(engine, UNDECIDED_AE)
+        self.assertEqual((decisive['cnn']['status'], decisive['confidence']), ('skipped', 80.0))
+        self.assertEqual(undecided['cnn']['status'], 'scored')
+        self.assertEqual(undecided['result'], 'Normal')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ScanScoreTests(TestCase):
+    """
+    The MRI store keeps a scan's CNN probability for its next upload: only a real one.
+    """
+    def setUp(self):
+        self.patient = User.objects.create_user('patient', password='x', is_patient=True)
+
+    def session(self, clinical):
+        scan = mri_store.session_fields(SimpleUploadedFile('scan.png', b'the same scan', 'image/png'))
+        return DiagnosticSession.objects.create(patient=self.patient, disease_type='AE', clinical_data=clinical, **scan)
+
+    def test_unscored_scan_is_not_recorded_and_can_be_scored_later(self):
+        engine = engine_with_cnn(mock.Mock())
+        session = self.session(DECISIVE_AE)
+        with mock.patch.object(engine, '_scan', side_effect=RuntimeError('corrupt scan')):
+            diagnosis.run_diagnosis(session, engine, explain=False)
+        session.refresh_from_db()
+        self.assertEqual((session.cnn_status, session.cnn_probability, session.confidence_score), ('failed', None, 80.0))
+        self.assertIsNone(session.mri_blob.cnn_probability)
+
+        with mock.patch.object(engine, '_predict_cnn', return_value=(0.9, None)):
+            diagnosis.score_skipped_mri(session, engine)
+        session.refresh_from_db()
+        self.assertEqual((session.cnn_status, session.cnn_probability), ('scored', 0.9))
+        self.assertEqual(session.mri_blob.cnn_probability, 0.9)
+
+    def test_skipped_scan_is_scored_on_demand(self):
+        engine = engine_with_cnn(mock.Mock())
+        session = self.session(DECISIVE_AE)
+        with mock.patch.object(ai_engine, 'CNN_CASCADE', True):
+            diagnosis.run_diagnosis(session, engine, explain=False)
+        self.assertEqual(session.cnn_status, 'skipped')
+        with mock.patch.object(engine, '_predict_cnn', return_value=(0.2, None)):
+            diagnosis.score_skipped_mri(session, engine)
+        session.refresh_from_db()
+        self.assertEqual((session.cnn_status, session.prediction_result), ('scored', 'Autoimmune Encephalitis (AE)'))
+        self.assertEqual(session.confidence_score, round((0.8 * 0.7 + 0.2 * 0.3) * 100, 2))
+
+
+# 8. Model versions and hot reload (services/artifacts.py, ai_engine.reload_engine)
+class ModelReloadTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.model_dir = os.path.join(directory.name, 'ml_models')
+        shutil.copytree(MODEL_DIR, self.model_dir, ignore=shutil.ignore_patterns('compiled'))
+        for name, value in [('MODEL_DIR', self.model_dir), ('COMPILED_DIR', os.path.join(self.model_dir, 'compiled')),
+                            ('MODEL_RELOAD_SETTLE', 0), ('_engine', None)]:
+            patcher = mock.patch.object(ai_engine, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict(ai_engine._reload, state='idle', outcome=None, failed_signature=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def reload(self):
+        self.assertTrue(ai_engine.reload_engine(wait=True))
+        return ai_engine.reload_status()
+
+    def test_version_follows_content_not_file_times(self):
+        version = ai_engine.HybridAIEngine().version
+        os.utime(os.path.join(self.model_dir, 'xgb_model.json'))
+        self.assertEqual(ai_engine.HybridAIEngine().version, version)
+        with open(os.path.join(self.model_dir, 'shap_base_values.json'), 'a') as f:
+            f.write(' ')
+        self.assertNotEqual(ai_engine.HybridAIEngine().version, version)
+
+    def test_reloading_unchanged_files_keeps_the_engine(self):
+        engine = ai_engine.get_engine()
+        version = engine.version
+        os.utime(os.path.join(self.model_dir, 'lgb_model.txt'))
+        status = self.reload()
+        self.assertEqual((status['outcome'], status['version']), ('unchanged', version))
+        self.assertIs(ai_engine.get_engine(), engine)
+        self.assertEqual(engine.signature, ai_engine.artifacts.stat_signature(self.model_dir))
+
+    def test_changed_files_swap_in_a_new_engine(self):
+        engine = ai_engine.get_engine()
+        engine.predict(UNDECIDED_AE, disease_type='AE')
+        with open(os.path.join(self.model_dir, 'shap_base_values.json'), 'a') as f:
+            f.write(' ')
+        status = self.reload()
+        fresh = ai_engine.get_engine()
+        self.assertEqual(status['outcome'], 'swapped')
+        self.assertIsNot(fresh, engine)
+        self.assertNotEqual(fresh.version, engine.version)
+        self.assertEqual(fresh.result_cache.stats()['entries'], 0)
+        self.assertTrue(fresh.readiness()['ready'])
+
+
+# 9. Single-pass CNN + Grad-CAM (ai_engine._cnn_eager)
+class CNNGradCamTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        import torch
+
+        super().setUpClass()
+        cls.model = cnn_model()
+        cls.batch = torch.randn(2, 3, 224, 224, generator=torch.Generator().manual_seed(1))
+
+    def engine(self):
+        import torch
+
+        engine = engine_with_cnn(self.model)
+        engine.device = torch.device('cpu')
+        return engine
+
+    def reference_cam(self, image):
+        """
+        Textbook Grad-CAM for one image: its own forward pass and backward pass.
+        """
+        import torch
+
+        activations = []
+        hook = self.model.features[-1].register_forward_hook(lambda m, i, o: activations.append(o))
+        try:
+            output = self.model(image[None])
+        finally:
+            hook.remove()
+        grads = torch.autograd.grad(output[0, 1], activations[0])[0][0].numpy()
+        cam = np.maximum(np.tensordot(grads.mean(axis=(1, 2)), activations[0][0].detach().numpy(), axes=1), 0)
+        return cam / cam.max()
+
+    def test_one_pass_gives_probabilities_and_the_requested_maps(self):
+        import torch
+
+        (p0, cam0), (p1, cam1) = self.engine()._cnn_eager(self.batch, cam_rows=[1])
+        with torch.no_grad():
+            expected = torch.softmax(self.model(self.batch), dim=1)[:, 1].tolist()
+        np.testing.assert_allclose([p0, p1], expected, atol=1e-5)
+        self.assertIsNone(cam0)
+        self.assertEqual(cam1.shape, (7, 7))
+        np.testing.assert_allclose(cam1, self.reference_cam(self.batch[1]), atol=1e-4)
+
+    def test_no_map_wanted_runs_without_gradients(self):
+        results = self.engine()._cnn_eager(self.batch, cam_mask=[False, False])
+        self.assertEqual([cam for _, cam in results], [None, None])
+
+    def test_scan_is_scored_once_per_content(self):
+        engine = self.engine()
+        path = png_scan(self)
+        with mock.patch.object(ai_engine, 'MEDIA_ROOT', temp_dir(self)), \
+                mock.patch.object(engine, '_score_scan', wraps=engine._score_scan) as score:
+            prob, url = engine._predict_cnn(path)
+            self.assertTrue(os.path.exists(engine.gradcam_file(engine.scan_digest(path))[0]))
+            self.assertEqual(engine._predict_cnn(path), (prob, url))
+        self.assertEqual(score.call_count, 1)
+        self.assertTrue(url.startswith('/media/grad_cam/'))
+
+
+# 10. Stage pools (services/stages.py)
+class StagePoolTests(SimpleTestCase):
+    def setUp(self):
+        pools = {}
+        for patcher in (mock.patch.object(stages, 'LANES', {'stage': 1, 'cnn': 2}), mock.patch.object(stages, '_pools', pools)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: [executor.shutdown(wait=True) for executor in pools.values()])
+
+    def test_stage_runs_on_the_pool_in_the_callers_context(self):
+        import contextvars
+        import threading
+
+        trace = contextvars.ContextVar('trace', default=None)
+        trace.set('request-1')
+        name, value = stages.submit(lambda: (threading.current_thread().name, trace.get())).result(timeout=5)
+        self.assertTrue(name.startswith('ai-stage-stage'))
+        self.assertEqual(value, 'request-1')
+
+    def test_stage_submitted_from_a_stage_runs_inline(self):
+        import threading
+
+        nested = lambda: stages.submit(lambda: threading.current_thread().name).result(timeout=5)
+        outer = stages.submit(lambda: (threading.current_thread().name, nested())).result(timeout=5)
+        self.assertEqual(outer[0], outer[1])
+
+    def test_cnn_lane_does_not_queue_behind_busy_stages(self):
+        import threading
+
+        release = threading.Event()
+        blocked = stages.submit(release.wait, 5)
+        try:
+            self.assertEqual(stages.submit_to('cnn', lambda: 'scored').result(timeout=2), 'scored')
+            self.assertFalse(blocked.done())
+        finally:
+            release.set()
+        self.assertTrue(blocked.result(timeout=5))
+
+    def test_overlapped_pipeline_matches_the_inline_one(self):
+        clinical = [DECISIVE_AE, UNDECIDED_AE, {'age': 50, 'dsg1_index': 45, 'skin_blisters': 1}]
+        diseases = ['AE', 'AE', 'PV']
+        overlapped = ai_engine.HybridAIEngine().predict_batch(clinical, diseases, [None] * 3)
+        with mock.patch.object(stages, 'LANES', {'stage': 0, 'cnn': 0}):
+            inline = ai_engine.HybridAIEngine().predict_batch(clinical, diseases, [None] * 3)
+        self.assertEqual(overlapped, inline)
+
+
+# 11. Micro-batching (services/batching.py)
+class MicroBatchTests(SimpleTestCase):
+    def concurrently(self, fn, items):
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(len(items)) as executor:
+            return list(executor.map(fn, items))
+
+    def test_concurrent_items_share_batches(self):
+        sizes = []
+        batcher = MicroBatcher(lambda items: sizes.append(len(items)) or [x * 2 for x in items], max_batch=4, max_wait=0.2)
+        self.addCleanup(batcher.close)
+        self.assertEqual(self.concurrently(batcher, range(6)), [0, 2, 4, 6, 8, 10])
+        self.assertEqual(sum(sizes), 6)
+        self.assertLessEqual(max(sizes), 4)
+        self.assertLess(len(sizes), 6)
+
+    def test_batch_error_reaches_every_caller(self):
+        def explode(items):
+            raise RuntimeError('forward failed')
+
+        batcher = MicroBatcher(explode, max_batch=4, max_wait=0.05)
+        self.addCleanup(batcher.close)
+        futures = [batcher.submit(i) for i in range(3)]
+        for future in futures:
+            self.assertRaisesMessage(RuntimeError, 'forward failed', future.result, 5)
+
+    def test_closed_batcher_runs_items_alone(self):
+        import threading
+
+        threads = []
+        batcher = MicroBatcher(lambda items: threads.append(threading.current_thread()) or items)
+        batcher.close()
+        self.assertEqual(batcher(7), 7)
+        self.assertEqual(threads, [threading.current_thread()])
+
+    def test_batched_scans_score_like_single_ones(self):
+        import torch
+
+        engine = engine_with_cnn(cnn_model())
+        engine.device = torch.device('cpu')
+        paths = [png_scan(self, seed) for seed in range(3)]
+        single = [engine._cnn_eager(torch.from_numpy(engine.mri_preprocess(path)[0].copy())[None], cam_rows=[])[0][0]
+                  for path in paths]
+        sizes = []
+        forward = lambda items: sizes.append(len(items)) or engine._cnn_forward_batch(items)
+        batcher = MicroBatcher(forward, max_batch=3, max_wait=0.5, name='test-cnn')
+        self.addCleanup(batcher.close)
+        with mock.patch.object(engine, 'cnn_batcher', batcher):
+            batched = self.concurrently(lambda path: engine._score_scan(path, with_cam=False)[0], paths)
+        np.testing.assert_allclose(batched, single, atol=1e-5)
+        self.assertEqual(sum(sizes), 3)
+        self.assertLess(len(sizes), 3)
+
+
+# 12. CNN inference backends (services/cnn_backends.py)
+class CNNBackendTests(SimpleTestCase):
+    def setUp(self):
+        import torch
+
+        self.model = cnn_model()
+        self.batch = torch.from_numpy(np.random.default_rng(0).normal(size=(2, 3, 224, 224)).astype(np.float32))
+        self.eager = cnn_backends.build(self.model, 'eager')(self.batch)
+
+    def test_builds_match_eager(self):
+        for backend, tolerance in (('channels_last', 1e-5), ('torchscript', 1e-4), ('int8_dynamic', 0.05)):
+            with self.subTest(backend=backend):
+                variant = cnn_backends.build(self.model, backend)
+                np.testing.assert_allclose(variant(self.batch), self.eager, atol=tolerance)
+
+    def test_scripted_build_round_trips_through_the_cache(self):
+        cache_dir = temp_dir(self)
+        built = cnn_backends.build(self.model, 'torchscript')
+        self.assertTrue(os.path.exists(cnn_backends.save(built, cache_dir)))
+        np.testing.assert_allclose(cnn_backends.load(cache_dir, 'torchscript')(self.batch), built(self.batch), atol=1e-5)
+        self.assertIsNone(cnn_backends.save(cnn_backends.build(self.model, 'eager'), cache_dir))
+
+    def test_rejects_unknown_and_uncalibrated_builds(self):
+        self.assertRaises(ValueError, cnn_backends.build, self.model, 'fp16')
+        self.assertRaises(ValueError, cnn_backends.build, self.model, 'int8_static')
+
+    def test_recommends_the_fastest_accurate_backend(self):
+        results = {
+            'eager': {'max_abs_diff': 0.0, 'ms_per_scan': 40.0},
+            'torchscript': {'max_abs_diff': 1e-6, 'ms_per_scan': 30.0},
+            'int8_dynamic': {'max_abs_diff': 0.2, 'ms_per_scan': 10.0},
+        }
+        self.assertEqual(cnn_backends.recommend(results, tolerance=1e-3), 'torchscript')
+        self.assertEqual(cnn_backends.recommend({'int8_dynamic': results['int8_dynamic']}, tolerance=1e-3), 'eager')
+
+    def test_engine_scores_through_the_build_and_keeps_eager_grad_cam(self):
+        import torch
+
+        engine = engine_with_cnn(self.model)
+        engine.device = torch.device('cpu')
+        engine.cnn_fast = cnn_backends.build(self.model, 'torchscript')
+        with mock.patch.object(engine, '_cnn_eager', wraps=engine._cnn_eager) as eager:
+            scored = engine._cnn_forward_batch([(scan, False) for scan in self.batch])
+        eager.assert_not_called()
+        np.testing.assert_allclose([p for p, _ in scored], self.eager, atol=1e-4)
+        self.assertEqual([cam for _, cam in scored], [None, None])
+
+
+# 13. LightGBM early exit (ai_engine._ensemble_proba)
+class EarlyExitTests(SimpleTestCase):
+    RECORDS = [DECISIVE_AE, {'age': 40, 'csf_protein': 55, 'seizures': 1}, {'age': 30}] # LightGBM AE: 0.74, 0.43, 0.11
+
+    def setUp(self):
+        self.engine = ai_engine.HybridAIEngine()
+        self.engine._ensure('tabular')
+        self.X = self.engine.engineer_features(self.RECORDS)
+        self.failed = np.zeros(len(self.X), dtype=bool)
+        self.stack = self.engine._stack_proba(self.X, self.failed)
+
+    def test_only_undecided_rows_take_the_full_stack(self):
+        self.engine.early_exit_band = (0.3, 0.7)
+        with mock.patch.object(self.engine, '_stack_proba', wraps=self.engine._stack_proba) as stack:
+            probs = self.engine._ensemble_proba(self.X, self.failed, [['AE']] * 3)
+        stack.assert_called_once()
+        np.testing.assert_array_equal(stack.call_args.args[0], self.X[[1]])
+        lgb = self.engine._base_proba('lgbm', self.X)
+        np.testing.assert_allclose(probs[[0, 2]], lgb[[0, 2]])
+        np.testing.assert_allclose(probs[1], self.stack[1])
+
+    def test_no_band_runs_the_full_stack(self):
+        self.engine.early_exit_band = None
+        np.testing.assert_allclose(self.engine._ensemble_proba(self.X, self.failed, [['AE']] * 3), self.stack)
+
+    def test_every_listed_disease_must_clear_the_band(self):
+        probs = np.array([[0.9, 0.05, 0.05], [0.9, 0.5, 0.05]])
+        exits = self.engine._early_exits(probs, [['AE', 'PV'], ['AE', 'PV']], (0.2, 0.8))
+        self.assertEqual(exits.tolist(), [True, False])
+
+    def test_early_exit_keeps_the_decisions(self):
+        full = self.engine.predict_batch(self.RECORDS, 'AE', explain=False)
+        self.engine.early_exit_band = (0.3, 0.7)
+        self.engine.result_cache.clear()
+        early = self.engine.predict_batch(self.RECORDS, 'AE', explain=False)
+        self.assertEqual([r['result'] for r in early], [r['result'] for r in full])
+
+
+# 14. Distilled fast tier (services/distillation.py, manage.py distill_ensemble)
+class DistillationTests(SimpleTestCase):
+    def test_soft_labels_weight_each_class_by_the_teacher(self):
+        X = np.array([[1.0], [2.0]])
+        X_rep, y_rep, w_rep = distillation.soft_label_rows(X, np.array([[0.7, 0.3, 0.0], [0.2, 0.2, 0.6]]))
+        self.assertEqual(X_rep[:, 0].tolist(), [1, 1, 2, 2, 2])
+        self.assertEqual(y_rep.tolist(), [0, 1, 0, 1, 2])
+        np.testing.assert_allclose(w_rep, [0.7, 0.3, 0.2, 0.2, 0.6])
+
+    def test_distilled_model_serves_the_fast_tier(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .management.commands import distill_ensemble
+
+        model_dir = os.path.join(temp_dir(self), 'ml_models')
+        shutil.copytree(MODEL_DIR, model_dir, ignore=shutil.ignore_patterns('compiled'))
+        with mock.patch.object(ai_engine, 'MODEL_DIR', model_dir), \
+                mock.patch.object(ai_engine, 'COMPILED_DIR', os.path.join(model_dir, 'compiled')), \
+                mock.patch.object(distill_ensemble, 'MODEL_DIR', model_dir):
+            call_command('distill_ensemble', rows=500, source='synthetic', trees=30, min_agreement=0, latency_rows=5,
+                         stdout=StringIO())
+            engine = ai_engine.HybridAIEngine()
+            engine._ensure('tabular')
+
+        report = distillation.read_report(model_dir)
+        self.assertEqual(report['teacher'], {k: engine._source_stamp(p) for k, p in engine.model_paths.items() if k != 'fast'})
+        self.assertEqual(engine.fast_scale, distillation.output_scale(engine.models['fast']))
+        with mock.patch.object(engine, '_stack_proba', wraps=engine._stack_proba) as stack:
+            fast = engine.predict_batch([DECISIVE_AE, {'age': 30}], 'AE', tier='fast', explain=False)
+        stack.assert_not_called()
+        self.assertEqual([r['tier'] for r in fast], ['fast', 'fast'])
+        full = engine.predict_batch([DECISIVE_AE, {'age': 30}], 'AE', tier='full', explain=False)
+        self.assertEqual(fast[0]['result'], full[0]['result'])
+        self.assertGreater(min(report['fidelity']['decision_agreement'].values()), 0.9)
+
+    def test_fast_tier_falls_back_to_the_full_stack(self):
+        engine = ai_engine.HybridAIEngine()
+        engine._ensure('tabular')
+        self.assertEqual(engine._resolve_tier('fast'), 'full') # No distilled model ships with the repo
+        self.assertRaises(ValueError, engine._resolve_tier, 'turbo')
+
+        base_proba = engine._base_proba
+
+        def broken_fast(key, X):
+            if key == 'fast': raise RuntimeError('booster failed')
+            return base_proba(key, X)
+
+        X = engine.engineer_features([UNDECIDED_AE])
+        failed = np.zeros(1, dtype=bool)
+        with mock.patch.object(engine, '_base_proba', broken_fast):
+            probs = engine._tier_proba(X, failed, [['AE']], 'fast')
+        np.testing.assert_allclose(probs, engine._ensemble_proba(X, failed, [['AE']]))
+
+
+# 15. Warm-up and readiness (ai_engine.warm_up, /api/health/)
+class WarmupTests(SimpleTestCase):
+    def setUp(self):
+        self.engine = ai_engine.HybridAIEngine()
+        patcher = mock.patch.object(ai_engine, '_engine', self.engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_warm_up_makes_the_engine_ready_without_caching_results(self):
+        self.assertFalse(self.engine.readiness()['ready'])
+        warmup = self.engine.warm_up()
+        self.assertEqual((warmup['state'], warmup['errors']), ('done', {}))
+        self.assertTrue({'load', 'full:single', 'full:batch', 'full:screening', 'total'} <= warmup['seconds'].keys())
+        self.assertTrue(self.engine.readiness()['ready'])
+        self.assertEqual(self.engine.result_cache.stats()['entries'], 0)
+
+    def test_failed_step_or_load_error_is_not_ready(self):
+        with mock.patch.object(self.engine, '_run_screening', side_effect=RuntimeError('stack failed')):
+            warmup = self.engine.warm_up()
+        self.assertEqual(warmup['state'], 'failed')
+        self.assertEqual(warmup['errors'], {'full:screening': 'stack failed'})
+        self.assertFalse(self.engine.readiness()['ready'])
+
+        self.engine.warm_up()
+        self.engine.load_errors['cnn'] = 'checkpoint unreadable'
+        self.assertFalse(self.engine.readiness()['ready'])
+
+    def test_background_warm_up_runs_once_per_process(self):
+        import threading
+
+        finished = threading.Event()
+        with mock.patch.object(self.engine, 'warm_up', side_effect=finished.set) as warm_up:
+            self.engine.start_warmup()
+            self.engine.start_warmup()
+            self.assertTrue(finished.wait(5))
+        warm_up.assert_called_once_with()
+
+    def test_health_probes(self):
+        client = Client()
+        live = client.get('/api/health/live/')
+        self.assertEqual((live.status_code, live.json()['status']), (200, 'alive'))
+
+        with mock.patch.object(self.engine, 'start_warmup'):
+            self.engine.warmup['state'] = 'running'
+            probe = client.get('/api/health/ready/')
+            self.assertEqual((probe.status_code, probe['Retry-After']), (503, '5'))
+            self.engine.warm_up()
+            probe = client.get('/api/health/ready/')
+        self.assertEqual(probe.status_code, 200)
+        self.assertTrue(probe.json()['ready'])
+
+
+# 16. Streaming predictions (views.predict_disease_stream)
+class StreamTests(TestCase):
+    FORM = {'disease_type': 'AE', 'clinical_data': '{"age": 40, "csf_protein": 55, "seizures": 1}'}
+
+    def setUp(self):
+        self.patient = User.objects.create_user('patient', password='x', is_patient=True)
+        self.auth = {'Authorization': f'Bearer {RefreshToken.for_user(self.patient).access_token}'}
+        # A fresh engine per test: a cached result would arrive as 'complete' alone
+        self.engine = ai_engine.HybridAIEngine()
+        patcher = mock.patch.object(ai_engine, '_engine', self.engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def stream(self, **headers):
+        from django.test import AsyncClient
+
+        response = await AsyncClient().post('/api/predict/stream/', self.FORM, headers={**self.auth, **headers})
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    async def test_ndjson_stream_sends_each_stage_then_the_result(self):
+        response, body = await self.stream()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        events = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([e['stage'] for e in events], ['session', 'ensemble', 'shap', 'complete'])
+        session = await DiagnosticSession.objects.aget(id=events[0]['data']['session_id'])
+        self.assertEqual(session.status, 'completed')
+        self.assertEqual(events[1]['data']['result'], session.prediction_result)
+        self.assertEqual(events[-1]['data']['id'], session.id)
+
+    async def test_event_stream_for_sse_clients(self):
+        response, body = await self.stream(Accept='text/event-stream')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = [block.split('\n', 1) for block in body.strip().split('\n\n')]
+        self.assertEqual([name for name, _ in events], [f'event: {s}' for s in ('session', 'ensemble', 'shap', 'complete')])
+        self.assertTrue(all(data.startswith('data: {') for _, data in events))
+
+    async def test_client_that_goes_away_fails_the_session(self):
+        import asyncio
+        import threading
+        from contextlib import suppress
+        from django.test import AsyncRequestFactory
+        from . import views
+
+        # The pipeline stalls after its first stage, until well after the client has gone
+        release = threading.Event()
+        predict_stream = self.engine.predict_stream
+
+        def stalled(*args, **kwargs):
+            stages = predict_stream(*args, **kwargs)
+            yield next(stages)
+            release.wait(5)
+            yield from stages
+
+        # Like the ASGI handler on a disconnect: the task sending the response is cancelled mid-stream
+        chunks, sent = [], asyncio.Event()
+
+        async def send(response):
+            async for chunk in response.streaming_content:
+                chunks.append(json.loads(chunk))
+                if len(chunks) == 2: sent.set()
+
+        request = AsyncRequestFactory().post('/api/predict/stream/', self.FORM, headers=self.auth)
+        with mock.patch.object(self.engine, 'predict_stream', stalled):
+            sending = asyncio.ensure_future(send(await views.predict_disease_stream(request)))
+            await asyncio.wait_for(sent.wait(), 5)
+            threading.Timer(0.2, release.set).start()
+            sending.cancel()
+            with suppress(asyncio.CancelledError):
+                await sending
+        self.assertEqual([c['stage'] for c in chunks], ['session', 'ensemble'])
+        session_id = chunks[0]['data']['session_id']
+        session = await DiagnosticSession.objects.aget(id=session_id)
+        self.assertEqual(session.status, 'failed')
+
+
+# 17. Deferred explanations (diagnosis.explain_session / request_explanations / explain_later)
+class ExplanationTests(TestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user('patient', password='x', is_patient=True)
+        self.engine = ai_engine.HybridAIEngine()
+        patcher = mock.patch.object(ai_engine, '_engine', self.engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def session(self, **fields):
+        return DiagnosticSession.objects.create(patient=self.patient, disease_type='AE', clinical_data=UNDECIDED_AE, **fields)
+
+    def test_deferred_explanations_match_inline_ones(self):
+        inline = self.session()
+        diagnosis.run_diagnosis(inline, self.engine, explain=True)
+        deferred = self.session()
+        diagnosis.run_diagnosis(deferred, self.engine, explain=False)
+        self.assertEqual((deferred.explanation_status, deferred.shap_features), ('pending', []))
+        self.assertEqual(deferred.prediction_result, inline.prediction_result)
+
+        diagnosis.explain_session(deferred, self.engine)
+        deferred.refresh_from_db()
+        self.assertEqual(deferred.explanation_status, 'ready')
+        self.assertEqual(deferred.shap_features, inline.shap_features)
+
+    def test_only_completed_sessions_waiting_on_explanations_are_queued(self):
+        with mock.patch.object(diagnosis, 'explain_later') as explain_later:
+            self.assertFalse(diagnosis.request_explanations(self.session(status='pending', explanation_status='pending')))
+            self.assertFalse(diagnosis.request_explanations(self.session(status='failed', explanation_status='pending')))
+            self.assertFalse(diagnosis.request_explanations(self.session(status='completed', explanation_status='ready')))
+            waiting = self.session(status='completed', explanation_status='pending')
+            self.assertTrue(diagnosis.request_explanations(waiting))
+        explain_later.assert_called_once_with(waiting.id)
+
+    def test_a_session_is_queued_once_while_waiting(self):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        release = threading.Event()
+        for name, value in [('_explainer', executor), ('_explainer_pid', os.getpid()), ('_queued', set()),
+                            ('DiagnosticSession', mock.Mock()), ('ensure_explanations', lambda session: release.wait(5))]:
+            patcher = mock.patch.object(diagnosis, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        queued = diagnosis.explain_later(7)
+        self.assertIsNone(diagnosis.explain_later(7))
+        release.set()
+        queued.result(timeout=5)
+        self.assertIsNotNone(diagnosis.explain_later(7)) # Done: a later request queues it again
+
+    def test_explanations_endpoint_answers_202_until_they_are_stored(self):
+        client = APIClient()
+        client.force_authenticate(self.patient)
+        session = self.session()
+        diagnosis.run_diagnosis(session, self.engine, explain=False)
+
+        explain_now = lambda session_id: diagnosis.ensure_explanations(DiagnosticSession.objects.get(id=session_id))
+        with mock.patch.object(diagnosis, 'explain_later', side_effect=explain_now):
+            pending = client.get(f'/api/predict/explanations/{session.id}/')
+            self.assertEqual((pending.status_code, pending['Retry-After']), (202, '2'))
+            ready = client.get(f'/api/predict/explanations/{session.id}/')
+        self.assertEqual(ready.status_code, 200)
+        self.assertEqual(ready.data['data']['explanation_status'], 'ready')
+        self.assertTrue(ready.data['data']['shap_features'])
+
+
+# 18. Content-addressed MRI store (services/mri_store.py)
+class MriStoreTests(TestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user('patient', password='x', is_patient=True)
+        media = self.settings(MEDIA_ROOT=temp_dir(self))
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def store(self, content=b'the same scan', name='scan.png'):
+        return mri_store.store(SimpleUploadedFile(name, content, 'image/png'))
+
+    def unused_since(self, blob, seconds):
+        MriBlob.objects.filter(id=blob.id).update(last_used_at=timezone.now() - timedelta(seconds=seconds))
+
+    def test_identical_scans_are_stored_once(self):
+        first, second = self.store(), self.store(name='copy.PNG')
+        digest = hashlib.sha256(b'the same scan').hexdigest()
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(first.file.name, mri_store.blob_name(digest, '.png'))
+        self.assertEqual(MriBlob.objects.get().refcount, 2)
+        with open(first.file.path, 'rb') as f:
+            self.assertEqual(f.read(), b'the same scan')
+        self.assertNotEqual(self.store(b'another scan').id, first.id)
+
+    def test_release_never_drops_below_zero(self):
+        blob = self.store()
+        mri_store.release(blob.id)
+        mri_store.release(blob.id)
+        self.assertEqual(MriBlob.objects.get().refcount, 0)
+
+    def test_collect_deletes_unreferenced_scans_after_the_grace_period(self):
+        blob = self.store()
+        overlay = os.path.join(settings.MEDIA_ROOT, 'grad_cam', blob.sha256[:2], f'{blob.sha256}-eager.png')
+        os.makedirs(os.path.dirname(overlay))
+        open(overlay, 'wb').close()
+        kept = self.store(b'still referenced')
+        mri_store.release(blob.id)
+        self.assertEqual(mri_store.collect(grace_seconds=60), (0, 0, 0)) # Released just now
+
+        self.unused_since(blob, 120)
+        self.unused_since(kept, 120)
+        self.assertEqual(mri_store.collect(grace_seconds=60), (1, blob.size, 1))
+        self.assertFalse(os.path.exists(blob.file.path) or os.path.exists(overlay))
+        self.assertEqual(list(MriBlob.objects.values_list('id', flat=True)), [kept.id])
+        self.assertTrue(os.path.exists(kept.file.path))
+
+    def test_drifted_count_is_restored_not_collected(self):
+        scan = mri_store.session_fields(SimpleUploadedFile('scan.png', b'the same scan', 'image/png'))
+        DiagnosticSession.objects.create(patient=self.patient, disease_type='AE', clinical_data={}, **scan)
+        MriBlob.objects.update(refcount=0)
+        self.unused_since(scan['mri_blob'], 120)
+        self.assertEqual(mri_store.collect(grace_seconds=60), (0, 0, 0))
+        self.assertEqual(MriBlob.objects.get().refcount, 1)
+        self.assertTrue(os.path.exists(scan['mri_blob'].file.path))
+
+        MriBlob.objects.update(refcount=5)
+        self.assertEqual(mri_store.recount(), 1)
+        self.assertEqual(MriBlob.objects.get().refcount, 1)
+
+    def test_known_digest_and_score_go_to_the_engine(self):
+        scan = mri_store.session_fields(SimpleUploadedFile('scan.png', b'the same scan', 'image/png'))
+        session = DiagnosticSession.objects.create(patient=self.patient, disease_type='AE', clinical_data={}, **scan)
+        blob = scan['mri_blob']
+        mri_store.remember_score(blob, 0.9, 'v1')
+        engine = mock.Mock()
+        session.refresh_from_db()
+        self.assertEqual(diagnosis.scan_path(session, engine), blob.file.path)
+        engine.remember_digest.assert_called_once_with(blob.file.path, blob.sha256)
+        engine.remember_scan.assert_called_once_with(blob.sha256, 0.9, 'v1')
+
+        mri_store.remember_score(blob, None, 'v2') # Only real probabilities are kept
+        self.assertEqual((MriBlob.objects.get().cnn_probability, MriBlob.objects.get().cnn_version), (0.9, 'v1'))
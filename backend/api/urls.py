@@ -13,6 +13,13 @@ urlpatterns = [
 
     # Patient
     path('predict/', views.predict_disease, name='predict_disease'),
+    path('predict/stream/', views.predict_disease_stream, name='predict_disease_stream'),
+    path('predict/screen/', views.screen_patient, name='screen_patient'),
+    path('predict/status/<int:session_id>/', views.get_prediction_status, name='prediction_status'),
+    path('predict/explanations/<int:session_id>/', views.get_session_explanations, name='session_explanations'),
+    path('uploads/', views.create_upload, name='create_upload'),
+    path('uploads/<uuid:upload_id>/', views.upload_detail, name='upload_detail'),
+    path('uploads/<uuid:upload_id>/finalize/', views.finalize_upload, name='finalize_upload'),
     path('patient/history/', views.get_patient_history, name='patient_history'),
     path('patient/dashboard-stats/', views.get_patient_dashboard_stats, name='dashboard_stats'),
     path('patient/appointments/', views.get_patient_appointments, name='patient_appointments'),
@@ -25,6 +32,7 @@ urlpatterns = [
     path('doctor/patients/', views.get_doctor_patients, name='doctor_patients'),
     path('doctor/session/<int:session_id>/', views.get_session_detail, name='session_detail'),
     path('doctor/verify/<int:session_id>/', views.verify_diagnosis, name='verify_diagnosis'),
+    path('doctor/session/<int:session_id>/score-mri/', views.score_session_mri, name='score_session_mri'),
     path('doctor/appointments/', views.get_doctor_appointments, name='doctor_appointments'),
     path('doctors/<int:pk>/', views.get_doctor_detail, name='get_doctor_detail'),
      path('appointment/complete/', views.complete_appointment, name='complete_appointment'),
@@ -41,4 +49,12 @@ urlpatterns = [
     path('profile/update/', views.update_profile_data, name='update_profile'),
      # Contact Form
     path('contact/submit/', views.submit_contact_query, name='submit_contact_query'),
+
+    # Operations
+    path('system/memory/', views.get_worker_memory, name='worker_memory'),
+    path('system/models/', views.get_model_version, name='model_version'),
+    path('system/models/reload/', views.reload_models, name='reload_models'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('health/live/', views.health_live, name='health_live'),
+    path('health/ready/', views.health_ready, name='health_ready'),
 ]
\ No newline at end of file
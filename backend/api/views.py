@@ -1,36 +1,52 @@
+import asyncio
+import functools
 import json
 import os
 import uuid
+from contextlib import suppress
 
 from django.utils import timezone  
 import datetime
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 from django.template.loader import get_template
+from django.utils.http import http_date
 from django.db.models import Q
-from xhtml2pdf import pisa
 
+from asgiref.sync import sync_to_async
 from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.decorators import api_view, parser_classes, permission_classes
-from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from django.contrib.auth import authenticate
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from .models import User, PatientProfile, DoctorProfile, DiagnosticSession, Appointment, Message
 from .serializers import UserSerializer, DiagnosticSessionSerializer, AppointmentSerializer, MessageSerializer
-from .services.ai_engine import HybridAIEngine
+from .services import job_queue, mri_store, uploads
+from .services.admission import Overloaded, get_governor, threads_in_use
+from .services.ai_engine import MODEL_TIERS, get_engine, reload_engine, reload_status
+from .services.memory import process_memory
+from .services.telemetry import render_prometheus, server_timing, span, trace
+from .services.uploads import UploadError
+from .services import diagnosis
+from .services.diagnosis import (ensure_explanations, explain_later, request_explanations, run_diagnosis, score_skipped_mri,
+                                 UNSCORED, session_payload, stream_diagnosis)
 
 
 # ... existing imports ...
-from .models import User, PatientProfile, DoctorProfile, DiagnosticSession, Appointment, Message, ContactQuery
+from .models import User, PatientProfile, DoctorProfile, DiagnosticSession, Appointment, Message, ContactQuery, InferenceJob, MriUpload
 from .serializers import UserSerializer, DiagnosticSessionSerializer, AppointmentSerializer, MessageSerializer, ContactQuerySerializer
 
 
 
-# Initialize the AI Engine once
-ai_engine = HybridAIEngine()
+# The AI Engine is created (and its models loaded) on the first prediction, see services/diagnosis.py
 
 # ==========================================
 # 1. AUTHENTICATION & PROFILE
@@ -249,61 +265,374 @@ def update_profile_data(request):
 # 2. PATIENT AI & DASHBOARD ENDPOINTS
 # ==========================================
 
+def debug_timings(view):
+    """
+    Attaches per-stage timings (Server-Timing header + "timings_ms") when the caller sends
+    `X-Debug-Timings: 1`; honoured for staff users, or anyone when DEBUG is on.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        enabled = request.headers.get('X-Debug-Timings') == '1' and (settings.DEBUG or request.user.is_staff)
+        with trace(enabled) as timings:
+            response = view(request, *args, **kwargs)
+        if timings is not None:
+            response['Server-Timing'] = server_timing(timings)
+            if isinstance(response.data, dict):
+                response.data["timings_ms"] = {stage: round(sec * 1000, 3) for stage, sec in timings.items()}
+        return response
+    return wrapper
+
+def overloaded_response(e):
+    # Admission control turned the request away (429 queue full, 503 waited too long): say when to come back
+    return Response({"status": "error", "message": str(e), "retry_after": e.retry_after},
+                    status=e.status, headers={'Retry-After': str(e.retry_after)})
+
+def read_clinical_data(raw):
+    # Multipart forms carry clinical_data as a JSON string
+    if isinstance(raw, str):
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError:
+            return {}
+    return raw
+
+def release_scan(blob_id, upload_id=None):
+    # A scan from a resumable upload goes back to the upload (which keeps the reference, so the client can
+    # retry with the same upload_id); a scan uploaded with the request gives its reference up
+    if upload_id:
+        uploads.detach(upload_id)
+    elif blob_id:
+        mri_store.release(blob_id)
+
+def discard_session(session, upload_id=None):
+    # Nothing was scored: drop the session and its hold on the scan so the retry starts clean
+    session.delete()
+    release_scan(session.mri_blob_id, upload_id)
+
+def create_session(user, disease_type, clinical_data, upload=None, upload_id=None):
+    # The scan goes into the content-addressed MRI store (a repeat upload shares the stored file);
+    # a finalized resumable upload is already there
+    scan = uploads.attach(upload_id, user) if upload_id else mri_store.session_fields(upload)
+    try:
+        return DiagnosticSession.objects.create(
+            patient=user, disease_type=disease_type, clinical_data=clinical_data, **scan
+        )
+    except Exception:
+        if scan: release_scan(scan['mri_blob'].id, upload_id)
+        raise
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
-@parser_classes([MultiPartParser, FormParser])
+@parser_classes([MultiPartParser, FormParser, JSONParser])
+@debug_timings
 def predict_disease(request):
+    """
+    Runs a diagnosis. The MRI comes as the "mri_scan" file, or as the "upload_id" of a finalized resumable upload
+    (uploads/), in which case the request can be plain JSON.
+    """
     data = request.data
     disease_type = data.get('disease_type', 'AE')
-    
-    raw_clinical_data = data.get('clinical_data', '{}')
-    if isinstance(raw_clinical_data, str):
+    clinical_data = read_clinical_data(data.get('clinical_data', '{}'))
+
+    # 1. Save Session
+    try:
+        with span('db_create'):
+            session = create_session(request.user, disease_type, clinical_data,
+                                     request.FILES.get('mri_scan'), data.get('upload_id'))
+    except UploadError as e:
+        return upload_error(e)
+    except Exception as e:
+        return Response({"status": "error", "message": str(e)}, status=400)
+
+    # 2a. Async mode: hand the session to the inference workers and return immediately
+    run_async = str(data.get('async', getattr(settings, 'AI_ASYNC_PREDICT', False))).lower() in ('1', 'true', 'yes')
+    if run_async:
+        job_queue.enqueue(session)
+        return Response({
+            "status": "queued",
+            "data": {
+                "session_id": session.id,
+                "status_url": f"/api/predict/status/{session.id}/"
+            }
+        }, status=status.HTTP_202_ACCEPTED)
+
+    # 2b. AI Prediction + 3. Update DB
+    try:
+        ai_result = run_diagnosis(session)
+    except Overloaded as e:
+        discard_session(session, data.get('upload_id'))
+        return overloaded_response(e)
+    if diagnosis.EXPLANATIONS == 'background':
+        explain_later(session.id)
+
+    return Response({
+        "status": "success",
+        "data": session_payload(session, ai_result)
+    })
+
+def jwt_user(request):
+    # DRF does not run async views: check the bearer token the way its JWTAuthentication would
+    try:
+        auth = JWTAuthentication().authenticate(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    return auth[0] if auth else None
+
+def stream_form(request):
+    # Same inputs as predict/: a multipart form, or a JSON body (an upload_id instead of a file)
+    if request.content_type == 'application/json':
         try:
-            clinical_data = json.loads(raw_clinical_data)
+            data = json.loads(request.body or b'{}')
         except json.JSONDecodeError:
-            clinical_data = {}
-    else:
-        clinical_data = raw_clinical_data
+            data = None
+        return data if isinstance(data, dict) else {}
+    return request.POST
 
-    # 1. Save Session
+def stream_chunk(stage, data, sse):
+    # One stage on the wire: an SSE event, or one NDJSON line
+    if sse: return f"event: {stage}\ndata: {json.dumps(data, default=str)}\n\n"
+    return json.dumps({"stage": stage, "data": data}, default=str) + "\n"
+
+@csrf_exempt
+@require_POST
+async def predict_disease_stream(request):
+    """
+    predict/ with the result sent stage by stage as it is computed: session, ensemble (tabular result),
+    fusion and grad_cam (AE with an MRI), shap, then complete (the predict/ payload). Each stage is stored
+    on the DiagnosticSession before it goes out; a failure mid-stream ends it with an error event and a 'failed'
+    session. Takes a multipart form or JSON (with an upload_id), like predict/. NDJSON by default, Server-Sent
+    Events for `Accept: text/event-stream`. Serve it through core/asgi.py; under WSGI the body arrives in one piece.
+    """
+    user = await sync_to_async(jwt_user)(request)
+    if user is None:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+
+    # 1. Save Session (the body is already spooled, parsing it does not block on the client)
+    data = stream_form(request)
     try:
-        session = DiagnosticSession.objects.create(
-            patient=request.user,
-            disease_type=disease_type,
-            clinical_data=clinical_data,
-            mri_scan=request.FILES.get('mri_scan')
+        session = await sync_to_async(create_session)(
+            user,
+            data.get('disease_type', 'AE'),
+            read_clinical_data(data.get('clinical_data', '{}')),
+            request.FILES.get('mri_scan'),
+            data.get('upload_id')
         )
+    except UploadError as e:
+        return JsonResponse({"status": "error", "message": str(e)}, status=e.status)
     except Exception as e:
-        return Response({"status": "error", "message": str(e)}, status=400)
+        return JsonResponse({"status": "error", "message": str(e)}, status=400)
 
-    # 2. AI Prediction
-    mri_path = session.mri_scan.path if session.mri_scan else None
-    
-    if disease_type == 'PV':
-        ai_result = ai_engine.predict_pv_ensemble(session.clinical_data)
-    else:
-        ai_result = ai_engine.predict_ae_fusion(session.clinical_data, mri_path)
+    # 2. The first stage runs before the response starts, so admission control can still answer 429/503
+    stages = stream_diagnosis(session)
+    try:
+        first = await anext(stages)
+    except Overloaded as e:
+        await sync_to_async(discard_session)(session, data.get('upload_id'))
+        return JsonResponse({"status": "error", "message": str(e), "retry_after": e.retry_after},
+                            status=e.status, headers={'Retry-After': str(e.retry_after)})
+    except Exception as e:
+        # stream_diagnosis() has marked the session failed
+        return JsonResponse({"status": "error", "message": str(e), "session_id": session.id}, status=500)
 
-    # 3. Update DB
-    session.prediction_result = ai_result.get('result')
-    session.confidence_score = ai_result.get('confidence')
-    session.ai_explanation_text = ai_result.get('explanation')
-    
-    if ai_result.get('full_data'):
-        session.clinical_data = ai_result.get('full_data')
-    
-    session.status = 'completed'
-    session.save()
+    sse = 'text/event-stream' in request.headers.get('Accept', '')
+
+    # 3. The remaining stages run in their own task. A client that goes away cancels the response (ASGI), and
+    # events() then cancels and closes that task at once: its admission slots are not left to the garbage collector
+    queue = asyncio.Queue()
+
+    async def run_stages():
+        try:
+            async for event in stages:
+                queue.put_nowait(event)
+        except Exception as e:
+            queue.put_nowait(('error', {"message": str(e), "session_id": session.id}))
+        finally:
+            queue.put_nowait(None)
+
+    stage_task = asyncio.ensure_future(run_stages())
+
+    async def events():
+        try:
+            yield stream_chunk('session', {"session_id": session.id, "status_url": f"/api/predict/status/{session.id}/"}, sse)
+            event = first
+            while event is not None:
+                stage, fields = event
+                if stage == 'complete': fields = await sync_to_async(session_payload)(session, fields)
+                yield stream_chunk(stage, fields, sse)
+                event = await queue.get()
+        finally:
+            stage_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await stage_task
+            await stages.aclose()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream' if sse else 'application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no' # nginx: pass each stage through as it comes
+    return response
+
+def upload_error(e):
+    return Response({"status": "error", "message": str(e)}, status=e.status, headers={'Tus-Resumable': '1.0.0'})
+
+def upload_headers(upload):
+    # tus: where the upload stands, so a client can resume after any failure
+    return {
+        'Tus-Resumable': '1.0.0',
+        'Upload-Offset': str(upload.offset),
+        'Upload-Length': str(upload.length),
+        'Upload-Expires': http_date(upload.expires_at.timestamp()),
+        'Cache-Control': 'no-store',
+    }
+
+def upload_payload(upload):
+    return {
+        "upload_id": str(upload.id),
+        "status": upload.status,
+        "offset": upload.offset,
+        "length": upload.length,
+        "expires_at": upload.expires_at,
+        "upload_url": f"/api/uploads/{upload.id}/",
+    }
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_upload(request):
+    """
+    Opens a resumable MRI upload (tus-style): {"length", "filename", "checksum"} - the optional checksum is the
+    scan's sha256 in hex, or comes with finalize - or a bare Upload-Length header. Chunks then go to PATCH uploads/<id>/,
+    POST uploads/<id>/finalize/ stores the scan, and predict/ takes it as "upload_id".
+    """
+    try:
+        upload = uploads.create(request.user, request.data.get('length') or request.headers.get('Upload-Length'),
+                                request.data.get('filename', ''), request.data.get('checksum', ''))
+    except UploadError as e:
+        return upload_error(e)
+    return Response({"status": "success", "data": upload_payload(upload)}, status=status.HTTP_201_CREATED,
+                    headers={**upload_headers(upload), 'Location': f"/api/uploads/{upload.id}/"})
+
+@api_view(['GET', 'HEAD', 'PATCH', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def upload_detail(request, upload_id):
+    """
+    GET / HEAD: the offset to resume from. PATCH: appends the body (application/offset+octet-stream) at
+    Upload-Offset, streamed to disk, with an optional Upload-Checksum for the chunk. DELETE: abandons the upload.
+    """
+    upload = MriUpload.objects.filter(id=upload_id, owner=request.user).first()
+    if upload is None:
+        return Response({"error": "Not found"}, status=404)
+
+    if request.method == 'DELETE':
+        uploads.discard(upload)
+        return Response(status=status.HTTP_204_NO_CONTENT, headers={'Tus-Resumable': '1.0.0'})
+
+    if request.method == 'PATCH':
+        if request.content_type.split(';')[0].strip() not in ('application/offset+octet-stream', 'application/octet-stream'):
+            return Response({"status": "error", "message": "Chunks must be sent as application/offset+octet-stream"}, status=415)
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return upload_error(UploadError("Upload-Offset header is required"))
+        # The body is read straight off the socket (request.data is never parsed)
+        try:
+            with span('upload_chunk'):
+                uploads.append(upload, offset, request.stream, int(request.META.get('CONTENT_LENGTH') or 0),
+                               request.headers.get('Upload-Checksum', ''))
+        except UploadError as e:
+            return upload_error(e)
+        return Response(status=status.HTTP_204_NO_CONTENT, headers=upload_headers(upload))
+
+    return Response({"status": "success", "data": upload_payload(upload)}, headers=upload_headers(upload))
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def finalize_upload(request, upload_id):
+    """
+    Checks the complete scan against its sha256 ("checksum" here or at creation, if any) and moves it into the MRI store.
+    """
+    upload = MriUpload.objects.filter(id=upload_id, owner=request.user).first()
+    if upload is None:
+        return Response({"error": "Not found"}, status=404)
+    try:
+        with span('upload_finalize'):
+            uploads.finalize(upload, request.data.get('checksum', ''))
+    except UploadError as e:
+        return upload_error(e)
+    return Response({
+        "status": "success",
+        "data": {**upload_payload(upload), "sha256": upload.blob.sha256, "mri_scan": upload.blob.file.url}
+    }, headers=upload_headers(upload))
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@debug_timings
+def screen_patient(request):
+    """
+    Screens clinical data for AE and PV in one ensemble pass. Nothing is persisted.
+    Optional "tier": 'full' (stacked ensemble) or 'fast' (distilled model), default AI_MODEL_TIER.
+    """
+    clinical_data = request.data.get('clinical_data', {})
+    if isinstance(clinical_data, str):
+        try:
+            clinical_data = json.loads(clinical_data)
+        except json.JSONDecodeError:
+            clinical_data = None
+    if not isinstance(clinical_data, dict):
+        return Response({"status": "error", "message": "clinical_data must be a JSON object"}, status=400)
+
+    tier = request.data.get('tier') or None
+    if tier is not None and tier not in MODEL_TIERS:
+        return Response({"status": "error", "message": f"tier must be one of {', '.join(MODEL_TIERS)}"}, status=400)
+
+    try:
+        with span('predict', disease='ALL'):
+            ai_result = get_engine().predict_all(clinical_data, tier=tier)
+    except Overloaded as e:
+        return overloaded_response(e)
 
     return Response({
         "status": "success",
         "data": {
-            **DiagnosticSessionSerializer(session).data,
-            "grad_cam_url": ai_result.get('grad_cam'),
-            "shap_features": ai_result.get('shap_features')
+            "result": ai_result['result'],
+            "confidence": ai_result['confidence'],
+            "scores": ai_result['scores'],
+            "screening": ai_result['screening'],
+            "explanation": ai_result['explanation'],
+            "shap_features": ai_result['shap_features'],
+            "tier": ai_result['tier'],
         }
     })
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_prediction_status(request, session_id):
+    try:
+        session = DiagnosticSession.objects.select_related('job').get(id=session_id)
+    except DiagnosticSession.DoesNotExist:
+        return Response({"error": "Not found"}, status=404)
+    if session.patient != request.user and not request.user.is_doctor:
+        return Response({"error": "Not found"}, status=404)
+
+    job = getattr(session, 'job', None)
+    body = {
+        "session_id": session.id,
+        "status": session.status,
+        "job_status": job.status if job else None,
+        "stage": job.stage if job else None,
+        "attempts": job.attempts if job else 0,
+    }
+    if job:
+        body["queue_position"] = (
+            InferenceJob.objects.filter(status='queued', created_at__lt=job.created_at).count() + 1
+            if job.status == 'queued' else 0
+        )
+        if job.status == 'failed': body["error"] = job.error
+    if session.status == 'failed' and "error" not in body:
+        body["error"] = "The analysis failed"
+
+    if session.status not in ('pending', 'failed'):
+        body["data"] = session_payload(session, job.result if job else {})
+    return Response(body)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_patient_dashboard_stats(request):
@@ -480,7 +809,8 @@ def book_appointment(request):
         return Response({"status": "success", "message": "Appointment booked", "roomId": room_id})
     except User.DoesNotExist:
         return Response({"error": "Doctor not found"}, status=404)
-# ... [END OF FILE] ...@api_view(['GET'])
+# ... [END OF FILE] ...
+@api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def generate_pdf_report(request, session_id):
     try:
@@ -539,12 +869,13 @@ def generate_pdf_report(request, session_id):
             "status": session.status.upper()
         }
         
-        # Handle GradCAM only for AE
+        # Handle GradCAM only for AE (the stored overlay; a deferred one is queued, not drawn in this request)
         if session.disease_type == 'AE' and session.mri_scan:
-             filename = f"gradcam_{os.path.basename(session.mri_scan.name)}"
-             full_path = os.path.join(settings.MEDIA_ROOT, 'grad_cam', filename)
-             if os.path.exists(full_path):
-                 context['grad_cam_path'] = full_path
+             context['grad_cam_pending'] = request_explanations(session)
+             if session.grad_cam_url.startswith(settings.MEDIA_URL):
+                 full_path = os.path.join(settings.MEDIA_ROOT, session.grad_cam_url[len(settings.MEDIA_URL):])
+                 if os.path.exists(full_path):
+                     context['grad_cam_path'] = full_path
 
         template_path = 'report_template.html'
         template = get_template(template_path)
@@ -552,6 +883,7 @@ def generate_pdf_report(request, session_id):
         
         response = HttpResponse(content_type='application/pdf')
         response['Content-Disposition'] = f'attachment; filename="Report_{session_id}.pdf"'
+        from xhtml2pdf import pisa
         pisa_status = pisa.CreatePDF(html, dest=response)
         
         if pisa_status.err: return Response({"error": "PDF generation failed"}, status=500)
@@ -570,10 +902,9 @@ def get_doctor_patients(request):
     sessions = DiagnosticSession.objects.all().order_by('-created_at')
     data = []
     for s in sessions:
+        # Stored explanations only: the list does not compute them (the session detail does)
         s_data = DiagnosticSessionSerializer(s).data
-        if s.disease_type == 'AE' and s.mri_scan:
-            gradcam_filename = f"gradcam_{os.path.basename(s.mri_scan.name)}"
-            s_data['grad_cam_url'] = f"/media/grad_cam/{gradcam_filename}"
+        s_data['grad_cam_url'] = s.grad_cam_url or None
         data.append(s_data)
     return Response(data)
 
@@ -582,13 +913,49 @@ def get_doctor_patients(request):
 def get_session_detail(request, session_id):
     try:
         session = DiagnosticSession.objects.get(id=session_id)
-        data = DiagnosticSessionSerializer(session).data
-        if session.disease_type == 'AE' and session.mri_scan:
-            gradcam_filename = f"gradcam_{os.path.basename(session.mri_scan.name)}"
-            data['grad_cam_url'] = f"/media/grad_cam/{gradcam_filename}"
-        return Response(data)
     except DiagnosticSession.DoesNotExist:
         return Response({"error": "Not found"}, status=404)
+    # A doctor opening the session is what the deferred explanations wait for: they are queued, and the page
+    # polls while explanation_status is 'pending'
+    if request.user.is_doctor:
+        request_explanations(session)
+    data = DiagnosticSessionSerializer(session).data
+    data['grad_cam_url'] = session.grad_cam_url or None
+    return Response(data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_session_explanations(request, session_id):
+    """
+    SHAP features and Grad-CAM overlay of a session. When AI_EXPLANATIONS deferred them, the first request
+    queues them on the background explainer and answers 202 (with Retry-After) until they are stored.
+    """
+    try:
+        session = DiagnosticSession.objects.get(id=session_id)
+    except DiagnosticSession.DoesNotExist:
+        return Response({"error": "Not found"}, status=404)
+    if session.patient != request.user and not request.user.is_doctor:
+        return Response({"error": "Not found"}, status=404)
+    if session.status == 'pending':
+        return Response({"error": "The result is not ready yet"}, status=409)
+    if session.status == 'failed':
+        return Response({"error": "The analysis failed, there is nothing to explain"}, status=409)
+
+    if request_explanations(session):
+        return Response({
+            "status": "pending",
+            "data": {"session_id": session.id, "explanation_status": "pending"}
+        }, status=status.HTTP_202_ACCEPTED, headers={'Retry-After': '2'})
+
+    return Response({
+        "status": "success",
+        "data": {
+            "session_id": session.id,
+            "explanation_status": session.explanation_status or 'ready',
+            "grad_cam_url": session.grad_cam_url or None,
+            "shap_features": session.shap_features,
+        }
+    })
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -605,6 +972,39 @@ def verify_diagnosis(request, session_id):
     session.save()
     return Response({"status": "success", "message": "Diagnosis verified"})
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def score_session_mri(request, session_id):
+    """
+    Scores an MRI the cascade skipped (the tabular ensemble had already decided the AE result), or that the CNN
+    could not score at prediction time.
+    """
+    if not request.user.is_doctor:
+        return Response({"error": "Only doctors can request MRI scoring"}, status=403)
+    try:
+        session = DiagnosticSession.objects.get(id=session_id)
+    except DiagnosticSession.DoesNotExist:
+        return Response({"error": "Session not found"}, status=404)
+    if not session.mri_scan or session.cnn_status not in ('scored', *UNSCORED):
+        return Response({"error": "This session has no AE scan to score"}, status=400)
+
+    grad_cam_url = None
+    if session.cnn_status in UNSCORED:
+        try:
+            grad_cam_url = score_skipped_mri(session)
+        except Overloaded as e:
+            return overloaded_response(e)
+        except Exception as e:
+            return Response({"status": "error", "message": str(e)}, status=503)
+    else:
+        ensure_explanations(session)
+        grad_cam_url = session.grad_cam_url or None
+
+    return Response({
+        "status": "success",
+        "data": {**DiagnosticSessionSerializer(session).data, "grad_cam_url": grad_cam_url}
+    })
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_doctor_appointments(request):
@@ -791,4 +1191,94 @@ def submit_contact_query(request):
     if serializer.is_valid():
         serializer.save()
         return Response({"status": "success", "message": "Message sent successfully!"})
-    return Response(serializer.errors, status=400)
\ No newline at end of file
+    return Response(serializer.errors, status=400)
+
+# ==========================================
+# 7. SYSTEM / OPERATIONS
+# ==========================================
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_worker_memory(request):
+    # Per-process memory of the worker serving this request; USS well below RSS means the models are shared
+    return Response({
+        "memory": process_memory(),
+        "engine": get_engine().describe()
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def get_model_version(request):
+    # Model version this worker serves and the state of its last hot reload (per process, like the metrics)
+    return Response(reload_status())
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def reload_models(request):
+    """
+    Reloads ml_models in the background and swaps the new set in without interrupting running requests.
+    "force": reload even if the content is unchanged; "wait": answer once the reload has finished.
+    Only the worker that serves this request reloads; the others pick up changed files on their own.
+    """
+    flag = lambda name: str(request.data.get(name, '')).lower() in ('1', 'true', 'yes')
+    if not reload_engine(force=flag('force'), wait=flag('wait')):
+        return Response({"status": "error", "message": "A reload is already running"}, status=409)
+    state = reload_status()
+    if state['state'] == 'loading':
+        return Response({"status": "reloading", **state}, status=status.HTTP_202_ACCEPTED)
+    return Response({"status": "failed" if state['state'] == 'failed' else "success", **state},
+                    status=500 if state['state'] == 'failed' else 200)
+
+@require_GET
+def metrics(request):
+    # Prometheus scrape target (plain Django view: a scraper's bearer token is not a JWT).
+    # Counters are per process; scrape every worker, or run one worker per metrics target.
+    # With AI_METRICS_TOKEN set, scrapers present it; without one, only admins (staff JWT or admin session) get in.
+    token = getattr(settings, 'AI_METRICS_TOKEN', '')
+    if token:
+        allowed = request.headers.get('Authorization') == f"Bearer {token}"
+    else:
+        user = request.user if request.user.is_authenticated else jwt_user(request)
+        allowed = user is not None and user.is_staff
+    if not allowed:
+        return HttpResponse(status=401)
+
+    engine = get_engine().describe()
+    readiness = get_engine().readiness()
+    memory = process_memory()
+    cache = engine['result_cache']
+    admission = get_governor().stats()
+    gauges = {
+        'immunoai_ready': [({}, int(readiness['ready']))],
+        'immunoai_model_version_info': [({'version': engine['version']}, 1)],
+        'immunoai_model_family_loaded': [({'family': f}, 1) for f in engine['loaded']],
+        'immunoai_model_load_seconds': [({'model': m}, s) for m, s in sorted(readiness['model_load_seconds'].items())],
+        'immunoai_inference_active': [({'family': f}, s['active']) for f, s in admission.items()],
+        'immunoai_inference_queue_depth': [({'family': f}, s['waiting']) for f, s in admission.items()],
+        'immunoai_inference_concurrency_limit': [({'family': f}, s['limit']) for f, s in admission.items()],
+        'immunoai_inference_threads': [({'library': k}, v) for k, v in threads_in_use().items() if v is not None],
+        'immunoai_result_cache_entries': [({}, cache['entries'])],
+        'immunoai_result_cache_hits': [({}, cache['hits'])],
+        'immunoai_result_cache_misses': [({}, cache['misses'])],
+        'immunoai_process_memory_bytes': [
+            ({'kind': key[:-3]}, int(value * 1024 * 1024)) for key, value in memory.items() if key.endswith('_mb')
+        ],
+    }
+    return HttpResponse(render_prometheus(gauges), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@require_GET
+def health_live(request):
+    # Liveness: the process answers requests; model state is the readiness probe's business
+    return JsonResponse({"status": "alive", "pid": os.getpid()})
+
+@require_GET
+def health_ready(request):
+    # Readiness for load balancers: 503 until this worker's models are loaded and warm.
+    # The first probe starts the warm-up if nothing else has (AI_WARMUP off, or a worker forked without it).
+    engine = get_engine()
+    engine.start_warmup()
+    report = engine.readiness()
+    report["pid"] = os.getpid()
+    response = JsonResponse(report, status=200 if report['ready'] else 503)
+    if report['warmup']['state'] == 'running': response['Retry-After'] = '5'
+    return response
@@ -14,3 +14,14 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_asgi_application()
+
+# Load the models before the server forks its workers (see AI_PRELOAD_ENGINE)
+from django.conf import settings
+if settings.AI_PRELOAD_ENGINE:
+    from api.services.ai_engine import preload_engine
+    preload_engine()
+
+# Warm the models in the background; api/health/ready/ answers 503 until that is done (see AI_WARMUP)
+if settings.AI_WARMUP:
+    from api.services.ai_engine import start_warmup
+    start_warmup(after_fork=settings.AI_PRELOAD_ENGINE)
@@ -124,6 +124,10 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
     "http://127.0.0.1:5173",
 ]
+# Resumable uploads speak tus headers
+from corsheaders.defaults import default_headers
+CORS_ALLOW_HEADERS = (*default_headers, 'tus-resumable', 'upload-length', 'upload-offset', 'upload-checksum')
+CORS_EXPOSE_HEADERS = ['Location', 'Tus-Resumable', 'Upload-Offset', 'Upload-Length', 'Upload-Expires', 'Retry-After']
 
 # Media files (Images/PDFs)
 import os
@@ -144,4 +148,97 @@ from datetime import timedelta
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=1), # Keep logged in for 1 day for dev
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
-}
\ No newline at end of file
+}
+
+# --- AI ENGINE ---
+# Tree ensembles: 'compiled' (NumPy node tables), 'native' (booster APIs) or 'verify' (both, compared per call)
+AI_TREE_BACKEND = 'compiled'
+# Async predictions: POST predict/ with async=1 (or this default) queues the session for
+# `manage.py run_inference_workers` and returns 202 instead of running the models in the request
+AI_ASYNC_PREDICT = False
+AI_INFERENCE_WORKERS = 2
+# Load every model in the WSGI/ASGI parent so forked workers (gunicorn --preload, uwsgi without lazy-apps)
+# share the weights copy-on-write. Off by default: runserver imports wsgi.py too.
+AI_PRELOAD_ENGINE = os.environ.get('AI_PRELOAD_ENGINE', '0') == '1'
+# Warm-up on boot: synthetic inputs through every loaded model in each worker (in the background, after the fork
+# when preloading). Off by default so runserver and management commands stay lazy; without it the first readiness
+# probe starts the warm-up. api/health/ready/ returns 503 until it finishes; api/health/live/ only checks the process.
+AI_WARMUP = os.environ.get('AI_WARMUP', '0') == '1'
+# Hot reload: workers re-stat ml_models every few seconds; a changed artifact set is hashed, loaded and warmed in the
+# background, then swapped in atomically. POST api/system/models/reload/ (admin) forces one. Every worker reloads on
+# its own into a private engine: with AI_PRELOAD_ENGINE that gives up the shared copy-on-write weights and holds two
+# engines per worker during the swap. Off by default; with preloading, restart the workers to deploy new models.
+AI_MODEL_AUTO_RELOAD = os.environ.get('AI_MODEL_AUTO_RELOAD', '0') == '1'
+AI_MODEL_RELOAD_SETTLE = 2 # seconds the files must stay unchanged before loading (multi-file deploys)
+# Read compiled forests / joblib arrays through read-only memory maps (shared page cache across processes)
+AI_MMAP_MODELS = True
+# Memoized prediction results: repeat submissions of the same form (and MRI content) skip the models.
+# The cache belongs to the engine and its keys carry the engine's model version, so it only ever serves results of
+# the models that engine has loaded. New files in ml_models reach it through a reload (AI_MODEL_AUTO_RELOAD,
+# POST api/system/models/reload/ or a worker restart), which brings a new engine with an empty cache.
+AI_RESULT_CACHE_SIZE = 1024
+AI_RESULT_CACHE_TTL = 600 # seconds
+# Shared thread pool that overlaps the base models, the MRI branch and SHAP inside one prediction (0 = run inline)
+AI_STAGE_THREADS = min(4, (os.cpu_count() or 1) - 1) # the request thread is the extra one
+# The CNN stage (micro-batcher wait + forward pass) runs on its own pool so it never holds up tabular stages
+AI_CNN_STAGE_THREADS = 8
+# CNN micro-batching: concurrent MRI scans share one forward pass (batch size 1 disables it)
+AI_CNN_BATCH_SIZE = 8
+AI_CNN_BATCH_WAIT_MS = 5
+# CNN build on CPU: 'eager' (fp32), 'torchscript', 'channels_last', 'int8_dynamic', 'int8_static',
+# or 'auto' = the fastest variant within tolerance from `manage.py build_cnn_backends`. Grad-CAM always runs eager fp32.
+AI_CNN_BACKEND = 'eager'
+# Decoded MRI scans (224x224 RGB, ~150 KB each) kept per process, keyed by file content (0 disables); each is
+# normalized per request into a preallocated per-thread buffer
+AI_MRI_CACHE_SIZE = 32
+# CNN probability per scan content (sha256) and CNN build, in memory; the MRI store keeps a copy per scan
+AI_SCAN_CACHE_SIZE = 4096
+# Cascade: skip the CNN + Grad-CAM for AE scans when the calibrated tabular score alone fixes the result
+# (> 5/7 or <= 2/7); the session records the skip and doctors can score the scan on demand
+AI_CNN_CASCADE = False
+# Early exit: LightGBM first, full stack only when its probability lies inside this band, e.g. (0.2, 0.8);
+# validate a band with `manage.py benchmark_early_exit` before enabling it. None = always the full stack.
+AI_EARLY_EXIT_BAND = None
+# Model tier when a request does not pick one: 'full' (stacked ensemble) or 'fast' (one booster distilled from it by
+# `manage.py distill_ensemble`; served by the full stack until that has run). Screening requests may pass "tier".
+AI_MODEL_TIER = 'full'
+# Share of fast-tier rows the full stack re-scores in the background (agreement metrics only, 0 = off)
+AI_FAST_VERIFY_RATE = 0.0
+# Admission control per process: at most N requests run per model family, AI_ADMISSION_QUEUE more wait up to
+# AI_ADMISSION_TIMEOUT seconds (then 503), beyond that predict/ answers 429; both carry Retry-After. 0 = unlimited.
+AI_MAX_CONCURRENCY = {'tabular': 8, 'cnn': 8}
+AI_ADMISSION_QUEUE = 32
+AI_ADMISSION_TIMEOUT = 10 # seconds
+# Torch / booster intra-op threads per call (0 = cores / (server processes x family concurrency))
+AI_SERVER_PROCESSES = int(os.environ.get('WEB_CONCURRENCY', '1'))
+AI_TORCH_THREADS = 0
+AI_BOOSTER_THREADS = 0
+# SHAP + Grad-CAM for predict/: 'inline' (in the response), 'on_demand' (computed and stored the first time the
+# session is opened, see predict/explanations/<id>/) or 'background' (right after the result, off the request path)
+AI_EXPLANATIONS = 'on_demand'
+# Content-addressed MRI store under MEDIA_ROOT/<AI_MRI_STORE_DIR>/ab/<sha256>.<ext>: identical uploads share one
+# file. `manage.py gc_mri_store` deletes scans no session has referenced for AI_MRI_STORE_GRACE seconds.
+AI_MRI_STORE_DIR = 'mri'
+AI_MRI_STORE_GRACE = 24 * 3600
+# Resumable MRI uploads (uploads/): chunks stream to AI_UPLOAD_DIR, finalized scans move into the MRI store and
+# predict/ takes them by upload_id. Unattached uploads expire after AI_UPLOAD_EXPIRY seconds (gc_mri_store).
+AI_UPLOAD_DIR = os.path.join(BASE_DIR, 'upload_parts')
+AI_UPLOAD_MAX_SIZE = 200 * 1024 * 1024 # bytes per scan
+AI_UPLOAD_MAX_CHUNK = 16 * 1024 * 1024 # bytes per PATCH
+AI_UPLOAD_EXPIRY = 24 * 3600
+# Stage timings go to the metrics endpoint (api/metrics/); per-request pipeline lines are DEBUG-level logs
+AI_METRICS_TOKEN = os.environ.get('AI_METRICS_TOKEN', '') # Bearer token for scrapers; unset = admin users only
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'api': {'handlers': ['console'], 'level': os.environ.get('AI_LOG_LEVEL', 'INFO'), 'propagate': False},
+    },
+}
@@ -26,11 +26,27 @@ const DoctorPatientDetail = () => {
   const [isSubmitting, setIsSubmitting] = useState(false);
 
   useEffect(() => {
+    let timer;
+    let cancelled = false;
+    // Deferred explanations are computed in the background: refresh until they are stored
+    const pollExplanations = (data) => {
+      if (!cancelled && data.explanation_status === "pending")
+        timer = setTimeout(refresh, 3000);
+    };
+    const refresh = async () => {
+      try {
+        const response = await api.get(`/doctor/session/${id}/`);
+        if (cancelled) return;
+        setSession(response.data);
+        pollExplanations(response.data);
+      } catch (e) {}
+    };
     const loadCase = async () => {
       try {
         const response = await api.get(`/doctor/session/${id}/`);
         setSession(response.data);
         setDoctorNotes(response.data.doctor_notes || "");
+        pollExplanations(response.data);
       } catch (e) {
         alert("Failed to load case details.");
       } finally {
@@ -38,6 +54,10 @@ const DoctorPatientDetail = () => {
       }
     };
     loadCase();
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
   }, [id]);
 
   const handleFinalize = async () => {
@@ -126,7 +126,9 @@ const DoctorPatients = () => {
                             ? "bg-blue-100 text-blue-700"
                             : session.status === "verified"
                               ? "bg-green-100 text-green-700"
-                              : "bg-gray-100"
+                              : session.status === "failed"
+                                ? "bg-red-100 text-red-700"
+                                : "bg-gray-100"
                         }`}
                       >
                         {session.status}
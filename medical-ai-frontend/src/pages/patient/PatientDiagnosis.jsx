@@ -1,7 +1,7 @@
 import React, { useState } from "react";
 import { UploadCloud, Activity, ArrowRight, Loader } from "lucide-react";
 import { Link, useNavigate } from "react-router-dom";
-import { submitDiagnosis } from "../../services/api";
+import { submitDiagnosis, uploadScan } from "../../services/api";
 
 const PatientDiagnosis = () => {
   const [step, setStep] = useState(1);
@@ -66,11 +66,10 @@ const PatientDiagnosis = () => {
 
     formData.append("clinical_data", JSON.stringify(processedData));
 
-    if (mriFile) {
-      formData.append("mri_scan", mriFile);
-    }
-
     try {
+      if (mriFile) {
+        formData.append("upload_id", await uploadScan(mriFile));
+      }
       const result = await submitDiagnosis(formData);
       navigate("/patient/results", { state: { result: result.data } });
     } catch (error) {
@@ -133,7 +133,8 @@ const PatientHistory = () => {
                         className={`px-2 py-1 rounded text-xs font-bold border ${
                           session.status === "verified"
                             ? "bg-green-50 border-green-200 text-green-700"
-                            : session.status === "rejected"
+                            : session.status === "rejected" ||
+                                session.status === "failed"
                               ? "bg-red-50 border-red-200 text-red-700"
                               : "bg-gray-50 border-gray-200 text-gray-600"
                         }`}
@@ -1,4 +1,4 @@
-import React from "react";
+import React, { useState, useEffect } from "react";
 import {
   Download,
   Share2,
@@ -10,10 +10,33 @@ import {
   ClipboardList,
 } from "lucide-react";
 import { Link, useLocation, Navigate } from "react-router-dom";
+import { api } from "../../services/api";
 
 const PatientResults = () => {
   const location = useLocation();
   const resultData = location.state?.result;
+  const [explanations, setExplanations] = useState(null);
+
+  // SHAP + Grad-CAM are queued on first view when the backend defers them: poll until they are stored
+  useEffect(() => {
+    if (resultData?.explanation_status !== "pending") return;
+    let timer;
+    let cancelled = false;
+    const load = () =>
+      api
+        .get(`/predict/explanations/${resultData.id}/`)
+        .then((response) => {
+          if (cancelled) return;
+          if (response.status === 202) timer = setTimeout(load, 2000);
+          else setExplanations(response.data.data);
+        })
+        .catch(() => {});
+    load();
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [resultData]);
 
   if (!resultData) {
     return <Navigate to="/patient/diagnosis" replace />;
@@ -23,8 +46,10 @@ const PatientResults = () => {
   const result = resultData.prediction_result || resultData.result;
   const confidence = resultData.confidence_score || resultData.confidence;
   const explanation = resultData.ai_explanation_text || resultData.explanation;
-  const grad_cam_url = resultData.grad_cam_url || resultData.grad_cam;
-  const shap_features = resultData.shap_features || [];
+  const grad_cam_url =
+    explanations?.grad_cam_url || resultData.grad_cam_url || resultData.grad_cam;
+  const shap_features =
+    explanations?.shap_features || resultData.shap_features || [];
 
   // RAW CLINICAL DATA
   const clinical = resultData.clinical_data || {};
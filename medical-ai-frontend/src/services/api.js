@@ -57,6 +57,51 @@ export const submitDiagnosis = async (formData) => {
   }
 };
 
+// Resumable MRI upload: the scan goes up in chunks, a dropped chunk resumes from the server's offset
+const CHUNK_SIZE = 1024 * 1024;
+
+// Each chunk carries its own sha256 (Upload-Checksum), so only one chunk is ever in memory for hashing.
+// crypto.subtle only exists in secure contexts (HTTPS/localhost); without it the chunks go up unsigned
+const chunkChecksum = async (chunk) => {
+  if (!globalThis.crypto?.subtle) return {};
+  const digest = new Uint8Array(await crypto.subtle.digest("SHA-256", await chunk.arrayBuffer()));
+  return { "Upload-Checksum": `sha256 ${btoa(String.fromCharCode(...digest))}` };
+};
+
+export const uploadScan = async (file, retries = 3) => {
+  const created = await api.post("/uploads/", {
+    length: file.size,
+    filename: file.name,
+  });
+  const uploadId = created.data.data.upload_id;
+
+  let offset = 0;
+  let failures = 0;
+  while (offset < file.size) {
+    const chunk = file.slice(offset, offset + CHUNK_SIZE);
+    try {
+      const response = await api.patch(`/uploads/${uploadId}/`, chunk, {
+        headers: {
+          "Content-Type": "application/offset+octet-stream",
+          "Tus-Resumable": "1.0.0",
+          "Upload-Offset": String(offset),
+          ...(await chunkChecksum(chunk)),
+        },
+      });
+      offset = Number(response.headers["upload-offset"]);
+      failures = 0;
+    } catch (error) {
+      if (++failures > retries) throw error;
+      // The server's offset is the truth: after a failure it says what arrived
+      const status = await api.get(`/uploads/${uploadId}/`);
+      offset = status.data.data.offset;
+    }
+  }
+
+  await api.post(`/uploads/${uploadId}/finalize/`);
+  return uploadId;
+};
+
 // NEW FUNCTIONS
 export const fetchPatientHistory = async () => {
   const response = await api.get("/patient/history/");